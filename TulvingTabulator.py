@@ -1,99 +1,127 @@
 # TulvingTabulator.py -- Tabulating results of Tulving-Watkins tests
 import argparse
-import csv
 import numpy as np
 import pandas as pd
+import tulvingdata as td
 
 class TulvingTabulator:
     #
     datadir = ''
-    DATAFILE_TEMPLATE = 'tw_session_{}.csv'
     # This should really be read from a model description file shared with 'tulvinglib.py'
     # Encoding/Retrievals
     LABELS_ROWS       = [ 'A/AR', 'A/RA', 'R/AR', 'R/RA' ]
     # Lower case: fail, Upper case: pass
     LABELS_COLS       = [ 'ar', 'aR', 'Ar', 'AR' ]
+    # Probes of a batch, 4 pairs
+    BATCH_PROBES      = 8
     # Selecting encodings for data matrices
     ENCODINGS         = {"all": range(32),
                          "A": [ 0, 1, 2, 3,  8,  9, 10, 11, 16, 17, 18, 19, 24, 25, 26, 27 ],
-                         "R": [ 4, 5, 6, 7, 12, 13, 14, 15, 20, 21, 22, 23, 28, 29, 39, 31 ]
+                         "R": [ 4, 5, 6, 7, 12, 13, 14, 15, 20, 21, 22, 23, 28, 29, 30, 31 ]
                          }
     
 
-    def __init__( self, datafiles_dir ):
+    def __init__( self, datafiles_dir, model=None ):
         self.datadir = datafiles_dir
+        self.model   = model
+
+
+    def read_results( self, sessions ):
+        """Session, row and result arrays of all probes of the `sessions', in row order."""
+        df = td.results( self.datadir, columns=['row', 'result'], task='tw', model=self.model,
+                         session=list( sessions ) )
+        df = df.sort_values( ['session', 'row'], kind='stable' )
+        return df.session.to_numpy(), df.row.to_numpy(), df.result.to_numpy( dtype=np.int64 )
+
+
+    def read_latencies( self, sessions ):
+        """Durations of all probes of the `sessions', with their `position'
+        in their batch, as a frame for `tulvingstats.latency_table'.
+        """
+        df = td.results( self.datadir, columns=['row', 'cue_type', 'duration'], task='tw', model=self.model,
+                         session=list( sessions ) )
+        return df.assign( position=df.row % TulvingTabulator.BATCH_PROBES )
+
+
+    def pairs( self, ses, row, res ):
+        """Indices of the second probes of all pairs, with their pair
+        position in the 8-probe batch, 0 to 3, and both results.
+        """
+        snd = np.flatnonzero( 1 == (row % 2) )
+        # The first probe of a pair is the previous row of the same session
+        snd = snd[ snd > 0 ]
+        snd = snd[ (ses[ snd ] == ses[ snd-1 ]) & (row[ snd-1 ] == row[ snd ] - 1) ]
+        return snd, (row[ snd ] // 2) % 4, res[ snd-1 ], res[ snd ]
+
+
+    def data_matrices( self, sessions, encodings=( "all", "A", "R" ) ):
+        """XY and YX data matrices of each encoding and session, as arrays
+        of shape (encodings, sessions, 2, 2), in proportions of the probes
+        of a session.
+        """
+        sessions              = list( dict.fromkeys( sessions ) )
+        ses, row, res         = self.read_results( sessions )
+        snd, pos, first, last = self.pairs( ses, row, res )
+        # Pairs 0 and 2 of a batch probe X then Y, pairs 1 and 3 Y then X
+        cell    = 4*(pos % 2) + 2*(1-first) + (1-last)
+        encoded = np.array( [ np.isin( row[ snd ], TulvingTabulator.ENCODINGS[ encoding ] ) &
+                              np.isin( row[ snd ] - 1, TulvingTabulator.ENCODINGS[ encoding ] )
+                              for encoding in encodings ] ).reshape( len( encodings ), len( snd ) )
+        enc, p  = np.nonzero( encoded )
+        dm      = np.zeros( ( len( encodings ), len( sessions ), 8 ) )
+        np.add.at( dm, ( enc, pd.Index( sessions ).get_indexer( ses[ snd[ p ] ] ), cell[ p ] ), 1. )
+        dm     /= np.array( [ 8 if "all" == encoding else 4 for encoding in encodings ], dtype=float )[ :, None, None ]
+        dm      = dm.reshape( len( encodings ), len( sessions ), 2, 2, 2 )
+        return dm[ :, :, 0 ], dm[ :, :, 1 ]
 
 
     def read_data_matrices_csv( self, sessions, encoding="all" ):
-        dmXY, dmYX = np.zeros( (2, 2), dtype=float ), np.zeros( (2, 2), dtype=float )
-        for ses in sessions:
-            with open( self.datadir + TulvingTabulator.DATAFILE_TEMPLATE.format( ses ) ) as f:
-                csvreader    = csv.DictReader( f, delimiter=',', quotechar="'" )
-                idx = 0
-                xresp, yresp = 0, 0
-                for row in csvreader:
-                    if idx in TulvingTabulator.ENCODINGS[ encoding ]:
-                        if (0 == (idx % 8)) or (4 == (idx % 8)):
-                            xresp = int( row['RESULT'] )
-                        elif (1 == (idx % 8)) or (5 == (idx % 8)):
-                            yresp = int( row['RESULT'] )                        
-                            dmXY[ 1-xresp, 1-yresp ] += 1
-                            xresp, yresp = 0, 0
-                        elif (2 == (idx % 8)) or (6 == (idx % 8)):
-                            yresp = int( row['RESULT'] )
-                        elif (3 == (idx % 8)) or (7 == (idx % 8)):
-                            xresp = int( row['RESULT'] )
-                            dmYX[ 1-yresp, 1-xresp ] += 1
-                            xresp, yresp = 0, 0
-                        else:
-                            pass
-                    idx += 1
-        #
-        tot = (8 if "all" == encoding else 4) * len( sessions )
-        return dmXY/tot, dmYX/tot
+        dmXY, dmYX = self.data_matrices( sessions, [ encoding ] )
+        return dmXY[ 0 ].mean( axis=0 ), dmYX[ 0 ].mean( axis=0 )
 
-    def read_csv( self, sessions ):
-        results = np.zeros( (4, 4), dtype=float )
-        for ses in sessions:
-            with open( self.datadir + TulvingTabulator.DATAFILE_TEMPLATE.format( ses ) ) as f:
-                csvreader    = csv.DictReader( f, delimiter=',', quotechar="'" )
-                idx, batch   = 0, 0
-                aresp, rresp = 0, 0
-                for row in csvreader:
-                    if idx in [ 8*batch + x for x in [ 0, 3, 4, 7 ] ]:
-                        aresp = int( row['RESULT'] )
-                    if idx in [ 8*batch + x for x in [ 1, 2, 5, 6 ] ]:
-                        rresp = int( row['RESULT'] )
-                    #
-                    if 1 == (idx % 2):
-                        row, col = (idx - 8*batch) // 2, aresp + aresp + rresp
-                        # print( f'row: {idx}, batch: {batch}, col:{col}' )
-                        results[ row, col ] += 1.
-                        aresp, rresp = 0, 0
-                    #    
-                    idx += 1
-                    if 0 == (idx % 8):
-                        batch += 1
-                
+    def session_tables( self, sessions ):
+        """Result tables of each session, as an array of shape (sessions, 4, 4)."""
+        sessions              = list( dict.fromkeys( sessions ) )
+        ses, row, res         = self.read_results( sessions )
+        snd, pos, first, last = self.pairs( ses, row, res )
+        # Pairs 0 and 2 of a batch retrieve A then R, pairs 1 and 3 R then A
+        ar                    = 0 == (pos % 2)
+        aresp, rresp          = np.where( ar, first, last ), np.where( ar, last, first )
+        results               = np.zeros( (len( sessions ), 4, 4), dtype=float )
+        np.add.at( results, (pd.Index( sessions ).get_indexer( ses[ snd ] ), pos, aresp + aresp + rresp), 1. )
         return results
 
+    def read_csv( self, sessions ):
+        return self.session_tables( sessions ).sum( axis=0 )
 
-    def trace_mat( self, dmXY, dmYX ):
+
+    def trace_mats( self, dmXY, dmYX ):
+        """Traces of stacked data matrices, (N, 2, 2) XY and YX arrays, as
+        two (N, 3, 3) arrays, and the eqn. 6 LHS and RHS as (N,) arrays.
+        """
+        dmXY, dmYX = np.asarray( dmXY, dtype=float ), np.asarray( dmYX, dtype=float )
         # Equations 1 to 6 from paper
-        xy = (dmXY[1,1] + dmYX[1,1])/2.
-        rxy, ryx  = (1-xy)/(1-dmXY[1,1]), (1-xy)/(1-dmYX[1,1])
-        X  = (dmXY[0,0] + dmXY[0,1])*rxy
-        Y  = (dmYX[0,0] + dmYX[0,1])*ryx
-        xY = dmXY[1,0]*rxy
-        Xy = dmYX[1,0]*ryx
-        eq6l, eq6r = (dmXY[0,0] + dmXY[0,1] + dmXY[1,0]), (dmYX[0,0] + dmYX[0,1] + dmYX[1,0])
+        xy = (dmXY[...,1,1] + dmYX[...,1,1])/2.
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            rxy, ryx  = (1-xy)/(1-dmXY[...,1,1]), (1-xy)/(1-dmYX[...,1,1])
+        X  = (dmXY[...,0,0] + dmXY[...,0,1])*rxy
+        Y  = (dmYX[...,0,0] + dmYX[...,0,1])*ryx
+        xY = dmXY[...,1,0]*rxy
+        Xy = dmYX[...,1,0]*ryx
+        eq6l, eq6r = (dmXY[...,0,0] + dmXY[...,0,1] + dmXY[...,1,0]), (dmYX[...,0,0] + dmYX[...,0,1] + dmYX[...,1,0])
         # Adjust and complete as in text
-        return ([ [X-Xy, Xy, X],
-                  [xY,xy, xY+xy],
-                  [Y, Xy+xy, dmXY[1,1] - dmYX[1,1]] ],
-                [ [Y-xY, Xy, X],
-                  [xY,xy, xY+xy],
-                  [Y, Xy+xy, dmYX[1,1] - dmXY[1,1]] ])
+        tm1 = np.stack( [ np.stack( [ X-Xy, Xy, X ], axis=-1 ),
+                          np.stack( [ xY, xy, xY+xy ], axis=-1 ),
+                          np.stack( [ Y, Xy+xy, dmXY[...,1,1] - dmYX[...,1,1] ], axis=-1 ) ], axis=-2 )
+        tm2 = np.stack( [ np.stack( [ Y-xY, Xy, X ], axis=-1 ),
+                          np.stack( [ xY, xy, xY+xy ], axis=-1 ),
+                          np.stack( [ Y, Xy+xy, dmYX[...,1,1] - dmXY[...,1,1] ], axis=-1 ) ], axis=-2 )
+        return tm1, tm2, eq6l, eq6r
+
+
+    def trace_mat( self, dmXY, dmYX ):
+        tm1, tm2, _, _ = self.trace_mats( dmXY, dmYX )
+        return tm1, tm2
 
 
     # def trace_adjust( self, mat, x, y ):
@@ -0,0 +1,64 @@
+# test_tulving_test.py -- Blocks of probes fitting in the context window
+import importlib.util
+import unittest
+#
+import tulvingbackend as tb
+
+TBR   = [ 'egg', 'hen', 'owl' ]
+CUES  = [ ( 'egg', 'egg', 'copy' ), ( 'hen', 'fowl', 'ncaw' ), ( 'owl', 'towel', 'rhym' ) ]
+MAX   = 4
+
+
+def count( text ):
+    "One token per word."
+    return len( text.split() )
+
+
+
+class TestFitProbes( unittest.TestCase ):
+
+    def test_fit_probes( self ):
+        self.assertEqual( tb.fit_probes( 10, [ 5, 5, 5 ], 25 ), 3 )
+        self.assertEqual( tb.fit_probes( 10, [ 5, 5, 5 ], 24 ), 2 )
+        self.assertEqual( tb.fit_probes( 10, [ 5, 5, 5 ], 15 ), 1 )
+        self.assertEqual( tb.fit_probes( 10, [ 5, 5, 5 ], 14 ), 0 )
+        self.assertEqual( tb.fit_probes( 10, [], 25 ), 0 )
+        # The prefix alone does not fit
+        self.assertEqual( tb.fit_probes( 10, [ 5 ], 9 ), 0 )
+        # Whole periods only
+        self.assertEqual( tb.fit_probes( 10, [ 5, 5, 5 ], 25, period=2 ), 2 )
+        self.assertEqual( tb.fit_probes( 10, [ 5, 5, 5 ], 19, period=2 ), 0 )
+
+
+
+@unittest.skipUnless( importlib.util.find_spec( 'llm' ), 'requires llm' )
+class TestBlockSize( unittest.TestCase ):
+
+    def test_reco( self ):
+        import tulving_test as tt
+        prefix = count( tt.prompt_memo( TBR ) ) + MAX
+        probe  = count( tt.TEMPL_RECO.format( 'egg' ) ) + MAX
+        for n in range( 1, 4 ):
+            self.assertEqual( tt.block_size( 'reco', TBR, CUES, CUES, prefix + n*probe, count, MAX ), n )
+            self.assertEqual( tt.block_size( 'reco', TBR, CUES, CUES, prefix + (n + 1)*probe - 1, count, MAX ), n )
+        with self.assertRaisesRegex( tb.ContextError, 'No recognition probe' ):
+            tt.block_size( 'reco', TBR, CUES, CUES, prefix + probe - 1, count, MAX )
+
+
+    def test_reca( self ):
+        import tulving_test as tt
+        prefix = count( tt.prompt_memo( TBR ) ) + MAX
+        # The costliest first prompt, then the costliest follow-ups
+        first  = max( count( tt.TEMPL_RECA.format( ex1=CUES[0][1], an1=CUES[0][0], ex2=CUES[1][1], an2=CUES[1][0],
+                                                   ex3=CUES[2][1], an3=CUES[2][0], cue=cue ) ) for w, cue, t in CUES )
+        follow = count( tt.TEMPL_RECA_FOLLOWUP.format( cue='egg' ) ) + MAX
+        n_ctx  = prefix + first + MAX
+        self.assertEqual( tt.block_size( 'reca', TBR, CUES, CUES, n_ctx, count, MAX ), 1 )
+        self.assertEqual( tt.block_size( 'reca', TBR, CUES, CUES, n_ctx + follow, count, MAX ), 2 )
+        self.assertEqual( tt.block_size( 'reca', TBR, CUES, CUES, n_ctx + 10*follow, count, MAX ), len( CUES ) )
+        with self.assertRaisesRegex( tb.ContextError, 'No recall probe' ):
+            tt.block_size( 'reca', TBR, CUES, CUES, n_ctx - 1, count, MAX )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# test_tulvingcache.py -- Storing, evicting and keying cached responses
+import os
+import tempfile
+import unittest
+#
+import tulvingbackend as tb
+import tulvingcache as tc
+
+
+class TestResponseCache( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fn  = os.path.join( self.tmp.name, 'responses.sqlite' )
+
+
+    def tearDown( self ):
+        self.tmp.cleanup()
+
+
+    def test_get_put( self ):
+        cache = tc.ResponseCache( self.fn )
+        try:
+            self.assertIsNone( cache.get( 'a' ) )
+            cache.put( 'a', ' YES', 1250., 40, 2 )
+            txt = cache.get( 'a' )
+            self.assertEqual( txt, ' YES' )
+            self.assertEqual( ( txt.duration, txt.prompt_tokens, txt.response_tokens ), ( 1250., 40, 2 ) )
+            # A replaced response no longer counts in the total
+            cache.put( 'a', ' NO', 900. )
+            self.assertEqual( cache.get( 'a' ), ' NO' )
+            self.assertEqual( cache.total, len( 'a' ) + len( ' NO' ) + 32 )
+        finally:
+            cache.close()
+        # Responses persist across opens
+        cache = tc.ResponseCache( self.fn )
+        try:
+            self.assertEqual( cache.get( 'a' ), ' NO' )
+        finally:
+            cache.close()
+
+
+    def test_evict( self ):
+        # Responses of 100 bytes, room for two
+        cache = tc.ResponseCache( self.fn, max_bytes=250 )
+        try:
+            cache.put( 'a', 'x'*67, 0. )
+            cache.put( 'b', 'x'*67, 0. )
+            # `a' is now used after `b', which is evicted first
+            self.assertEqual( cache.get( 'a' ), 'x'*67 )
+            cache.put( 'c', 'x'*67, 0. )
+            self.assertIsNone( cache.get( 'b' ) )
+            self.assertEqual( [ cache.get( key ) for key in 'ac' ], [ 'x'*67 ]*2 )
+            self.assertEqual( cache.total, 200 )
+        finally:
+            cache.close()
+
+
+    def test_key( self ):
+        backend         = tb.FakeBackend()
+        backend.options = lambda: {}
+        cached          = tc.CachedBackend( backend, tc.ResponseCache( self.fn ) )
+        try:
+            keys = [ cached.key( 'prompt', [ 'Is egg in the list?' ] ),
+                     cached.key( 'prompt', [ 'Is egg in the list?' ], max_tokens=8 ),
+                     cached.key( 'prompt', [ 'Is egg in the list?' ], max_tokens=16 ),
+                     cached.key( 'prompt', [ 'Is egg in the list?' ], stop=tb.StopOnWords( [ 'YES', 'NO' ] ) ),
+                     cached.key( 'prompt', [ 'Is hen in the list?' ] ) ]
+            self.assertEqual( len( set( keys ) ), len( keys ) )
+            self.assertEqual( keys[1], cached.key( 'prompt', [ 'Is egg in the list?' ], max_tokens=8 ) )
+            self.assertEqual( keys[3], cached.key( 'prompt', [ 'Is egg in the list?' ],
+                                                   stop=tb.StopOnWords( [ 'YES', 'NO' ] ) ) )
+            # Stopped responses are not replayed for full ones
+            self.assertEqual( cached.prompt( 'egg, hen. egg', max_tokens=1 ), ' YES' )
+            self.assertIsNone( cached.cache.get( cached.key( 'prompt', [ 'egg, hen. egg' ] ) ) )
+            self.assertEqual( cached.prompt( 'egg, hen. egg', max_tokens=1 ), ' YES' )
+            self.assertTrue( cached.usage.get( 'cached' ) )
+        finally:
+            tc.close( cached )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# test_tulvingdata.py -- Reading back the result files of the sinks
+import importlib.util
+import os
+import tempfile
+import unittest
+#
+import tulvingdata as td
+import tulvingsink as tsk
+
+COLUMNS = [ 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
+
+
+class TestRoundTrip( unittest.TestCase ):
+
+    def test_csv_sink( self ):
+        responses = [ "The answer is 'egg', of course.\nExplanation: eggs, hens.",
+                      ' None',
+                      'He said "star", then \'star\'\r\nagain, twice.' ]
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join( tmp, 'merge_reca_imm_mistral_session_1.csv' )
+            # Two blocks appended to the same session file
+            with tsk.open_sink( fn, COLUMNS ) as sink:
+                sink.write( ( 'egg', 1, 1, 'ovum', responses[0], 'ncaw', 12.5 ) )
+                sink.write( ( 'None', 0, 0, 'jazz', responses[1], 'none', 3.25 ) )
+            with tsk.open_sink( fn, COLUMNS ) as sink:
+                sink.write( ( 'star', 0, None, 'star', responses[2], 'copy', 48.75 ) )
+            with self.assertNoLogs( level='WARNING' ):
+                df = td.read_result_file( fn )
+        self.assertEqual( df[ 'response' ].tolist(), responses )
+        self.assertEqual( df[ 'tbrword' ].tolist(), [ 'egg', 'None', 'star' ] )
+        self.assertEqual( df[ 'result' ].tolist(), [ 1, 0, 0 ] )
+        self.assertTrue( df[ 'fp' ].isna().tolist() == [ False, False, True ] )
+        self.assertEqual( df[ 'duration' ].tolist(), [ 12.5, 3.25, 48.75 ] )
+        self.assertEqual( df[ 'row' ].tolist(), [ 0, 1, 2 ] )
+        self.assertEqual( ( df[ 'task' ].iloc[0], df[ 'session' ].iloc[0] ), ( 'reca', 1 ) )
+
+
+    @unittest.skipUnless( importlib.util.find_spec( 'pyarrow' ), 'requires pyarrow' )
+    def test_parquet_sink( self ):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join( tmp, 'merge_reco_del_mistral_session_2.parquet' )
+            # A first block without false positives, then a second block
+            with tsk.open_sink( fn, COLUMNS ) as sink:
+                sink.write( ( 'egg', 1, None, 'egg', ' Yes', 'copy', 12.5 ) )
+            with tsk.open_sink( fn, COLUMNS ) as sink:
+                sink.write( ( 'hen', 0, 1, 'fowl', ' Yes, "hen".', 'ncaw', 3.25 ) )
+            df = td.read_result_file( fn )
+            self.assertEqual( os.listdir( tmp ), [ os.path.basename( fn ) ] )
+        self.assertEqual( df[ 'tbrword' ].tolist(), [ 'egg', 'hen' ] )
+        self.assertEqual( df[ 'fp' ].isna().tolist(), [ True, False ] )
+        self.assertEqual( df[ 'response' ].tolist(), [ ' Yes', ' Yes, "hen".' ] )
+
+
+    def test_printed_rows( self ):
+        # Former printed rows: quotes not escaped, commas in the target
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join( tmp, 'tw_session_1.csv' )
+            with open( fn, 'w', encoding='utf-8' ) as f:
+                f.write( "'TBRWORD','RESULT','INLIST','CUE','RESPONSE','CUE_TYPE','DURATION'\n"
+                         "'['hour', 'minute']',1,0,'flour',' It's \"hour\", I think.','altrcue',56.20\n" )
+            df = td.read_result_file( fn )
+        self.assertEqual( df[ 'tbrword' ].tolist(), [ "['hour', 'minute']" ] )
+        self.assertEqual( df[ 'response' ].tolist(), [ ' It\'s "hour", I think.' ] )
+        self.assertEqual( df[ 'fp' ].tolist(), [ 0 ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# test_tulvingjournal.py -- Resuming a session from its journal
+import importlib.util
+import os
+import tempfile
+import unittest
+#
+import tulvingbackend as tb
+import tulvingjournal as tj
+
+# Two batches of a target and a distractor
+WORDS = 'T,C,D\negg,egg,none\nhen,hen,none\nowl,owl,none\nx,x,star\ny,y,moon\n'
+
+
+class Crash( Exception ):
+    pass
+
+
+
+def session( fn, chrono ):
+    import tulvingmem as tm
+    tt             = tm.TulvingTest( 'Journal' )
+    tt.distractors = [ 'D' ]
+    tt.remember    = 'Memorize the list: {}.'
+    tt.encodings   = '{0}'
+    tt.retrievals  = 'Is {0} in the list?'
+    tt.protocol    = {
+        'type'         : chrono,
+        'batch_number' : 2,
+        'batch_size'   : 2,
+        'encodings'    : [ ['T'], ['D'] ],
+        'retrievals'   : [ ['C'], ['D'] ]
+    }
+    tt.fill( fn, randomize=False )
+    return tt
+
+
+def respond( prompts, crash_at=None ):
+    "`FakeBackend' responses, recording the prompts, failing at the `crash_at'-th."
+    def call( text ):
+        prompts.append( text )
+        if len( prompts ) == crash_at:
+            raise Crash( text )
+        return tb.FakeBackend.recognize( text )
+    return call
+
+
+
+class TestJournal( unittest.TestCase ):
+
+    def test_torn_record( self ):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join( tmp, 'session.jsonl' )
+            with tj.Journal( fn ).create( { 'name' : 'Journal' } ) as journal:
+                journal.append( { 'batch' : 0, 'row' : 0 } )
+            with open( fn, 'a' ) as f:
+                f.write( '{"batch": 0, "ro' )
+            with self.assertLogs( level='WARNING' ):
+                header, records = tj.Journal( fn ).reopen()
+            self.assertEqual( ( header, records ), ( { 'name' : 'Journal' }, [ { 'batch' : 0, 'row' : 0 } ] ) )
+
+
+    @unittest.skipUnless( importlib.util.find_spec( 'llm' ), 'requires llm' )
+    def test_resume( self ):
+        import tulvingmem as tm
+        for chrono in ( tm.TulvingTest.TYPE_PROMPT, tm.TulvingTest.TYPE_CHAT ):
+            with self.subTest( chrono=chrono ), tempfile.TemporaryDirectory() as tmp:
+                fn, log = os.path.join( tmp, 'words.csv' ), os.path.join( tmp, 'session.jsonl' )
+                with open( fn, 'w' ) as f:
+                    f.write( WORDS )
+                # Crashes at the third prompt
+                first = []
+                with self.assertRaises( Crash ):
+                    session( fn, chrono ).perform( 'orcamini', backend=tb.FakeBackend( respond( first, 3 ) ),
+                                                   journal=log, output=os.path.join( tmp, 'first.csv' ) )
+                before = [ ( r['batch'], r['row'] ) for r in tj.Journal.load( log )[1] ]
+                again  = []
+                session( fn, chrono ).perform( 'orcamini', backend=tb.FakeBackend( respond( again ) ), journal=log,
+                                               resume=True, output=os.path.join( tmp, 'again.csv' ) )
+                done   = [ ( r['batch'], r['row'] ) for r in tj.Journal.load( log )[1] ]
+                rows   = [ -1, 0, 1 ] if chrono else [ 0, 1 ]
+                self.assertEqual( sorted( done ), [ ( b, r ) for b in range( 2 ) for r in rows ] )
+                # Each prompt of the resumed session is a probe not journaled before
+                self.assertEqual( done[ :len( before ) ], before )
+                self.assertEqual( len( again ), len( done ) - len( before ) )
+                with open( os.path.join( tmp, 'again.csv' ) ) as f:
+                    cues = [ line.split( ',' )[3] for line in f.read().splitlines()[ 1: ] ]
+                self.assertEqual( cues, [ "'egg'", "'star'", "'hen'", "'moon'" ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# test_tulvingmem.py -- Token counts and context checks of session plans
+import importlib.util
+import unittest
+#
+import tulvingbackend as tb
+
+
+def count( text ):
+    "One token per word."
+    return len( text.split() )
+
+
+
+class TestEstimate( unittest.TestCase ):
+
+    def test_estimate_tokens( self ):
+        # Digits one by one, ASCII words by four letters, others by letter
+        self.assertEqual( tb.estimate_tokens( 'S4ODV78T5G' ), 8 )
+        self.assertEqual( tb.estimate_tokens( 'Is hen in the list?' ), 6 )
+        self.assertEqual( tb.estimate_tokens( 'œuf, ça' ), 6 )
+        self.assertEqual( tb.estimate_with_margin( 'S4ODV78T5G' ), 10 )
+
+
+    def test_get_tokenizer( self ):
+        backend           = tb.FakeBackend()
+        self.assertIs( tb.get_tokenizer( None ), tb.estimate_with_margin )
+        self.assertIs( tb.get_tokenizer( None, backend ), tb.estimate_with_margin )
+        backend.tokenizer = lambda: count
+        self.assertIs( tb.get_tokenizer( None, backend ), count )
+
+
+
+@unittest.skipUnless( importlib.util.find_spec( 'llm' ), 'requires llm' )
+class TestPlan( unittest.TestCase ):
+
+    def plan( self, chat ):
+        import tulvingmem as tm
+        # A 3 tokens prefix, and prompts of 1 to 4 tokens in two batches
+        return tm.Plan( chat, [ 'a b c' ], [ 'w', 'w w', 'w w w', 'w w w w' ], [ 0 ]*4, [ 0, 0, 1, 1 ], count )
+
+
+    def test_context_tokens( self ):
+        self.assertEqual( self.plan( False ).context_tokens( 2 ).tolist(), [ 6, 7, 8, 9 ] )
+        # Turns accumulate within each conversation, after the memorization
+        self.assertEqual( self.plan( True ).context_tokens( 2 ).tolist(), [ 8, 12, 10, 16 ] )
+        self.assertEqual( self.plan( True ).context_tokens().tolist(),
+                          self.plan( True ).context_tokens( tb.RESPONSE ).tolist() )
+
+
+    def test_check( self ):
+        import tulvingmem as tm
+        for chat, n_ctx in ( ( False, 9 ), ( True, 16 ) ):
+            # The longest retrieval, the last one, fits exactly
+            plan = self.plan( chat )
+            plan.check( n_ctx, 2 )
+            with self.assertRaisesRegex( tm.ContextError, f'^1 retrievals exceed the context window of {n_ctx - 1} '
+                                                          f'tokens, up to {n_ctx} tokens from probe 3$' ):
+                plan.check( n_ctx - 1, 2 )
+            with self.assertRaises( tm.ContextError ):
+                plan.check( n_ctx, 3 )
+
+
+    def test_estimated( self ):
+        import tulvingmem as tm
+        self.assertFalse( self.plan( False ).estimated )
+        plan = tm.Plan( False, [ 'a b c' ], [ 'w' ], [ 0 ], [ 0 ], tb.estimate_with_margin )
+        self.assertTrue( plan.estimated )
+        self.assertIn( '# Token counts are estimates, with a margin of +25%', plan.describe( 2048 ) )
+        self.assertEqual( plan.describe( 2048 )[-2], f'# Total: {plan.total_tokens()} prompt tokens, context up to '
+                                                     f'{plan.context_tokens().max()} of 2048 tokens' )
+
+
+if __name__ == '__main__':
+    unittest.main()
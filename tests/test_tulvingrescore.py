@@ -0,0 +1,64 @@
+# test_tulvingrescore.py -- Re-scoring stored responses of result files
+import os
+import tempfile
+import unittest
+#
+import tulvingdata as td
+import tulvingrescore as trs
+import tulvingsink as tsk
+
+COLUMNS = [ 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
+# Responses as scored by `tulving_test', recognition then recall
+RESULTS = {
+    'merge_reco_imm_mistral_session_1.csv' : [
+        ( 'egg', 1, 1, 'egg', ' Yes, it is.', 'copy', 12.5 ),
+        ( 'hen', 1, 0, 'fowl', ' No.', 'ncaw', 3.25 ),
+        ( 'owl', 0, 1, 'towel', ' Yes', 'rhym', 4. ),
+        ( 'owl', 0, 0, 'owl', ' YES', 'copy', 4. ) ],
+    'merge_reca_imm_mistral_session_1.csv' : [
+        ( 'egg', 1, 1, 'ovum', ' The answer is "egg".', 'ncaw', 12.5 ),
+        ( 'hen', 0, 1, 'fowl', ' egg', 'ncaw', 3.25 ),
+        ( 'None', 1, 0, 'jazz', ' None', 'none', 4. ),
+        ( 'owl', 0, 0, 'towel', ' Eggs, hens.', 'rhym', 4. ),
+        ( 'owl', 1, 1, 'howl', ' OWL\nExplanation: howl, owl.', 'rhym', 4. ) ] }
+
+
+class TestRescore( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmp = tempfile.TemporaryDirectory()
+        for fn, rows in RESULTS.items():
+            with tsk.open_sink( os.path.join( self.tmp.name, fn ), COLUMNS ) as sink:
+                for row in rows:
+                    sink.write( row )
+        self.df = td.results( self.tmp.name )
+
+
+    def tearDown( self ):
+        self.tmp.cleanup()
+
+
+    def test_study_lists( self ):
+        study = trs.study_lists( self.df )
+        self.assertEqual( ( study['reco'], study['reca'] ), ( [ 'egg', 'hen', 'owl' ], [ 'egg', 'hen', 'owl' ] ) )
+        self.assertEqual( study['ord'], [] )
+
+
+    def test_rescore( self ):
+        # The rules of each task reproduce the stored scores
+        df = trs.rescore( self.df )
+        self.assertEqual( df[ 'result_new' ].tolist(), df[ 'result' ].tolist() )
+        self.assertEqual( df[ 'fp_new' ].tolist(), df[ 'fp' ].tolist() )
+        self.assertEqual( len( trs.summary( df ) ), 6 )
+
+
+    def test_rule( self ):
+        # Whole words, whatever their case
+        reco = self.df[ self.df[ 'task' ] == 'reco' ]
+        df   = trs.rescore( reco, 'reco_words', 'words' )
+        self.assertEqual( df[ 'result_words' ].tolist(), [ 1, 1, 0, 1 ] )
+        self.assertEqual( df[ 'fp_words' ].tolist(), [ 1, 0, 1, 1 ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# test_tulvingscore.py -- Whole-word matching of responses
+import unittest
+#
+import tulvingscore as ts
+
+
+class TestMatcher( unittest.TestCase ):
+
+    def test_whole_words( self ):
+        matcher = ts.Matcher( [ 'ant', 'ants', 'an' ] )
+        self.assertEqual( matcher.findall( 'An ant.' ), [ 'an', 'ant' ] )
+        self.assertEqual( matcher.findall( 'want, pants, antler' ), [] )
+        self.assertEqual( matcher.findall( 'ants, then "ant"' ), [ 'ants', 'ant' ] )
+        self.assertIsNone( matcher.search( 'giant' ) )
+
+
+    def test_case( self ):
+        matcher = ts.Matcher( [ 'YES', 'No' ] )
+        self.assertEqual( matcher.words, [ 'no', 'yes' ] )
+        self.assertEqual( matcher.findall( ' yes, YES. Yes? NO' ), [ 'yes', 'no' ] )
+        self.assertEqual( matcher.search( 'Nope, not so: NO.' ), 'no' )
+        self.assertIsNone( matcher.search( 'Yesterday' ) )
+
+
+    def test_empty( self ):
+        matcher = ts.Matcher( [ '', None ] )
+        self.assertEqual( ( matcher.findall( 'egg' ), matcher.search( 'egg' ) ), ( [], None ) )
+        self.assertIsNone( ts.Matcher( [ 'egg' ] ).search( None ) )
+
+
+    def test_special( self ):
+        # Regex characters are literal, words sharing a prefix are all found
+        matcher = ts.Matcher( [ 'c++', 'c', 'cat', 'catalog' ] )
+        self.assertEqual( matcher.findall( 'A cat, a catalog and c' ), [ 'cat', 'catalog', 'c' ] )
+        self.assertEqual( matcher.findall( 'In c++, or c' ), [ 'c++', 'c' ] )
+        self.assertEqual( matcher.findall( 'cxx' ), [] )
+        self.assertIs( ts.matcher( ( 'egg', ) ), ts.matcher( ( 'egg', ) ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,9 +5,17 @@
 # create batches of prompts for recognition ("reco") and recall
 # ("reca") tests.
 
+import argparse
+import contextlib
+import csv
+import json
 import pickle
+import sqlite3
 import numpy as np
 
+# Words of the two cue sheets of a session
+SHEET_TBR, SHEET_NTBR = 48, 16
+
 # Not to be remembered (from Bing on Sunday, January 21, 2024)
 NTBR_WORDS = [ 'abrupt', 'bloom', 'braid', 'cactus', 'caterpillar', 'daisy', 'ditch', 'dove', 'frost', 'giraffe', 'hedge', 'jazz', 'lighthouse', 'mango', 'ocean', 'penguin' ]
 
@@ -69,40 +77,155 @@ def test_unicity( lst ):
     return all( counts == 1 )
 
 
+def validate( tbr_words, ntbr_words ):
+    """
+    Violations of the cue constraints, checked in one pass over the word
+    bank: base words, NTBR words, NCAW and NCRW cues are unique, and no
+    NCAW or NCRW cue is a base or NTBR word.
+    """
+    errors = []
+    ntbr   = set()
+    for w in ntbr_words:
+        if w in ntbr:
+            errors.append( f'NTBR duplicate {w}' )
+        ntbr.add( w )
+    base, ncaws, ncrws = set(), set(), set()
+    for ( w, ncaw, ncrw ) in tbr_words:
+        if w in base:
+            errors.append( f'Base duplicate {w}' )
+        if w in ncaws or w in ncrws:
+            errors.append( f'Base word {w} is a NCAW/NCRW cue' )
+        base.add( w )
+        for cue, cues, label in ( ( ncaw, ncaws, 'NCAW' ), ( ncrw, ncrws, 'NCRW' ) ):
+            if cue in cues:
+                errors.append( f'{label} duplicate {cue}' )
+            if cue in base or cue in ntbr:
+                errors.append( f'{label} {cue} is a base/NTBR word' )
+            cues.add( cue )
+    return errors
+
+
 def test_TBR():
     global TEMPL_MEMO, TBR_WORDS, NTBR_WORDS
     # Size
     assert 48 == len(TBR_WORDS)
     assert 16 == len(NTBR_WORDS)
     # Duplicates
-    base = [ w for ( w, ncaw, ncrw ) in TBR_WORDS ]
-    assert test_unicity( base ), "Base words has duplicates." 
-    assert test_unicity( base + [ ncaw for ( w, ncaw, ncrw ) in TBR_WORDS ] ), "Base/NCAW duplicates;"
-    assert test_unicity( base + [ ncrw for ( w, ncaw, ncrw ) in TBR_WORDS ] ), "Base/NCRW duplicates;"
-    ntbr_base = NTBR_WORDS
-    assert test_unicity( ntbr_base ); "NTBR Duplicates."
-    assert test_unicity( ntbr_base + [ ncaw for ( w, ncaw, ncrw ) in TBR_WORDS ] ), "NTBR/NCAW duplicates;"
-    assert test_unicity( ntbr_base + [ ncrw for ( w, ncaw, ncrw ) in TBR_WORDS ] ), "NTBR/NCRW duplicates;"
+    errors = validate( TBR_WORDS, NTBR_WORDS )
+    assert not errors, "; ".join( errors )
 
 # Protocol
-def protocol_cuesheets():
+def protocol_cuesheets( rng=None, tbr_words=None, ntbr_words=None ):
+    """
+    Two shuffled cue sheets, reco and reca, from the 48 TBR and 16 NTBR
+    words, by default the lists above. The draws are from `rng', a
+    `numpy.random.Generator', or else from the global `np.random' state.
+    """
     global TEMPL_MEMO, TBR_WORDS, NTBR_WORDS
-    TBRl, NTBRl = len( TBR_WORDS ), len( NTBR_WORDS )
-    permute_tbr, permute_ntbr = np.random.permutation( TBRl ), np.random.permutation( NTBRl )
-    tbr_reco = [ TBR_WORDS[i]  for i in permute_tbr[: (TBRl//2)] ]
-    tbr_reca = [ TBR_WORDS[i]  for i in permute_tbr[(TBRl//2):] ]
+    rng        = np.random if rng is None else rng
+    tbr_words  = TBR_WORDS if tbr_words is None else tbr_words
+    ntbr_words = NTBR_WORDS if ntbr_words is None else ntbr_words
+    TBRl, NTBRl = len( tbr_words ), len( ntbr_words )
+    permute_tbr, permute_ntbr = rng.permutation( TBRl ), rng.permutation( NTBRl )
+    tbr_reco = [ tbr_words[i]  for i in permute_tbr[: (TBRl//2)] ]
+    tbr_reca = [ tbr_words[i]  for i in permute_tbr[(TBRl//2):] ]
     # Build cuesheets
-    cs_reco  = [ (w, w, 'copy') for ( w, ncaw, ncrw ) in tbr_reco[:8] ] + [ (w, ncaw, 'ncaw') for ( w, ncaw, ncrw ) in tbr_reco[8:16] ] + [ (w, ncrw, 'ncrw') for ( w, ncaw, ncrw ) in tbr_reco[16:] ] + [ ( None, NTBR_WORDS[i], 'none' ) for i in permute_ntbr[:8] ]
+    cs_reco  = [ (w, w, 'copy') for ( w, ncaw, ncrw ) in tbr_reco[:8] ] + [ (w, ncaw, 'ncaw') for ( w, ncaw, ncrw ) in tbr_reco[8:16] ] + [ (w, ncrw, 'ncrw') for ( w, ncaw, ncrw ) in tbr_reco[16:] ] + [ ( None, ntbr_words[i], 'none' ) for i in permute_ntbr[:8] ]
     #
-    cs_reca  = [ (w, w, 'copy') for ( w, ncaw, ncrw ) in tbr_reca[:8] ] + [ (w, ncaw, 'ncaw') for ( w, ncaw, ncrw ) in tbr_reca[8:16] ] + [ (w, ncrw, 'ncrw') for ( w, ncaw, ncrw ) in tbr_reca[16:] ] + [ ( None, NTBR_WORDS[i], 'none' ) for i in permute_ntbr[8:] ]
+    cs_reca  = [ (w, w, 'copy') for ( w, ncaw, ncrw ) in tbr_reca[:8] ] + [ (w, ncaw, 'ncaw') for ( w, ncaw, ncrw ) in tbr_reca[8:16] ] + [ (w, ncrw, 'ncrw') for ( w, ncaw, ncrw ) in tbr_reca[16:] ] + [ ( None, ntbr_words[i], 'none' ) for i in permute_ntbr[8:] ]
     assert 32 == len( cs_reco )
     assert 32 == len( cs_reca )
     # Shuffle
-    permute_cso, permute_csa = np.random.permutation( 32 ), np.random.permutation( 32 )
+    permute_cso, permute_csa = rng.permutation( 32 ), rng.permutation( 32 )
     cso, csa = [ cs_reco[i] for i in permute_cso ], [ cs_reca[i] for i in permute_csa ]
     return cso, csa
 
+
+def generate_cuesheets( sessions, seed=0, tbr_words=None, ntbr_words=None ):
+    """
+    Yields ( session, tbr, cso, csa ) for each session: the 48 words to
+    memorize and the two cue sheets, drawn from a word bank of any size.
+
+    Each pass over a seeded permutation of the bank gives consecutive
+    sessions disjoint words; the sheets of a session are then drawn from
+    its own generator, seeded by ( seed, session ), so that any session
+    is reproduced alone.
+    """
+    tbr_words  = TBR_WORDS if tbr_words is None else tbr_words
+    ntbr_words = NTBR_WORDS if ntbr_words is None else ntbr_words
+    errors     = validate( tbr_words, ntbr_words )
+    if errors:
+        raise ValueError( "; ".join( errors ) )
+    if len( tbr_words ) < SHEET_TBR or len( ntbr_words ) < SHEET_NTBR:
+        raise ValueError( f'Word bank smaller than {SHEET_TBR} TBR and {SHEET_NTBR} NTBR words' )
+    passes = {}
+
+    def draw( words, size, kind, session ):
+        # Words of `session' in its pass over the `kind' permutation
+        per_pass   = len( words ) // size
+        npass, blk = divmod( session, per_pass )
+        if ( kind, npass ) not in passes:
+            passes[ ( kind, npass ) ] = np.random.default_rng( [ seed, kind, npass ] ).permutation( len( words ) )
+        return [ words[i] for i in passes[ ( kind, npass ) ][ blk*size:(blk+1)*size ] ]
+
+    for session in sessions:
+        tbr      = draw( tbr_words, SHEET_TBR, 0, session )
+        ntbr     = draw( ntbr_words, SHEET_NTBR, 1, session )
+        cso, csa = protocol_cuesheets( np.random.default_rng( [ seed, 2, session ] ), tbr, ntbr )
+        yield session, [ w for ( w, ncaw, ncrw ) in tbr ], cso, csa
+
+
+def read_bank( fn ):
+    "Word bank of a CSV file: rows of a TBR word, its NCAW and NCRW cues, or of a NTBR word."
+    tbr_words, ntbr_words = [], []
+    with open( fn, newline='' ) as f:
+        for row in csv.reader( f ):
+            row = [ w.strip() for w in row if w.strip() ]
+            if 3 == len( row ):
+                tbr_words.append( tuple( row ) )
+            elif 1 == len( row ):
+                ntbr_words.append( row[0] )
+    return tbr_words, ntbr_words
+
+
+def write_cuesheets( path, sheets ):
+    """Writes the ( session, tbr, cso, csa ) `sheets' to the SQLite file
+    `path', indexed by session; returns their number.
+    """
+    with contextlib.closing( sqlite3.connect( path ) ) as db, db:
+        db.execute( 'CREATE TABLE IF NOT EXISTS cuesheets ( session INTEGER PRIMARY KEY, tbr TEXT, cso TEXT, csa TEXT )' )
+        cur = db.executemany( 'INSERT OR REPLACE INTO cuesheets VALUES ( ?, ?, ?, ? )',
+                              ( ( session, json.dumps( tbr ), json.dumps( cso ), json.dumps( csa ) )
+                                for session, tbr, cso, csa in sheets ) )
+        return cur.rowcount
+
+
+def read_cuesheets( path, session ):
+    "Returns the tbr, cso and csa of `session' in the cue sheets file `path'."
+    with contextlib.closing( sqlite3.connect( path ) ) as db:
+        row = db.execute( 'SELECT tbr, cso, csa FROM cuesheets WHERE session = ?', ( session, ) ).fetchone()
+    if row is None:
+        raise KeyError( f'No cue sheets for session {session} in {path}' )
+    tbr, cso, csa = [ json.loads( x ) for x in row ]
+    return tbr, [ tuple( cue ) for cue in cso ], [ tuple( cue ) for cue in csa ]
+
+
 def main():
+    parser = argparse.ArgumentParser( prog="cues",
+                                      description="Draws the cue sheets of Tulving Test sessions." )
+    parser.add_argument( '-n', '--sessions', type=int, nargs=2, metavar=( 'FIRST', 'LAST' ),
+                         help="Writes the cue sheets of sessions FIRST to LAST to one indexed file" )
+    parser.add_argument( '-b', '--bank', help="CSV word bank, see `read_bank', defaults to the lists above" )
+    parser.add_argument( '-s', '--seed', type=int, default=0 )
+    parser.add_argument( '-o', '--output', default='cuesheets.sqlite' )
+    args = parser.parse_args()
+    if args.sessions:
+        tbr_words, ntbr_words = read_bank( args.bank ) if args.bank else ( TBR_WORDS, NTBR_WORDS )
+        first, last           = args.sessions
+        n = write_cuesheets( args.output, generate_cuesheets( range( first, last + 1 ), args.seed, tbr_words, ntbr_words ) )
+        print( f'{n} sessions written to {args.output}' )
+        return
+    #
     test_TBR()
     words = [ w for ( w, ncaw, ncrw ) in TBR_WORDS ]
     with open( 'words_test.pickle', 'wb' ) as f:
@@ -7,120 +7,125 @@ import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+import tulvingdata as td
+import tulvingstats as tst
 
-CUETYPES        = ["'copy'", "'ncaw'", "'ncrw'", "'none'"]
+CUETYPES        = ['copy', 'ncaw', 'ncrw', 'none']
+CUENAMES        = {'copy': "Copy", 'ncaw': "Associate", 'ncrw': "Rhyme", 'none': "Unrelated"}
+CUEGROUPS       = {'copy': ['copy'], 'noncopy': ['ncaw', 'ncrw']}
 TESTWORDS       = "C:\\Users\\chauv\\Documents\\NEWNEWAI\\tulving\\words_test.pickle"
+# Result files, or the dataset compacted by `tulvingdata.py'
 OUTPUT_DIR      = "C:\\Users\\chauv\\Documents\\NEWNEWAI\\tulving\\output\\"
-TEMPL_MERGERECO = "merge_reco_{}_session_{}.csv"
-TEMPL_MERGERECA = "merge_reca_{}_session_{}.csv"
-TEMPL_MERGEORDR = "merge_ord_{}_mistral_session_{}.csv"
+MODEL           = 'mistral'
 SESSIONS        = None
+# Probes per block of the test scripts, e.g. per delayed conversation
+BLOCKSIZE       = 8
 
 def tulving_ordering_results():
     """
     Merge results tables from 'ordering' Tulving Test into dataframes.
     One for the delayed test; one for the immmediate test.
     """
-    global SESSIONS, OUTPUT_DIR, TEMPL_MERGEORDR
-    COLRES  = "'RESULT'"
-    del_df  = pd.read_csv( OUTPUT_DIR + TEMPL_MERGEORDR.format( 'del', SESSIONS[0] ),
-                           index_col=False, 
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-    imm_df  = pd.read_csv( OUTPUT_DIR + TEMPL_MERGEORDR.format( 'imm', SESSIONS[0] ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-    for ses in SESSIONS[ 1: ]:
-        dfd = pd.read_csv( OUTPUT_DIR + TEMPL_MERGEORDR.format( 'del', ses ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-        dfi = pd.read_csv( OUTPUT_DIR + TEMPL_MERGEORDR.format( 'imm', ses ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-        del_df = pd.concat( [del_df, dfd] )
-        imm_df = pd.concat( [imm_df, dfi] )
-    return del_df, imm_df
-
-
-def tulving_results( chrono, false_positives=True ):
-    global SESSIONS, OUTPUT_DIR, TEMPL_MERGEFN
-    COLRES  = "'RESULT'" if false_positives else "'FP'"
-    imm     = "imm" if "Immediate" == chrono else "del"
-    reco_df = pd.read_csv( OUTPUT_DIR + TEMPL_MERGERECO.format( imm, SESSIONS[0] ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-    reca_df = pd.read_csv( OUTPUT_DIR + TEMPL_MERGERECA.format( imm, SESSIONS[0] ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-    for ses in SESSIONS[ 1: ]:
-        dfo = pd.read_csv( OUTPUT_DIR + TEMPL_MERGERECO.format( imm, ses ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-        dfa = pd.read_csv( OUTPUT_DIR + TEMPL_MERGERECA.format( imm, ses ),
-                           index_col=False,
-                           usecols=lambda x: x.upper() in [COLRES, "'CUE_TYPE'"] )
-        reco_df = pd.concat( [reco_df, dfo] )
-        reca_df = pd.concat( [reca_df, dfa] )
-        
-    return reco_df, reca_df
-
-
-def tulving_occurences( tbr, nsessions, dfs, cuetype ):
-    occ_word, occ_true = np.zeros( len(tbr) ), np.zeros( len(tbr) )
-    iw = 0
-    for w in tbr:
-        for i in range( nsessions ):
-            df = dfs[i].loc[ lambda df: df["'tbrword'"] == f"'{w}'" ]
-            if df.empty :
-                pass
-            else:
-                if df.iat[ 0, 2 ]  in cuetype:
-                    occ_word[iw] += 1
-                if 1 == df.iat[ 0, 1 ] and df.iat[ 0, 2 ] in cuetype :
-                    occ_true[iw] += 1
-        iw += 1
-    return occ_word, occ_true
-
-
-def tulving_cuetype_results( chrono, cuetype, false_positives=True ):
-    global SESSIONS, OUTPUT_DIR, TEMPL_MERGEFN, TESTWORDS
-    COLRES  = "'RESULT'" if false_positives else "'FP'"
+    global SESSIONS, OUTPUT_DIR, MODEL
+    df = td.results( OUTPUT_DIR, columns=['result', 'cue_type'], task='ord', model=MODEL, session=SESSIONS )
+    return df[ 'del' == df.chrono ], df[ 'imm' == df.chrono ]
+
+
+def tulving_latency_results( block=BLOCKSIZE ):
+    """
+    Durations of the probes of all tasks and chronologies, with their
+    `position' in their block: the batch position in the immediate
+    test, the conversation depth in the delayed test.
+    """
+    global SESSIONS, OUTPUT_DIR, MODEL
+    df = td.results( OUTPUT_DIR, columns=['row', 'cue_type', 'duration'], model=MODEL, session=SESSIONS )
+    return df.assign( position=df.row % block )
+
+
+def tulving_results( chrono, false_positives=True, columns=None ):
+    global SESSIONS, OUTPUT_DIR, MODEL
+    COLRES  = 'result' if false_positives else 'fp'
     imm     = "imm" if "Immediate" == chrono else "del"
+    df      = td.results( OUTPUT_DIR, columns=( columns or [] ) + [COLRES, 'cue_type'],
+                          task=['reco', 'reca'], chrono=imm, model=MODEL, session=SESSIONS )
+    return df[ 'reco' == df.task ], df[ 'reca' == df.task ]
+
+
+def tulving_first_probes( df ):
+    "First probe of each word in each session, the one scored by the cue valence analysis."
+    return df.drop_duplicates( subset=['task', 'chrono', 'model', 'session', 'tbrword'], keep='first' )
+
+
+def tulving_occurences( df, tbr, groups, col='result' ):
+    """
+    Occurrences of the `tbr' words with a cue of each group of cue types,
+    `occ_word', and of their hits in `col', `occ_true', over the sessions
+    of `df'. One grouped pass for all words, sessions and groups; the
+    result has columns ( group, 'occ_word' | 'occ_true' ), indexed by `tbr'.
+    """
+    first  = tulving_first_probes( df )
+    counts = first.assign( occ_word=1, occ_true=first[ col ].eq( 1 ).fillna( False ).astype( int ) ) \
+                  .groupby( ['tbrword', 'cue_type'], observed=True )[ ['occ_word', 'occ_true'] ].sum()
+    cue    = counts.index.get_level_values( 'cue_type' )
+    return pd.concat( { name: counts[ cue.isin( cuetype ) ].groupby( level='tbrword' ).sum().reindex( tbr, fill_value=0 )
+                        for name, cuetype in groups.items() }, axis=1 )
+
+
+def tulving_hit_matrix( df, tbr, sessions, cuetype=None, col='result', sparse=False ):
+    """
+    Words x sessions matrix of the first probe of each word in each
+    session: 1 for a hit, 0 for a miss, NaN if the word was not probed,
+    or not with a cue of `cuetype'. `sparse' keeps only the probes.
+    """
+    first = tulving_first_probes( df )
+    if cuetype is not None:
+        first = first[ first.cue_type.isin( cuetype ) ]
+    hits  = first.pivot( index='tbrword', columns='session', values=col ) \
+                 .reindex( index=tbr, columns=sessions ).astype( float )
+    return hits.astype( pd.SparseDtype( float ) ) if sparse else hits
+
+
+def tulving_cuetype_results( chrono, groups, false_positives=True ):
+    """
+    Occurrences of the test words with each group of cue types, see
+    `tulving_occurences', in the recognition and recall tasks.
+    """
+    global TESTWORDS
+    COLRES  = 'result' if false_positives else 'fp'
     # Read session results from column implicitly designes by metrics (all/book)
-    i = 0
-    dfo, dfa = [ None for i in range( len(SESSIONS) ) ], [ None for i in range( len(SESSIONS) ) ]
-    for session in SESSIONS:
-        dfo[ i ] = pd.read_csv( OUTPUT_DIR + TEMPL_MERGERECO.format( imm, session ),
-                                      index_col=False,
-                                      usecols=lambda x: x.upper() in ["'TBRWORD'", COLRES, "'CUE_TYPE'"] )
-        dfa[ i ] = pd.read_csv( OUTPUT_DIR + TEMPL_MERGERECA.format( imm, session ),
-                                      index_col=False,
-                                      usecols=lambda x: x.upper() in ["'TBRWORD'", COLRES, "'CUE_TYPE'"] )
-        i += 1
-        
+    reco, reca = tulving_results( chrono, false_positives, columns=['tbrword'] )
+
     # Score each word
     with open( TESTWORDS, 'rb' ) as f:
         tbr = pickle.load( f )
-    occ_words_o, occ_true_o = tulving_occurences( tbr, len(SESSIONS), dfo, cuetype )
-    occ_words_a, occ_true_a = tulving_occurences( tbr, len(SESSIONS), dfa, cuetype )
-    return( pd.DataFrame( index=tbr, data={ 'occ_word': occ_words_o, 'occ_true': occ_true_o } ),
-            pd.DataFrame( index=tbr, data={ 'occ_word': occ_words_a, 'occ_true': occ_true_a} ) )
+    return( tulving_occurences( reco, tbr, groups, COLRES ),
+            tulving_occurences( reca, tbr, groups, COLRES ) )
         
 
 def summary( df, fp ):
-    COLRES = "'result'" if fp else "'fp'"
-    # summary = df.groupby( "'cue_type'" )[COLRES].mean()
+    COLRES = 'result' if fp else 'fp'
+    # summary = df.groupby( 'cue_type' )[COLRES].mean()
     # Cleansing
-    mask = df["'cue_type'"].isin(CUETYPES)
+    mask = df['cue_type'].isin(CUETYPES)
     df_clean = df[ mask ]
     # with pd.option_context('display.max_rows', None,
     #                    'display.max_columns', None,
     #                    'display.precision', 3,
     #                    ):
 
-    summary = df_clean.groupby( ["'cue_type'"] ).mean()[COLRES]
+    summary = df_clean.groupby( ['cue_type'], observed=True )[COLRES].mean()
     return summary
     
 
+def summary_ci( df, fp, name, resamples=tst.RESAMPLES ):
+    """Bootstrap interval of the `summary' means over the sessions, as
+    columns `name' lower and upper bounds.
+    """
+    COLRES = 'result' if fp else 'fp'
+    ci     = tst.mean_ci( df[ df['cue_type'].isin(CUETYPES) ], COLRES, 'cue_type', resamples )
+    return ci.drop( columns=COLRES ).add_prefix( f'{name} ' )
+
+
 def rand_jitter(arr):
     stdev = .01 * (max(arr) - min(arr))
     return arr + np.random.randn(len(arr)) * stdev
@@ -144,7 +149,7 @@ def tulving_scatterplot( df, title ):
 
 
 def main():
-    global SESSIONS
+    global SESSIONS, OUTPUT_DIR, MODEL
     parser = argparse.ArgumentParser( prog="Tabulate",
                                       description="Tabulate Tulving Test results." )
     parser.add_argument( '-i', '--immediate',
@@ -156,36 +161,67 @@ def main():
     parser.add_argument( '-b', '--book',
                          help="Selects original book metrics rather than standard",
                          action=argparse.BooleanOptionalAction )
+    parser.add_argument( '-d', '--data',
+                         help="Result files directory, or dataset, defaults to OUTPUT_DIR" )
+    parser.add_argument( '-m', '--model', nargs='+', default=MODEL,
+                         help="Selects the model(s)" )
+    parser.add_argument( '-l', '--latency',
+                         help="Tabulates latency percentiles of the probes rather than results",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '-B', '--block', type=int, default=BLOCKSIZE,
+                         help="Probes per block, or delayed conversation, for the latency by position" )
+    parser.add_argument( '-r', '--resamples', type=int, default=tst.RESAMPLES,
+                         help="Bootstrap resamples of the sessions for confidence intervals, 0 for none" )
     parser.add_argument('sessions', metavar='N', type=int, nargs='+',
                         help='Session number(s)')
     args       = parser.parse_args()
     
     chrono     = "Immediate" if args.immediate else "Delayed"
     SESSIONS   = args.sessions
+    OUTPUT_DIR = args.data or OUTPUT_DIR
+    MODEL      = args.model
 
-    if args.ordering:
-        COLRES         = "'result'"
+    if args.latency:
+        df = tulving_latency_results( args.block )
+        print( f'* Latency (ms)\n:PROPERTIES:\n:SessionIds: {SESSIONS}\n:Probes: {len( df.index ):3d}\n:END:' )
+        print( '** By Cue Type' )
+        print( tst.latency_table( df, ['task', 'chrono', 'model', 'cue_type'] ) )
+        # Delayed conversations grow with each probe of a block
+        print( '** By Position in Block' )
+        print( tst.latency_table( df, ['chrono', 'model', 'position'] ) )
+        print()
+
+    elif args.ordering:
+        COLRES         = 'result'
         del_df, imm_df = tulving_ordering_results()
         ndel, nimm     = len( del_df.index ), len( imm_df.index )
         mdel, mimm     = del_df.mean(numeric_only=True)[COLRES], imm_df.mean(numeric_only=True)[COLRES]
         print( f'* Ordering Task\n:PROPERTIES:\n:SessionIds: {SESSIONS}\n:Delayed: {ndel:3d}\n:Immediate: {nimm:3d}\n:END:' )
-        print( f'| Immediate |  Delayed |\n| {mimm:2.3f} | {mdel:2.3f} |\n' )
+        print( f'| Immediate |  Delayed |\n| {mimm:2.3f} | {mdel:2.3f} |' )
+        if args.resamples:
+            (ilo, ihi), (dlo, dhi) = [ tst.mean_ci( df, COLRES, resamples=args.resamples ).iloc[ 0, 1: ]
+                                       for df in ( imm_df, del_df ) ]
+            print( f'| [{ilo:2.3f}, {ihi:2.3f}] | [{dlo:2.3f}, {dhi:2.3f}] |' )
+        print()
 
     else:
         reco, reca = tulving_results( chrono, false_positives = not args.book )
         summary_reco, summary_reca = summary( reco, not args.book ), summary( reca, not args.book )
-        treco, treca               = reco.count().get("'cue_type'"), reca.count().get("'cue_type'")
+        treco, treca               = reco.count().get('cue_type'), reca.count().get('cue_type')
         print( f'* {chrono} Task\n:PROPERTIES:\n:SessionIds: {SESSIONS}\n:Recos: {treco:3d}\n:Recas: {treca:3d}\n:END:' )
 
         # Org-mode print statistical summaries
         if not args.book :
-            df = pd.merge( summary_reco, summary_reca, on="'cue_type'" ).rename(
-                columns={"'result'_x": "Familiarity", "'result'_y": "Identification"},
-                index={"'copy'": "Copy", "'ncaw'": "Associate", "'ncrw'": "Rhyme", "'none'": "Unrelated"} )
+            df = pd.merge( summary_reco, summary_reca, on='cue_type' ).rename(
+                columns={'result_x': "Familiarity", 'result_y': "Identification"}, index=CUENAMES )
         else:
-            df = pd.merge( summary_reco, summary_reca, on="'cue_type'" ).rename(
-                columns={"'fp'_x": "Familiarity", "'fp'_y": "Identification"},
-                index={"'copy'": "Copy", "'ncaw'": "Associate", "'ncrw'": "Rhyme", "'none'": "Unrelated"} )
+            df = pd.merge( summary_reco, summary_reca, on='cue_type' ).rename(
+                columns={'fp_x': "Familiarity", 'fp_y': "Identification"}, index=CUENAMES )
+
+        if args.resamples:
+            ci_reco = summary_ci( reco, not args.book, "Familiarity", args.resamples ).rename( index=CUENAMES )
+            ci_reca = summary_ci( reca, not args.book, "Identification", args.resamples ).rename( index=CUENAMES )
+            df      = pd.concat( [ df[ ["Familiarity"] ], ci_reco, df[ ["Identification"] ], ci_reca ], axis=1 )
 
         df.index.rename( "Cue Type", inplace=True )
         print( df )
@@ -194,7 +230,8 @@ def main():
         print()
         print( f'* {chrono} Task: Most recognized and recalled' )
         print( '** Copy Cues' )
-        dfo, dfa = tulving_cuetype_results( chrono, [ "'copy'" ], false_positives = not args.book )
+        occ_o, occ_a = tulving_cuetype_results( chrono, CUEGROUPS, false_positives = not args.book )
+        dfo, dfa = occ_o[ 'copy' ], occ_a[ 'copy' ]
         df = pd.concat( [dfo.rename( columns={ 'occ_word': 'reco_word', 'occ_true': 'reco_true' } ), dfa.rename( columns={ 'occ_word': 'reca_word', 'occ_true': 'reca_true' } ) ], axis=1 )
         df.to_csv( f'tab_counts_copy_{chrono}.csv' )
         # print( df.sort_values( by=['reco'] ) )
@@ -204,7 +241,7 @@ def main():
 
         plt.close( "all" )
         print( '** Associative Cues' )
-        dfo, dfa = tulving_cuetype_results( chrono, [ "'ncaw'", "'ncrw'" ], false_positives = not args.book )
+        dfo, dfa = occ_o[ 'noncopy' ], occ_a[ 'noncopy' ]
         df = pd.concat( [dfo.rename( columns={ 'occ_word': 'reco_word', 'occ_true': 'reco_true' } ), dfa.rename( columns={ 'occ_word': 'reca_word', 'occ_true': 'reca_true' } ) ], axis=1 )
         df.to_csv( f'tab_counts_noncopy_{chrono}.csv' )
         tulving_scatterplot( df, f'{chrono} Task - Associative Cues' )
@@ -215,4 +252,6 @@ def main():
                          
 if __name__ == '__main__':
     pd.set_option("display.precision", 2)
+    pd.set_option("display.max_columns", None)
+    pd.set_option("display.width", 160)
     main()
@@ -8,31 +8,85 @@
 # nltk.download( 'wordnet' )
 # nltk.download( 'cmudict' )
 
-#Checking synonym for the word "travel"
-from nltk.corpus import wordnet
-from nltk.corpus import cmudict
-
-entries = cmudict.entries()
-print( 'CMU Pronunciation Dictionary:', len(entries) )
-
-def set_of_cues( word ):
-    global entries
-    pron, rhymes, syns, antos = None, None, [], []
-    # Find pronunciation for rhymes
-    for w, p in entries:
-        if word == w:
-            pron = p
-            break
-    if pron:
-        ending = pron[ -2: ]
-        rhymes = [ w for w, p in entries if ending == p[ -2: ] ]
-    # Antonyms and synonyms
+import argparse
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+# Prebuilt index of pronunciations, rhymes and WordNet cues, see `build_index'
+INDEX  = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "words_index.pickle" )
+# Number of final phonemes shared by rhymes
+SUFFIX = 2
+
+
+def build_pronunciations( suffix=SUFFIX ):
+    """
+    Index of the CMU Pronunciation Dictionary in one pass: word to its
+    pronunciations, and ending of `suffix' phonemes to its words.
+    """
+    from nltk.corpus import cmudict
+    prons, rhymes = {}, {}
+    for w, p in cmudict.entries():
+        prons.setdefault( w, [] ).append( tuple( p ) )
+        words = rhymes.setdefault( tuple( p[ -suffix: ] ), [] )
+        # Pronunciations of a word are consecutive entries
+        if not words or w != words[ -1 ]:
+            words.append( w )
+    return prons, rhymes
+
+
+def wordnet_cues( word ):
+    "Synonyms and antonyms of `word' in WordNet."
+    from nltk.corpus import wordnet
+    syns, antos = [], []
     for syn in wordnet.synsets( word ):
         for lm in syn.lemmas():
             syns.append( lm.name() ) # adding into synonyms
             if lm.antonyms():
                 antos.append( lm.antonyms()[0].name() )
-    return rhymes, list( set( syns ) ), list( set( antos ) )
+    return list( set( syns ) ), list( set( antos ) )
+
+
+def index_words( index, words, processes=None ):
+    """Adds the WordNet cues of `words' missing from `index', looked up
+    on a pool of `processes'.
+    """
+    missing = [ w for w in dict.fromkeys( words ) if w not in index[ 'wordnet' ] ]
+    if missing:
+        chunksize = max( 1, len( missing ) // (4*(processes or os.cpu_count() or 1)) )
+        with ProcessPoolExecutor( processes ) as pool:
+            index[ 'wordnet' ].update( zip( missing, pool.map( wordnet_cues, missing, chunksize=chunksize ) ) )
+    return index
+
+
+def build_index( words, suffix=SUFFIX, processes=None ):
+    """
+    Index of pronunciations, rhymes by ending of `suffix' phonemes, and
+    synonyms and antonyms of the candidate `words'.
+    """
+    prons, rhymes = build_pronunciations( suffix )
+    index         = { 'suffix': suffix, 'pronunciations': prons, 'rhymes': rhymes, 'wordnet': {} }
+    return index_words( index, words, processes )
+
+
+def load_index( path=INDEX ):
+    with open( path, 'rb' ) as f:
+        return pickle.load( f )
+
+
+def save_index( index, path=INDEX ):
+    with open( path, 'wb' ) as f:
+        pickle.dump( index, f, protocol=pickle.HIGHEST_PROTOCOL )
+
+
+def set_of_cues( word, index ):
+    pron, rhymes = index[ 'pronunciations' ].get( word ), None
+    # Rhymes of the first pronunciation
+    if pron:
+        rhymes = index[ 'rhymes' ][ pron[0][ -index[ 'suffix' ]: ] ]
+    # Antonyms and synonyms
+    syns, antos = index[ 'wordnet' ].get( word ) or wordnet_cues( word )
+    return rhymes, syns, antos
 
 TBR_WORDS = [
     'free',
@@ -85,17 +139,44 @@ TBR_WORDS = [
     'arm'
 ]
 
-print( 'To-be-remembered (TBR) words:', len(TBR_WORDS) )
 
-for w in TBR_WORDS:
-    rhy, syn, ant = set_of_cues( w )
-    print( "* {}".format( w ) )
-    print( "** Rhymes of {}".format( w ) )
-    print( rhy )
-    print( "** Synonyms of {}".format( w ) )
-    print( syn )
-    print( "** Antonyms of {}".format( w ) )
-    print( ant )
-    
-    
+def main():
+    parser = argparse.ArgumentParser( prog="words",
+                                      description="Outputs rhymes, synonyms and antonyms of candidate words as org." )
+    parser.add_argument( '-w', '--words', help="File of candidate words, one per line, defaults to TBR_WORDS" )
+    parser.add_argument( '-s', '--suffix', type=int, default=SUFFIX, help="Number of final phonemes of rhymes" )
+    parser.add_argument( '-p', '--processes', type=int, help="Processes looking up WordNet, defaults to the cores" )
+    parser.add_argument( '-i', '--index', default=INDEX, help="Index file" )
+    parser.add_argument( '--rebuild', action='store_true', help="Rebuilds the index" )
+    args  = parser.parse_args()
+    words = TBR_WORDS
+    if args.words:
+        with open( args.words ) as f:
+            words = [ w.strip() for w in f if w.strip() ]
+
+    index = None
+    if not args.rebuild and os.path.exists( args.index ):
+        index = load_index( args.index )
+        if args.suffix != index[ 'suffix' ]:
+            index = None
+    if index is None:
+        index = build_index( words, args.suffix, args.processes )
+        save_index( index, args.index )
+    elif any( w not in index[ 'wordnet' ] for w in words ):
+        save_index( index_words( index, words, args.processes ), args.index )
+    print( 'CMU Pronunciation Dictionary:', len( index[ 'pronunciations' ] ) )
+    print( 'To-be-remembered (TBR) words:', len( words ) )
+
+    for w in words:
+        rhy, syn, ant = set_of_cues( w, index )
+        print( "* {}".format( w ) )
+        print( "** Rhymes of {}".format( w ) )
+        print( rhy )
+        print( "** Synonyms of {}".format( w ) )
+        print( syn )
+        print( "** Antonyms of {}".format( w ) )
+        print( ant )
+
 
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,8 @@
 cd "\tulving"
 python cues.py
 
-for /l %%x in (0, 8, 24) do python tulving_test.py -m %1 -b %%x -t reco > res_reco%%x.csv
-for /l %%x in (0, 8, 24) do python tulving_test.py -m %1 -b %%x -t reca > res_reca%%x.csv
-python resjoin.py -t reco -s %2
-python resjoin.py -t reca -s %2
-for /l %%x in (0, 8, 24) do python tulving_test_imm.py -m %1 -b %%x -t reco > res_reco%%x.csv
-for /l %%x in (0, 8, 24) do python tulving_test_imm.py -m %1 -b %%x -t reca > res_reca%%x.csv
-python resjoin.py -i -t reco -s %2
-python resjoin.py -i -t reca -s %2
+del merge_reco_del_session_%2.csv merge_reca_del_session_%2.csv merge_reco_imm_session_%2.csv merge_reca_imm_session_%2.csv 2>nul
+for /l %%x in (0, 8, 24) do python tulving_test.py -m %1 -b %%x -t reco -o merge_reco_del_session_%2.csv
+for /l %%x in (0, 8, 24) do python tulving_test.py -m %1 -b %%x -t reca -o merge_reca_del_session_%2.csv
+for /l %%x in (0, 8, 24) do python tulving_test_imm.py -m %1 -b %%x -t reco -o merge_reco_imm_session_%2.csv
+for /l %%x in (0, 8, 24) do python tulving_test_imm.py -m %1 -b %%x -t reca -o merge_reca_imm_session_%2.csv
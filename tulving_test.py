@@ -7,7 +7,13 @@ import timeit
 import pickle
 import numpy as np
 #
-import llm
+import tulvingbackend as tb
+import tulvingcache as tc
+import tulvingmetrics as tmx
+import tulvingregistry as tr
+import tulvingscore as ts
+import tulvingsink as tsk
+import tulvingworker as tw
 
 MODELS = { "orcamini": "orca-mini-3b-gguf2-q4_0",
            "mistral":  "mistral-7b-instruct-v0"
@@ -18,7 +24,7 @@ TESTWORDS  = "\\tulving\\words_test.pickle"
 CUESHEET_1 = "\\tulving\\cues_half_1.pickle"
 CUESHEET_2 = "\\tulving\\cues_half_2.pickle"
 
-# Adjust for model context length
+# Adjust for model context length, or see `block_size'
 BLOCKSIZE = 8
 
 # Chat templates
@@ -35,8 +41,8 @@ TEMPL_RECA = " Which word in the S4ODV78T5G list is reminiscent of the given cue
 TEMPL_RECA += "\nExamples:\n(cue = \"{ex1}\", answer = \"{an1}\")\n(cue = \"{ex2}\", answer = \"{an2}\")\n(cue = \"{ex3}\", answer = \"{an3}\")\n Please complete: ( cue =\"{cue}\", answer = "
 TEMPL_RECA_FOLLOWUP = "Explain your answer: Please complete only with a word in the S4ODV78T5G list (or NONE if no such word is found): ( cue =\"{cue}\", answer = "
 
-TEMPL_RES    = "'{word}', {val:1d}, {valfp:1d}, '{cue}', '{txt}', '{cue_type}', {tdur:4.2f}"
-TEMPL_HEADER = "'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration'"
+# Columns of the result rows, see `tulvingsink'
+COLUMNS      = [ 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
 
 def prompt_memo( tbr ):
     global TEMPL_MEMO
@@ -47,11 +53,12 @@ def prompt_memo( tbr ):
 
 # Protocol
 def protocol_reca_match( txt, answer, false_positives = True, tbr=None ):
+    # Whole words only, the study list being compiled once per session
     if txt:
         if false_positives:
-            return 1 if (txt.find( f"'{answer}'") >= 0) or (txt.find( f' {answer}' ) >= 0) or (txt.find( f'"{answer}"') >= 0) else 0
+            return 1 if ts.matcher( ( answer, ) ).search( txt ) else 0
         else:
-            return any( [ 1 if txt.find( w ) >=0 else 0 for w in tbr ] )
+            return 1 if ts.matcher( tuple( tbr ) ).search( txt ) else 0
     return 0
 
 
@@ -65,49 +72,96 @@ def protocol_reco_match( txt, answer, cue, false_positives = True, tbr=None ):
     return 0
 
 
-def protocol_session( mdl, test, tbr, cs1, cs2, beg ):
+def block_size( test, tbr, cs1, cs2, n_ctx=tb.CONTEXT, count=None, max_tokens=tb.RESPONSE ):
+    """Largest block of cues of `cs1' that fits in one conversation of
+    `n_ctx' tokens, whichever the cues of the block, each response
+    counting for `max_tokens' tokens, as in `protocol_session'.
+
+    Raises `tulvingbackend.ContextError' if not even one cue fits.
+    """
+    count  = count or tb.get_tokenizer()
+    prefix = count( prompt_memo( tbr ) ) + max_tokens
+    if 'reco' == test:
+        n = tb.fit_probes( prefix, sorted( [ count( TEMPL_RECO.format( cue ) ) + max_tokens
+                                             for w, cue, cue_type in cs1 ], reverse=True ), n_ctx )
+        if not n:
+            raise tb.ContextError( f'No recognition probe fits in {n_ctx} tokens' )
+        return n
+    # The first prompt of a block has the instructions and examples
+    first  = max( count( TEMPL_RECA.format( ex1= cs2[0][1], an1=cs2[0][0], ex2= cs2[1][1], an2=cs2[1][0],
+                                            ex3= cs2[2][1], an3=cs2[2][0], cue=cue ) ) for w, cue, cue_type in cs1 )
+    if prefix + first + max_tokens > n_ctx:
+        raise tb.ContextError( f'No recall probe fits in {n_ctx} tokens' )
+    # The k-1 follow-ups of a block are at worst the k-1 costliest ones
+    return min( len( cs1 ), 1 + tb.fit_probes( prefix + first + max_tokens,
+                                               sorted( [ count( TEMPL_RECA_FOLLOWUP.format( cue=cue ) ) + max_tokens
+                                                         for w, cue, cue_type in cs1 ], reverse=True ), n_ctx ) )
+
+
+def protocol_session( mdl, test, tbr, cs1, cs2, beg, backend=None, cache=False, output=None, size=BLOCKSIZE,
+                      metrics=None, max_tokens=tb.RESPONSE ):
     # INIT Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
     print( f'# BEGIN {tbeg}' )
 
     # model	 = llm.get_model( "mistral-7b-instruct-v0" )
-    model	 = llm.get_model( MODELS[mdl] )
-    conversation = model.conversation()
+    # Model is preloaded when running on `tulvingworker'
+    # Timed phases, exported to the `metrics' file, see `tulvingmetrics'
+    timings      = tmx.Metrics( script='tulving_test', model=mdl, test=test, begin=beg )
+    if backend is None:
+        with timings.timer( 'load' ):
+            backend  = tb.get_backend( tr.get_model( MODELS[mdl] ) )
+            backend.load()
+    # Unchanged prompts are answered from the response cache
+    backend      = tc.cached( backend, cache )
+    conversation = backend.conversation()
     # STEP 1: MEMO.
     tbeg         = timeit.default_timer()
-    response     = conversation.prompt( prompt_memo( tbr ) )
-    tdur         = (timeit.default_timer() - tbeg)*1000000
+    # Responses are capped as budgeted by `block_size'
+    response     = conversation.prompt( prompt_memo( tbr ), max_tokens=max_tokens )
+    tdur         = tb.elapsed( response, tbeg )
+    timings.record( 'memorize', timeit.default_timer() - tbeg )
     print( f'# MEMO {tdur}' )
-    print( TEMPL_HEADER )
-
-    if 'reco' == test:
-        for w, cue, cue_type in cs1[ beg:beg+BLOCKSIZE ]:
-            tbeg     = timeit.default_timer()
-            response = conversation.prompt( TEMPL_RECO.format( cue ) )
-            tdur     = (timeit.default_timer() - tbeg)*1000000
-            res_val  = protocol_reco_match( response.text(), w, cue )
-            res_valfp= protocol_reco_match( response.text(), w, cue,
-                                            false_positives=False,
-                                            tbr = tbr)
-            print( TEMPL_RES.format( word=w, val=res_val, valfp=res_valfp, cue=cue, txt=response.text(), cue_type=cue_type, tdur=tdur ) )
-    elif 'reca' == test:
-        prompt_id = 0
-        for w, cue, cue_type in cs1[ beg:beg+BLOCKSIZE ]:
-            # First prompt has instructions
-            prompt_txt = TEMPL_RECA.format(ex1= cs2[0][1], an1=cs2[0][0], ex2= cs2[1][1], an2=cs2[1][0], ex3= cs2[2][1], an3=cs2[2][0], cue=cue ) if 0 == prompt_id else TEMPL_RECA_FOLLOWUP.format( cue=cue )
-            prompt_id += 1
-            # print( prompt_txt )
-            tbeg     = timeit.default_timer()
-            response = conversation.prompt( prompt_txt )
-            tdur     = (timeit.default_timer() - tbeg)*1000000
-            answer   = w if w else 'None'
-            res_val  = protocol_reca_match( response.text().lower(), answer.lower() )
-            res_valfp= protocol_reco_match( response.text(), w, cue,
-                                            false_positives=False,
-                                            tbr = tbr)
-            print( TEMPL_RES.format( word=w, val=res_val, valfp=res_valfp, cue=cue, txt=response.text(), cue_type=cue_type, tdur=tdur ) )
-    else:
-        pass
+    with tsk.sink( output, COLUMNS ) as sink:
+        if 'reco' == test:
+            for w, cue, cue_type in cs1[ beg:beg+size ]:
+                tbeg     = timeit.default_timer()
+                txt      = conversation.prompt( TEMPL_RECO.format( cue ), max_tokens=max_tokens )
+                tdur     = tb.elapsed( txt, tbeg )
+                timings.record_usage( 'retrieval', timeit.default_timer() - tbeg, backend.usage, cue=cue )
+                with timings.timer( 'score' ):
+                    res_val  = protocol_reco_match( txt, w, cue )
+                    res_valfp= protocol_reco_match( txt, w, cue,
+                                                    false_positives=False,
+                                                    tbr = tbr)
+                with timings.timer( 'write' ):
+                    sink.write( ( str( w ), res_val, res_valfp, cue, txt, cue_type, round( tdur, 2 ) ) )
+        elif 'reca' == test:
+            prompt_id = 0
+            for w, cue, cue_type in cs1[ beg:beg+size ]:
+                # First prompt has instructions
+                prompt_txt = TEMPL_RECA.format(ex1= cs2[0][1], an1=cs2[0][0], ex2= cs2[1][1], an2=cs2[1][0], ex3= cs2[2][1], an3=cs2[2][0], cue=cue ) if 0 == prompt_id else TEMPL_RECA_FOLLOWUP.format( cue=cue )
+                prompt_id += 1
+                # print( prompt_txt )
+                tbeg     = timeit.default_timer()
+                txt      = conversation.prompt( prompt_txt, max_tokens=max_tokens )
+                tdur     = tb.elapsed( txt, tbeg )
+                timings.record_usage( 'retrieval', timeit.default_timer() - tbeg, backend.usage, cue=cue )
+                answer   = w if w else 'None'
+                with timings.timer( 'score' ):
+                    res_val  = protocol_reca_match( txt.lower(), answer.lower() )
+                    res_valfp= protocol_reco_match( txt, w, cue,
+                                                    false_positives=False,
+                                                    tbr = tbr)
+                with timings.timer( 'write' ):
+                    sink.write( ( str( w ), res_val, res_valfp, cue, txt, cue_type, round( tdur, 2 ) ) )
+        else:
+            pass
+        tend = timeit.default_timer()
+    timings.record( 'flush', timeit.default_timer() - tend )
+    tc.close( backend )
+    if metrics:
+        timings.export( metrics )
 
     # CLOSE Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
@@ -120,7 +174,14 @@ if __name__ == '__main__':
                                       description="Tulving Test for LLM." )
     parser.add_argument( '-t', '--test', default='reco', choices=[ 'reco', 'reca' ] )
     parser.add_argument( '-m', '--model', default='mistral', choices=[ 'mistral', 'orcamini' ] )
+    parser.add_argument( '-o', '--output', help='Session file, .csv or .parquet, appended to (default: standard output)' )
     parser.add_argument( '-b', '--begin', type=int, required=True )
+    parser.add_argument( '-s', '--size', type=int, default=BLOCKSIZE, help='Number of cues of the block' )
+    parser.add_argument( '--metrics',
+                         help='Timing and throughput of the block, .prom (Prometheus text) or .jsonl, appended to' )
+    parser.add_argument( '--cache', default=False,
+                         help="Replays and stores responses in the response cache, for deterministic decoding only",
+                         action=argparse.BooleanOptionalAction )
     args = parser.parse_args()
     # Read words from files
     with open( CUESHEET_1, 'rb' ) as f:
@@ -130,6 +191,8 @@ if __name__ == '__main__':
     with open( TESTWORDS, 'rb' ) as f:
         tbr = pickle.load( f )
 
-    protocol_session( args.model, args.test, tbr, cs1, cs2, args.begin )
+    tw.run( 'tulving_test', 'protocol_session', args.model, args.model, args.test, tbr, cs1, cs2, args.begin,
+            cache=args.cache, output=args.output, size=args.size,
+            metrics=args.metrics )
     
 
@@ -9,7 +9,12 @@ import timeit
 import pickle
 import numpy as np
 #
-import llm
+import tulvingbackend as tb
+import tulvingcache as tc
+import tulvingmetrics as tmx
+import tulvingregistry as tr
+import tulvingsink as tsk
+import tulvingworker as tw
 
 MODELS = { "orcamini": "orca-mini-3b-gguf2-q4_0",
            "mistral":  "mistral-7b-instruct-v0"
@@ -50,8 +55,8 @@ TEMPL_ORDMEMO = "Step 1. Memorize the following list of english words: {}."
 TEMPL_ORDTEST = "What is the {} word of the memorized list in Step 1?"
 
 
-TEMPL_RES    = "'{word}',{val:1d},{valfp:1d},'{cue}','{txt}','{cue_type}',{tdur:4.2f}"
-TEMPL_HEADER = "'tbrword','result','fp','cue','response','cue_type','duration'"
+# Columns of the result rows, see `tulvingsink'
+COLUMNS      = [ 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
 
 def prompt_memostr( tbr ):
     str = ""
@@ -65,31 +70,47 @@ def protocol_ord_match( txt, answer ):
 
 
 # Modified for "immediate"
-def protocol_session( mdl, tbr ):
+def protocol_session( mdl, tbr, backend=None, cache=False, output=None, metrics=None ):
     global ORDINALS
     # INIT Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
     # print( f'# BEGIN {tbeg}' )
 
-    model	 = llm.get_model( MODELS[mdl] )
-    conversation = model.conversation()
+    # Model is preloaded when running on `tulvingworker'
+    # Timed phases, exported to the `metrics' file, see `tulvingmetrics'
+    timings      = tmx.Metrics( script='tulving_test_del_order', model=mdl )
+    if backend is None:
+        with timings.timer( 'load' ):
+            backend  = tb.get_backend( tr.get_model( MODELS[mdl] ) )
+            backend.load()
+    # Unchanged prompts are answered from the response cache
+    backend      = tc.cached( backend, cache )
+    conversation = backend.conversation()
     instr        = prompt_memostr(tbr)
     
     tbeg         = timeit.default_timer()
     response     = conversation.prompt( TEMPL_ORDMEMO.format( instr ) )
-    tdur         = (timeit.default_timer() - tbeg)*1000000
+    tdur         = tb.elapsed( response, tbeg )
+    timings.record( 'memorize', timeit.default_timer() - tbeg )
     # print( f'# MEMO {tdur:4.2f}' )
     
     
-    print( TEMPL_HEADER )
-
-    for i in range( len(ORDINALS) ):
-        tbeg       = timeit.default_timer()
-        response   = conversation.prompt( TEMPL_ORDTEST.format( ORDINALS[i] ) )
-        tdur       = (timeit.default_timer() - tbeg)*1000000
-        res_val    = protocol_ord_match( response.text(), tbr[i] )
-        res_val_fp = res_val
-        print( TEMPL_RES.format( word=tbr[i], val=res_val, valfp=res_val_fp, cue='-', txt=response.text(), cue_type="ordn", tdur=tdur ) )
+    with tsk.sink( output, COLUMNS ) as sink:
+        for i in range( len(ORDINALS) ):
+            tbeg       = timeit.default_timer()
+            txt        = conversation.prompt( TEMPL_ORDTEST.format( ORDINALS[i] ) )
+            tdur       = tb.elapsed( txt, tbeg )
+            timings.record_usage( 'retrieval', timeit.default_timer() - tbeg, backend.usage, cue=ORDINALS[i] )
+            with timings.timer( 'score' ):
+                res_val    = protocol_ord_match( txt, tbr[i] )
+                res_val_fp = res_val
+            with timings.timer( 'write' ):
+                sink.write( ( tbr[i], res_val, res_val_fp, '-', txt, 'ordn', round( tdur, 2 ) ) )
+        tend = timeit.default_timer()
+    timings.record( 'flush', timeit.default_timer() - tend )
+    tc.close( backend )
+    if metrics:
+        timings.export( metrics )
     # CLOSE Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
     # print( f'# END {tbeg}' )
@@ -99,6 +120,12 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser( prog="A LLM Psychoanalyst?",
                                       description="Tulving Test for LLMs." )
     parser.add_argument( '-m', '--model', default='mistral', choices=[ 'mistral', 'orcamini' ] )
+    parser.add_argument( '-o', '--output', help='Session file, .csv or .parquet, appended to (default: standard output)' )
+    parser.add_argument( '--metrics',
+                         help='Timing and throughput, .prom (Prometheus text) or .jsonl, appended to' )
+    parser.add_argument( '--cache', default=False,
+                         help="Replays and stores responses in the response cache, for deterministic decoding only",
+                         action=argparse.BooleanOptionalAction )
 
     args = parser.parse_args()
     # Read words from files
@@ -109,6 +136,7 @@ if __name__ == '__main__':
     with open( TESTWORDS, 'rb' ) as f:
         tbr = pickle.load( f )
 
-    protocol_session( args.model, tbr )
+    tw.run( 'tulving_test_del_order', 'protocol_session', args.model, args.model, tbr, cache=args.cache, output=args.output,
+            metrics=args.metrics )
     
 
@@ -8,7 +8,13 @@ import timeit
 import pickle
 import numpy as np
 #
-import llm
+import tulvingbackend as tb
+import tulvingcache as tc
+import tulvingmetrics as tmx
+import tulvingregistry as tr
+import tulvingscore as ts
+import tulvingsink as tsk
+import tulvingworker as tw
 
 MODELS = { "orcamini": "orca-mini-3b-gguf2-q4_0",
            "mistral":  "mistral-7b-instruct-v0"
@@ -23,12 +29,17 @@ CUESHEET_2 = "\\tulving\\cues_half_2.pickle"
 BLOCKSIZE = 8
 
 # Chat templates
-TEMPL_RECO   = "1) Memorize the following list, called list S4ODV78T5G, of english words: {}.\n2) Answer YES or NO. Is the following word in the list S4ODV78T5G: {}?"
+# (Immediate prompts are the shared TEMPL_MEMO prefix followed by a probe)
+TEMPL_MEMO   = "1) Memorize the following list, called list S4ODV78T5G, of english words: {}.\n"
 
-TEMPL_RECA = "1) Memorize the following list, called list S4ODV78T5G, of english words: {}.\n2) Which word in the S4ODV78T5G list is related to the given cue: answer that word or 'None' if no word in S4ODV78T5G recalls the cue.\nCue = {}, Answer ="
+TEMPL_RECO_PROBE = "2) Answer YES or NO. Is the following word in the list S4ODV78T5G: {}?"
+TEMPL_RECO   = TEMPL_MEMO + TEMPL_RECO_PROBE
 
-TEMPL_RES    = "'{word}', {val:1d}, {valfp:1d}, '{cue}', '{txt}', '{cue_type}', {tdur:4.2f}"
-TEMPL_HEADER = "'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration'"
+TEMPL_RECA_PROBE = "2) Which word in the S4ODV78T5G list is related to the given cue: answer that word or 'None' if no word in S4ODV78T5G recalls the cue.\nCue = {}, Answer ="
+TEMPL_RECA = TEMPL_MEMO + TEMPL_RECA_PROBE
+
+# Columns of the result rows, see `tulvingsink'
+COLUMNS      = [ 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
 
 def prompt_memostr( tbr ):
     str = ""
@@ -38,11 +49,12 @@ def prompt_memostr( tbr ):
 
 # Protocol
 def protocol_reca_match( txt, answer, false_positives = True, tbr=None ):
+    # Whole words only, the study list being compiled once per session
     if txt:
         if false_positives:
-            return 1 if (txt.find( f"'{answer}'") >= 0) or (txt.find( f' {answer}' ) >= 0) or (txt.find( f'"{answer}"') >= 0) else 0
+            return 1 if ts.matcher( ( answer, ) ).search( txt ) else 0
         else:
-            return any( [ 1 if txt.find( w ) >=0 else 0 for w in tbr ] )
+            return 1 if ts.matcher( tuple( tbr ) ).search( txt ) else 0
     return 0
 
 
@@ -56,44 +68,67 @@ def protocol_reco_match( txt, answer, cue, false_positives = True, tbr=None ):
     return 0
 
 # Modified for "immediate"
-def protocol_session( mdl, test, tbr, cs1, cs2, beg ):
+def protocol_session( mdl, test, tbr, cs1, cs2, beg, prefix_cache=False, backend=None, batched=False, cache=False,
+                      output=None, metrics=None ):
     # INIT Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
     print( f'# BEGIN {tbeg}' )
 
     # model	 = llm.get_model( "mistral-7b-instruct-v0" )
-    model	 = llm.get_model( MODELS[mdl] )
+    # Model is preloaded when running on `tulvingworker'
+    # Timed phases, exported to the `metrics' file, see `tulvingmetrics'
+    timings      = tmx.Metrics( script='tulving_test_imm', model=mdl, test=test, begin=beg )
+    if backend is None:
+        with timings.timer( 'load' ):
+            backend  = tb.get_backend( tr.get_model( MODELS[mdl] ) )
+            backend.load()
+    # Unchanged prompts are answered from the response cache
+    backend      = tc.cached( backend, cache )
     instr        = prompt_memostr(tbr)
+    # With `prefix_cache', the list to memorize is evaluated once only
+    with timings.timer( 'memorize', prefix_cache=prefix_cache ):
+        probes   = backend.prefix( TEMPL_MEMO.format( instr ), cache=prefix_cache )
     
-    print( TEMPL_HEADER )
-
-    if 'reco' == test:
-        # RECOGNITION
-        for w, cue, cue_type in cs1[ beg:beg+BLOCKSIZE ]:
+    with tsk.sink( output, COLUMNS ) as sink:
+        if 'reco' == test:
+            # RECOGNITION
+            # With `batched', the block is one batched generation if supported
+            block    = cs1[ beg:beg+BLOCKSIZE ]
+            answers  = tb.timed_prompts( probes, [ TEMPL_RECO_PROBE.format( cue ) for w, cue, cue_type in block ], batched )
+            # Answers are generated as the loop asks for them
             tbeg     = timeit.default_timer()
-            response = model.prompt( TEMPL_RECO.format( instr, cue ) )
-            tdur     = (timeit.default_timer() - tbeg)*1000000
-            res_val  = protocol_reco_match( response.text(), w, cue )
-            res_valfp= protocol_reco_match( response.text(), w, cue,
-                                            false_positives=False,
-                                            tbr = tbr)
-            print( TEMPL_RES.format( word=w, val=res_val, valfp=res_valfp, cue=cue, txt=response.text(), cue_type=cue_type, tdur=tdur ) )
-    elif 'reca' == test:
-        # RECALL
-        prompt_id  = 0
-        for w, cue, cue_type in cs1[ beg:beg+BLOCKSIZE ]:
-            prompt_id += 1
-            prompt_txt = TEMPL_RECA.format( instr, cue )
-            # print( prompt_txt )
+            for ( w, cue, cue_type ), ( txt, tdur ) in zip( block, answers ):
+                timings.record_usage( 'retrieval', timeit.default_timer() - tbeg, backend.usage, cue=cue )
+                with timings.timer( 'score' ):
+                    res_val  = protocol_reco_match( txt, w, cue )
+                    res_valfp= protocol_reco_match( txt, w, cue,
+                                                    false_positives=False,
+                                                    tbr = tbr)
+                with timings.timer( 'write' ):
+                    sink.write( ( str( w ), res_val, res_valfp, cue, txt, cue_type, round( tdur, 2 ) ) )
+                tbeg     = timeit.default_timer()
+        elif 'reca' == test:
+            # RECALL
+            block    = cs1[ beg:beg+BLOCKSIZE ]
+            answers  = tb.timed_prompts( probes, [ TEMPL_RECA_PROBE.format( cue ) for w, cue, cue_type in block ], batched )
+            # Answers are generated as the loop asks for them
             tbeg     = timeit.default_timer()
-            response = model.prompt( prompt_txt )
-            tdur     = (timeit.default_timer() - tbeg)*1000000
-            answer   = w if w else 'None'
-            res_val  = protocol_reca_match( response.text().lower(), answer.lower() )
-            res_valfp= protocol_reca_match( response.text(), answer, false_positives=False, tbr = tbr)
-            print( TEMPL_RES.format( word=w, val=res_val, valfp=res_valfp, cue=cue, txt=response.text(), cue_type=cue_type, tdur=tdur ) )
-    else:
-        pass
+            for ( w, cue, cue_type ), ( txt, tdur ) in zip( block, answers ):
+                timings.record_usage( 'retrieval', timeit.default_timer() - tbeg, backend.usage, cue=cue )
+                answer   = w if w else 'None'
+                with timings.timer( 'score' ):
+                    res_val  = protocol_reca_match( txt.lower(), answer.lower() )
+                    res_valfp= protocol_reca_match( txt, answer, false_positives=False, tbr = tbr)
+                with timings.timer( 'write' ):
+                    sink.write( ( str( w ), res_val, res_valfp, cue, txt, cue_type, round( tdur, 2 ) ) )
+                tbeg     = timeit.default_timer()
+        else:
+            pass
+        tend = timeit.default_timer()
+    timings.record( 'flush', timeit.default_timer() - tend )
+    tc.close( backend )
+    if metrics:
+        timings.export( metrics )
 
     # CLOSE Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
@@ -107,7 +142,19 @@ if __name__ == '__main__':
                                       description="Tulving Test for LLMs." )
     parser.add_argument( '-t', '--test', default='reco', choices=[ 'reco', 'reca' ] )
     parser.add_argument( '-m', '--model', default='mistral', choices=[ 'mistral', 'orcamini' ] )
+    parser.add_argument( '-o', '--output', help='Session file, .csv or .parquet, appended to (default: standard output)' )
     parser.add_argument( '-b', '--begin', type=int, required=True )
+    parser.add_argument( '-p', '--prefix-cache',
+                         help="Evaluates the list to memorize once for all probes",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--batched',
+                         help="Generates the probes of a block in one batch, if the model supports it",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--metrics',
+                         help='Timing and throughput, .prom (Prometheus text) or .jsonl, appended to' )
+    parser.add_argument( '--cache', default=False,
+                         help="Replays and stores responses in the response cache, for deterministic decoding only",
+                         action=argparse.BooleanOptionalAction )
     args = parser.parse_args()
     # Read words from files
     with open( CUESHEET_1, 'rb' ) as f:
@@ -116,6 +163,8 @@ if __name__ == '__main__':
         cs2 = pickle.load( f )
     with open( TESTWORDS, 'rb' ) as f:
         tbr = pickle.load( f )
-    protocol_session( args.model, args.test, tbr, cs1, cs2, args.begin )
+    tw.run( 'tulving_test_imm', 'protocol_session', args.model, args.model, args.test, tbr, cs1, cs2, args.begin,
+            prefix_cache=bool( args.prefix_cache ), batched=bool( args.batched ), cache=args.cache,
+            output=args.output, metrics=args.metrics )
     
 
@@ -9,7 +9,12 @@ import timeit
 import pickle
 import numpy as np
 #
-import llm
+import tulvingbackend as tb
+import tulvingcache as tc
+import tulvingmetrics as tmx
+import tulvingregistry as tr
+import tulvingsink as tsk
+import tulvingworker as tw
 
 MODELS = { "orcamini": "orca-mini-3b-gguf2-q4_0",
            "mistral":  "mistral-7b-instruct-v0"
@@ -50,11 +55,15 @@ TEMPL_RECO   = "1) Memorize the following list, called list S4ODV78T5G, of engli
 TEMPL_RECA = "1) Memorize the following list, called list S4ODV78T5G, of english words: {}.\n2) Which word in the S4ODV78T5G list is related to the given cue: answer that word or 'None' if no word in S4ODV78T5G recalls the cue.\nCue = {}, Answer ="
 
 
-TEMPL_ORD = "1) Memorize the following list, called list S4ODV78T5G, of english words: {}.\n2) What is the {} word of the list?"
+# (Immediate prompts are the shared TEMPL_MEMO prefix followed by a probe)
+TEMPL_MEMO = "1) Memorize the following list, called list S4ODV78T5G, of english words: {}.\n"
 
+TEMPL_ORD_PROBE = "2) What is the {} word of the list?"
+TEMPL_ORD = TEMPL_MEMO + TEMPL_ORD_PROBE
 
-TEMPL_RES    = "'{word}',{val:1d},{valfp:1d},'{cue}','{txt}','{cue_type}',{tdur:4.2f}"
-TEMPL_HEADER = "'tbrword','result','fp','cue','response','cue_type','duration'"
+
+# Columns of the result rows, see `tulvingsink'
+COLUMNS      = [ 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
 
 def prompt_memostr( tbr ):
     str = ""
@@ -68,25 +77,43 @@ def protocol_ord_match( txt, answer ):
 
 
 # Modified for "immediate"
-def protocol_session( mdl, tbr ):
+def protocol_session( mdl, tbr, prefix_cache=False, backend=None, cache=False, output=None, metrics=None ):
     global ORDINALS
     # INIT Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
     # print( f'# BEGIN {tbeg}' )
 
     # model	 = llm.get_model( "mistral-7b-instruct-v0" )
-    model	 = llm.get_model( MODELS[mdl] )
+    # Model is preloaded when running on `tulvingworker'
+    # Timed phases, exported to the `metrics' file, see `tulvingmetrics'
+    timings      = tmx.Metrics( script='tulving_test_imm_order', model=mdl )
+    if backend is None:
+        with timings.timer( 'load' ):
+            backend  = tb.get_backend( tr.get_model( MODELS[mdl] ) )
+            backend.load()
+    # Unchanged prompts are answered from the response cache
+    backend      = tc.cached( backend, cache )
     instr        = prompt_memostr(tbr)
+    # With `prefix_cache', the list to memorize is evaluated once only
+    with timings.timer( 'memorize', prefix_cache=prefix_cache ):
+        probes   = backend.prefix( TEMPL_MEMO.format( instr ), cache=prefix_cache )
     
-    print( TEMPL_HEADER )
-
-    for i in range( len(ORDINALS) ):
-        tbeg       = timeit.default_timer()
-        response   = model.prompt( TEMPL_ORD.format( instr, ORDINALS[i] ) )
-        tdur       = (timeit.default_timer() - tbeg)*1000000
-        res_val    = protocol_ord_match( response.text(), tbr[i] )
-        res_val_fp = res_val
-        print( TEMPL_RES.format( word=tbr[i], val=res_val, valfp=res_val_fp, cue='-', txt=response.text(), cue_type="ordn", tdur=tdur ) )
+    with tsk.sink( output, COLUMNS ) as sink:
+        for i in range( len(ORDINALS) ):
+            tbeg       = timeit.default_timer()
+            txt        = probes.prompt( TEMPL_ORD_PROBE.format( ORDINALS[i] ) )
+            tdur       = tb.elapsed( txt, tbeg )
+            timings.record_usage( 'retrieval', timeit.default_timer() - tbeg, backend.usage, cue=ORDINALS[i] )
+            with timings.timer( 'score' ):
+                res_val    = protocol_ord_match( txt, tbr[i] )
+                res_val_fp = res_val
+            with timings.timer( 'write' ):
+                sink.write( ( tbr[i], res_val, res_val_fp, '-', txt, 'ordn', round( tdur, 2 ) ) )
+        tend = timeit.default_timer()
+    timings.record( 'flush', timeit.default_timer() - tend )
+    tc.close( backend )
+    if metrics:
+        timings.export( metrics )
     # CLOSE Chrono
     tbeg = datetime.now().isoformat( timespec='seconds' )
     # print( f'# END {tbeg}' )
@@ -97,6 +124,15 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser( prog="A LLM Psychoanalyst?",
                                       description="Tulving Test for LLMs." )
     parser.add_argument( '-m', '--model', default='mistral', choices=[ 'mistral', 'orcamini' ] )
+    parser.add_argument( '-o', '--output', help='Session file, .csv or .parquet, appended to (default: standard output)' )
+    parser.add_argument( '-p', '--prefix-cache',
+                         help="Evaluates the list to memorize once for all probes",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--metrics',
+                         help='Timing and throughput, .prom (Prometheus text) or .jsonl, appended to' )
+    parser.add_argument( '--cache', default=False,
+                         help="Replays and stores responses in the response cache, for deterministic decoding only",
+                         action=argparse.BooleanOptionalAction )
 
     args = parser.parse_args()
     # Read words from files
@@ -107,6 +143,8 @@ if __name__ == '__main__':
     with open( TESTWORDS, 'rb' ) as f:
         tbr = pickle.load( f )
 
-    protocol_session( args.model, tbr )
+    tw.run( 'tulving_test_imm_order', 'protocol_session', args.model, args.model, tbr,
+            prefix_cache=bool( args.prefix_cache ), cache=args.cache,
+            output=args.output, metrics=args.metrics )
     
 
@@ -0,0 +1,736 @@
+# tulvingbackend.py -- Model backends for the Tulving tests
+# In-process and prefix-cached prompting on top of `llm' models
+import asyncio
+import bisect
+import contextlib
+import functools
+import inspect
+import itertools
+import logging
+import math
+import os
+import re
+import threading
+import time
+import timeit
+import tulvingscore as ts
+
+# Context window of the gpt4all models, in tokens
+CONTEXT   = 2048
+# Expected tokens of a response, when not capped
+RESPONSE  = 32
+# Hugging Face `tokenizer.json' of the model, to count prompt tokens
+TOKENIZER = os.environ.get( 'TULVING_TOKENIZER' )
+# Safety margin of estimated token counts, see `get_tokenizer'
+MARGIN    = 1.25
+# Prompt of `warm_up', discarded with its timing
+WARMUP    = 'Hello.'
+
+
+class Backend:
+    """Wrapper of an `llm' model as used by `TulvingTest.perform'
+
+    Attributes
+    ----------
+    model : llm.Model
+        The wrapped model, as returned by `llm.get_model'
+    concurrent : bool
+        Whether prompts may run concurrently from several threads
+    can_batch : bool
+        Whether `batch' runs its prompts in one batched generation
+    cacheable : bool
+        Whether responses may be stored by `tulvingcache'
+    n_ctx : int
+        Context window of the model, in tokens
+    usage : dict
+        Token counts of the last response of the current thread, where
+        the backend knows them, and `ttft', the seconds to its first token
+
+    Methods
+    -------
+    load()
+        Loads the model weights, if the backend keeps them in-process.
+
+    tokenizer()
+        Returns a function counting the tokens of a text as the loaded
+        model does, or None.
+
+    options()
+        Decoding options of the prompts.
+
+    prompt( text: str, stop=None, max_tokens=None )
+        Single stateless prompt (immediate setting), returns the response
+        text. The response is streamed and generation is cancelled once
+        `stop( text )' holds, e.g. a `StopOnWords', or after `max_tokens'.
+
+    stream( text: str )
+        As `prompt', iterating over chunks of the response text.
+
+    batch( texts: [ str ], stop=None, max_tokens=None )
+        Independent prompts, returns the list of response texts.
+
+    conversation()
+        Returns a new `Conversation' (delayed setting).
+
+    prefix( text: str, cache=True )
+        Returns a `PrefixSession' answering retrieval suffixes which
+        all follow the same `text' prefix.
+    """
+
+    concurrent = True
+    can_batch  = False
+    cacheable  = True
+    n_ctx      = CONTEXT
+
+    def __init__( self, model ):
+        self.model  = model
+        self._local = threading.local()
+        self.usage  = {}
+
+
+    @property
+    def usage( self ):
+        return getattr( self._local, 'usage', {} )
+
+
+    @usage.setter
+    def usage( self, usage ):
+        self._local.usage = usage
+
+
+    @property
+    def model_id( self ):
+        return getattr( self.model, 'model_id', type( self ).__name__ )
+
+
+    def load( self ):
+        pass
+
+
+    def tokenizer( self ):
+        return None
+
+
+    def options( self ):
+        return dict( self.model.Options() )
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        self.usage = {}
+        return consume( self.model.prompt( text ), stop, max_tokens, self.usage )
+
+
+    def stream( self, text ):
+        return iter( self.model.prompt( text ) )
+
+
+    def batch( self, texts, stop=None, max_tokens=None ):
+        return [ self.prompt( text, stop, max_tokens ) for text in texts ]
+
+
+    def conversation( self ):
+        return Conversation( self )
+
+
+    def prefix( self, text, cache=True ):
+        return PrefixSession( self, text )
+
+
+
+class Conversation:
+    """Successive prompts in the same chat, returning response texts.
+
+    `restore( turns )' rebuilds the chat from ( prompt, response ) pairs,
+    e.g. from a journal; by default the prompts are sent again, which
+    only reproduces the responses with deterministic decoding.
+    """
+
+    def __init__( self, backend ):
+        self.backend      = backend
+        self.conversation = backend.model.conversation()
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        self.backend.usage = {}
+        return consume( self.conversation.prompt( text ), stop, max_tokens, self.backend.usage )
+
+
+    def restore( self, turns ):
+        for text, response in turns:
+            self.prompt( text )
+
+
+
+class PrefixSession:
+    """Probes sharing a common prefix, e.g. the list to memorize.
+
+    The default implementation sends `prefix + suffix' as a full
+    prompt for each probe, which is what the immediate protocol
+    did before prefix caching.
+    """
+
+    def __init__( self, backend, prefix ):
+        self.backend = backend
+        self.prefix  = prefix
+
+
+    def prompt( self, suffix, stop=None, max_tokens=None ):
+        return self.backend.prompt( self.prefix + suffix, stop, max_tokens )
+
+
+    def batch( self, suffixes, stop=None, max_tokens=None ):
+        if self.backend.can_batch:
+            return self.backend.batch( [ self.prefix + suffix for suffix in suffixes ], stop, max_tokens )
+        return [ self.prompt( suffix, stop, max_tokens ) for suffix in suffixes ]
+
+
+
+class Gpt4AllBackend( Backend ):
+    """Backend for `llm-gpt4all' models, keeping the model weights
+    loaded in-process. Prompts are rendered as `llm-gpt4all' does, but
+    do not reload the model, nor query the model list online, on each
+    prompt; and the llama.cpp KV cache is reused where possible.
+    (The gpt4all bindings decode a single sequence: no batching.)
+
+    The KV cache is reached through internals of the gpt4all bindings,
+    as pinned in `requirements.txt'. Other versions fall back, with a
+    warning, to the prompts and conversations of `Backend'.
+    """
+
+    # A single model context
+    concurrent = False
+
+    def __init__( self, model, n_threads=None ):
+        super().__init__( model )
+        self._gpt      = None
+        self._kv_cache = None
+        self.n_threads = n_threads
+        # Prompt template split around the user message
+        template = model.prompt_template()
+        system   = model.system_prompt()
+        self.before, _, self.after = template.partition( '%1' )
+        self.head = f'{system}\n{self.before}' if system else self.before
+        # Special case as in `llm-gpt4all'
+        self.end  = ''
+        if "<|im_start|>" in template and template.count( "<|im_start|>" ) - 1 == template.count( "<|im_end|>" ):
+            self.end = "<|im_end|>"
+
+
+    @property
+    def gpt( self ):
+        "The in-process `gpt4all.GPT4All' model, loaded on first use."
+        if self._gpt is None:
+            from gpt4all import GPT4All
+            self._gpt = GPT4All( self.model.filename(), allow_download=False, n_threads=self.n_threads,
+                                 n_ctx=self.n_ctx )
+        return self._gpt
+
+
+    @property
+    def kv_cache( self ):
+        "Whether the loaded gpt4all bindings expose the KV cache used here."
+        if self._kv_cache is None:
+            llmodel        = self.gpt.model
+            params         = inspect.signature( llmodel.prompt_model ).parameters
+            self._kv_cache = hasattr( llmodel, 'context' ) and { 'reset_context', 'special' } <= set( params )
+            if not self._kv_cache:
+                logging.warning( 'gpt4all bindings without KV cache access, see requirements.txt: '
+                                 'plain prompts and conversations' )
+                # The `llm' model loads its own weights
+                self._gpt = None
+        return self._kv_cache
+
+
+    def load( self ):
+        self.kv_cache
+
+
+    def tokenizer( self ):
+        "Counts the tokens of a text by evaluating it in a fresh context."
+        if not self.kv_cache:
+            return None
+
+        @functools.lru_cache( maxsize=None )
+        def count( text ):
+            self.generate( text, n_past=0, n_predict=0 )
+            return self.usage['prompt_tokens']
+
+        return count
+
+
+    def options( self ):
+        "Decoding options, defaulting as in `llm-gpt4all'."
+        opts = dict( self.model.Options() )
+        return {
+            'n_predict'      : opts['max_tokens'],
+            'temp'           : opts['temp'],
+            'top_k'          : opts['top_k'],
+            'top_p'          : opts['top_p'],
+            'repeat_penalty' : opts['repeat_penalty'],
+            'repeat_last_n'  : opts['repeat_last_n'],
+            'n_batch'        : opts['n_batch']
+        }
+
+
+    def generate( self, text, n_past=None, stop=None, max_tokens=None, **options ):
+        """Evaluates `text' and returns the generated text.
+
+        The KV cache is first rewound to `n_past' tokens, 0 for a fresh
+        context; with `n_past=None', `text' continues the current context.
+        Generation stops early once `stop( text )' holds.
+        """
+        tokens  = []
+        first   = []
+        tbeg    = timeit.default_timer()
+        llmodel = self.gpt.model
+        opts    = self.options()
+        opts.update( options )
+        if max_tokens is not None:
+            opts['n_predict'] = min( opts['n_predict'], max_tokens )
+
+        def callback( token_id, response ):
+            if not tokens:
+                first.append( timeit.default_timer() - tbeg )
+            tokens.append( response )
+            return stop is None or not stop( ''.join( tokens ) )
+
+        if n_past and llmodel.context is not None:
+            llmodel.context.n_past = n_past
+        n_beg   = 0 if 0 == n_past or llmodel.context is None else llmodel.context.n_past
+        llmodel.prompt_model( text, '%1', callback, reset_context=(0 == n_past), special=True, **opts )
+        self.usage = { 'prompt_tokens'   : llmodel.context.n_past - n_beg - len( tokens ),
+                       'response_tokens' : len( tokens ) }
+        if first:
+            self.usage['ttft'] = first[0]
+        return ''.join( tokens )
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        if not self.kv_cache:
+            return super().prompt( text, stop, max_tokens )
+        return self.generate( self.head + text + self.after, n_past=0, stop=stop, max_tokens=max_tokens )
+
+
+    def stream( self, text ):
+        if not self.kv_cache:
+            return super().stream( text )
+        return self.gpt.model.prompt_model_streaming( self.head + text + self.after, '%1',
+                                                      reset_context=True, special=True,
+                                                      **self.options() )
+
+
+    def conversation( self ):
+        return Gpt4AllConversation( self ) if self.kv_cache else Conversation( self )
+
+
+    def prefix( self, text, cache=True ):
+        return Gpt4AllPrefixSession( self, text ) if cache and self.kv_cache else PrefixSession( self, text )
+
+
+
+class Gpt4AllConversation( Conversation ):
+    """Chat continuing the KV cache: each prompt evaluates only its own
+    block, after the previous prompts and responses.
+    """
+
+    def __init__( self, backend ):
+        self.backend = backend
+        self.turns   = 0
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        backend = self.backend
+        if 0 == self.turns:
+            txt = backend.generate( backend.head + text + backend.after, n_past=0, stop=stop, max_tokens=max_tokens )
+        else:
+            txt = backend.generate( backend.end + backend.before + text + backend.after, stop=stop, max_tokens=max_tokens )
+        self.turns += 1
+        return txt
+
+
+    def restore( self, turns ):
+        # Evaluates the recorded responses in place of generating them
+        backend = self.backend
+        for text, response in turns:
+            if 0 == self.turns:
+                backend.generate( backend.head + text + backend.after + response, n_past=0, n_predict=0 )
+            else:
+                backend.generate( backend.end + backend.before + text + backend.after + response, n_predict=0 )
+            self.turns += 1
+
+
+
+class Gpt4AllPrefixSession( PrefixSession ):
+    """Evaluates the prefix once and runs each suffix from the snapshot.
+
+    The llama.cpp KV cache keeps the evaluated prefix; the snapshot is
+    the number of prefix tokens `n_past'. Rewinding `n_past' before each
+    suffix discards the previous probe, so that probes stay independent.
+    """
+
+    def __init__( self, backend, prefix ):
+        super().__init__( backend, prefix )
+        backend.generate( backend.head + prefix, n_past=0, n_predict=0 )
+        self.n_past = backend.gpt.model.context.n_past
+        logging.info( f'Prefix cached: {self.n_past} tokens' )
+
+
+    def prompt( self, suffix, stop=None, max_tokens=None ):
+        return self.backend.generate( suffix + self.backend.after, n_past=self.n_past, stop=stop, max_tokens=max_tokens )
+
+
+
+class FakeBackend( Backend ):
+    """Deterministic in-process stand-in for a model, e.g. to exercise
+    concurrency or the test harness without loading model weights.
+
+    Each prompt sleeps `latency' seconds then returns `respond( text )'.
+    By default the response is YES when the last word of the prompt,
+    i.e. the cue, appears earlier in the prompt, and NO otherwise.
+    A batch of prompts sleeps `latency' seconds once.
+    """
+
+    can_batch = True
+    # Responses depend on `respond', which is not part of the cache key
+    cacheable = False
+
+    def __init__( self, respond=None, latency=0. ):
+        super().__init__( None )
+        self.respond = respond if respond else FakeBackend.recognize
+        self.latency = latency
+
+
+    @staticmethod
+    def recognize( text ):
+        words = text.replace( '?', ' ' ).replace( ',', ' ' ).replace( '.', ' ' ).split()
+        return ' YES' if words and words[-1] in words[ :-1 ] else ' NO'
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        tbeg       = timeit.default_timer()
+        time.sleep( self.latency )
+        self.usage = {}
+        return consume( self.chunks( self.respond( text ) ), stop, max_tokens, self.usage, tbeg )
+
+
+    @staticmethod
+    def chunks( txt ):
+        "Words of `txt' with their leading spaces, as streamed tokens."
+        return iter( re.findall( r'\s*\S+', txt ) )
+
+
+    def stream( self, text ):
+        return self.chunks( self.prompt( text ) )
+
+
+    def batch( self, texts, stop=None, max_tokens=None ):
+        time.sleep( self.latency )
+        self.usage = {}
+        return [ consume( self.chunks( self.respond( text ) ), stop, max_tokens ) for text in texts ]
+
+
+    def conversation( self ):
+        return FakeConversation( self )
+
+
+
+class FakeConversation( Conversation ):
+    "Conversation of a `FakeBackend', responding to the whole chat so far."
+
+    def __init__( self, backend ):
+        self.backend = backend
+        self.history = ''
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        self.history += text + ' '
+        return self.backend.prompt( self.history, stop, max_tokens )
+
+
+    def restore( self, turns ):
+        for text, response in turns:
+            self.history += text + ' '
+
+
+
+class Response( str ):
+    """Response text with the `usage' of the backend which generated it,
+    and the original `duration' of a response read from `tulvingcache'.
+    """
+
+    def __new__( cls, txt, usage=None ):
+        response          = super().__new__( cls, txt )
+        response.usage    = dict( usage or {} )
+        response.duration = getattr( txt, 'duration', None )
+        return response
+
+
+
+class AsyncBackend:
+    """asyncio interface of a `Backend'
+
+    Blocking calls run in worker threads. Backends which are not
+    `concurrent', e.g. in-process models with a single context, run
+    one prompt, or one whole conversation, at a time. Single responses
+    are `Response' texts, with their token usage.
+
+    Methods
+    -------
+    async prompt( text: str, stop=None, max_tokens=None )
+        As `Backend.prompt'.
+
+    async stream( text: str )
+        Async iterator over chunks of the response text.
+
+    async conversation()
+        Returns an `AsyncConversation', to be used with `async with'.
+
+    async batch( texts: [ str ], stop=None, max_tokens=None )
+        As `Backend.batch'.
+
+    async prefix( text: str, cache=True )
+        Returns an `AsyncPrefixSession'.
+    """
+
+    def __init__( self, backend ):
+        self.backend = backend
+        self.lock    = None if backend.concurrent else asyncio.Lock()
+
+
+    def exclusive( self ):
+        "Async context manager holding the backend if not `concurrent'."
+        return self.lock if self.lock else contextlib.nullcontext()
+
+
+    def measured( self, call, *args ):
+        "The `Response' of `call( *args )', with the usage of the backend in this thread."
+        return Response( call( *args ), self.backend.usage )
+
+
+    async def prompt( self, text, stop=None, max_tokens=None ):
+        async with self.exclusive():
+            return await asyncio.to_thread( self.measured, self.backend.prompt, text, stop, max_tokens )
+
+
+    async def batch( self, texts, stop=None, max_tokens=None ):
+        async with self.exclusive():
+            return await asyncio.to_thread( self.backend.batch, texts, stop, max_tokens )
+
+
+    async def stream( self, text ):
+        async with self.exclusive():
+            chunks = await asyncio.to_thread( self.backend.stream, text )
+            while True:
+                chunk = await asyncio.to_thread( next, chunks, None )
+                if chunk is None:
+                    break
+                yield chunk
+
+
+    async def conversation( self ):
+        return AsyncConversation( self, self.backend.conversation() )
+
+
+    async def prefix( self, text, cache=True ):
+        async with self.exclusive():
+            session = await asyncio.to_thread( self.backend.prefix, text, cache )
+        return AsyncPrefixSession( self, session )
+
+
+
+class AsyncConversation:
+    """Conversation of an `AsyncBackend'; prompts are sequential, and
+    the backend is held from `async with' entry to exit if needed.
+    """
+
+    def __init__( self, backend, conversation ):
+        self.backend      = backend
+        self.conversation = conversation
+        self.held         = backend.exclusive()
+
+
+    async def __aenter__( self ):
+        await self.held.__aenter__()
+        return self
+
+
+    async def __aexit__( self, *exc ):
+        return await self.held.__aexit__( *exc )
+
+
+    async def prompt( self, text, stop=None, max_tokens=None ):
+        return await asyncio.to_thread( self.backend.measured, self.conversation.prompt, text, stop, max_tokens )
+
+
+    async def restore( self, turns ):
+        return await asyncio.to_thread( self.conversation.restore, turns )
+
+
+
+class AsyncPrefixSession:
+    "Prefix session of an `AsyncBackend'."
+
+    def __init__( self, backend, session ):
+        self.backend = backend
+        self.session = session
+
+
+    async def prompt( self, suffix, stop=None, max_tokens=None ):
+        async with self.backend.exclusive():
+            return await asyncio.to_thread( self.backend.measured, self.session.prompt, suffix, stop, max_tokens )
+
+
+    async def batch( self, suffixes, stop=None, max_tokens=None ):
+        async with self.backend.exclusive():
+            return await asyncio.to_thread( self.session.batch, suffixes, stop, max_tokens )
+
+
+
+class StopOnWords:
+    """Stop condition of a streamed response: one of `words' is complete,
+    i.e. followed by a non-word character, case insensitive. E.g. the first
+    YES or NO of a recognition, or the first study-list word of a recall.
+    """
+
+    def __init__( self, words ):
+        self.words = sorted( set( w.lower() for w in words if w ) )
+        self.regex = re.compile( r'\b(?:{})(?=\W)'.format( ts.trie_pattern( self.words ) ), re.IGNORECASE )
+
+
+    def __call__( self, txt ):
+        return self.regex.search( txt ) is not None
+
+
+    def __repr__( self ):
+        return f'StopOnWords({self.words})'
+
+
+
+def consume( chunks, stop=None, max_tokens=None, usage=None, tbeg=None ):
+    """Joins the chunks of a streamed response until `stop( text )' holds
+    or `max_tokens' chunks are read, then closes the stream.
+
+    A `usage' dict gets the number of chunks read, `response_tokens',
+    and `ttft', the seconds to the first chunk from `tbeg' or the call.
+    """
+    tbeg   = timeit.default_timer() if tbeg is None else tbeg
+    txt, n = '', 0
+    for n, chunk in enumerate( chunks, 1 ):
+        if 1 == n and usage is not None:
+            usage['ttft'] = timeit.default_timer() - tbeg
+        txt += chunk
+        if ( stop is not None and stop( txt ) ) or ( max_tokens is not None and n >= max_tokens ):
+            break
+    if hasattr( chunks, 'close' ):
+        chunks.close()
+    if usage is not None:
+        usage['response_tokens'] = n
+    return txt
+
+
+
+def timed_prompts( session, suffixes, batched=False ):
+    """Yields the response text and duration (microseconds) of each
+    suffix of a `PrefixSession'.
+
+    With `batched', backends which `can_batch' answer all suffixes in one
+    call, and the duration of each is its share of the batch duration.
+    """
+    if batched and session.backend.can_batch:
+        tbeg = timeit.default_timer()
+        txts = session.batch( suffixes )
+        tdur = (timeit.default_timer() - tbeg)*1000000 / max( 1, len( suffixes ) )
+        for txt in txts:
+            yield txt, getattr( txt, 'duration', None ) or tdur
+    else:
+        for suffix in suffixes:
+            tbeg = timeit.default_timer()
+            txt  = session.prompt( suffix )
+            yield txt, elapsed( txt, tbeg )
+
+
+
+def warm_up( backend, text=WARMUP, max_tokens=1 ):
+    """Sends a first, discarded, prompt to `backend', so that the cold
+    start of the model after loading is not timed with the first probe;
+    returns its duration in seconds.
+    """
+    tbeg = timeit.default_timer()
+    backend.prompt( text, max_tokens=max_tokens )
+    return timeit.default_timer() - tbeg
+
+
+
+def elapsed( txt, tbeg ):
+    """Duration (microseconds) of the response `txt' started at `tbeg',
+    or the original duration of a response read from `tulvingcache'.
+    """
+    duration = getattr( txt, 'duration', None )
+    return duration if duration is not None else (timeit.default_timer() - tbeg)*1000000
+
+
+
+def estimate_tokens( text ):
+    """Approximate token count of `text': a token per punctuation mark,
+    per digit, and per four letters of a word, as subword tokenizers
+    split words; a token per letter of words which are not ASCII.
+    """
+    return sum( 1 if not piece.isalpha() else math.ceil( len( piece ) / 4 ) if piece.isascii() else len( piece )
+                for piece in re.findall( r'\d|[^\W\d_]+|[^\w\s]|_', text ) )
+
+
+
+def estimate_with_margin( text ):
+    "`estimate_tokens' of `text', increased by the safety `MARGIN'."
+    return math.ceil( MARGIN * estimate_tokens( text ) )
+
+estimate_with_margin.estimated = True
+
+
+
+def get_tokenizer( path=TOKENIZER, backend=None ):
+    """Returns a function counting the tokens of a text.
+
+    With `path', a Hugging Face `tokenizer.json' of the model, tokens
+    are counted by the `tokenizers' package, without loading the model
+    weights; else by the loaded `backend', if it has a `tokenizer';
+    otherwise they are estimated by `estimate_with_margin', which has
+    an `estimated' attribute.
+    """
+    if not path:
+        return ( backend and backend.tokenizer() ) or estimate_with_margin
+    from tokenizers import Tokenizer
+    tokenizer = Tokenizer.from_file( path )
+    return lambda text: len( tokenizer.encode( text, add_special_tokens=False ).ids )
+
+
+
+class ContextError( Exception ):
+    pass
+
+
+
+def fit_probes( prefix, probes, n_ctx=CONTEXT, period=1 ):
+    """Largest number of consecutive probes which fit in one conversation
+    of `n_ctx' tokens, in multiples of `period'; 0 when none fits.
+
+    The conversation opens with `prefix' tokens, then each probe takes
+    the tokens of its prompt and response, `probes' in order.
+    """
+    n = bisect.bisect_right( list( itertools.accumulate( probes, initial=prefix ) ), n_ctx ) - 1
+    return max( 0, n - n % period )
+
+
+
+def get_backend( model, n_threads=None ):
+    """Returns the best `Backend' for an `llm' model.
+
+    `n_threads' limits the CPU threads of in-process models.
+    """
+    try:
+        import llm_gpt4all
+    except ImportError:
+        return Backend( model )
+    if isinstance( model, llm_gpt4all.Gpt4AllModel ):
+        return Gpt4AllBackend( model, n_threads=n_threads )
+    return Backend( model )
@@ -0,0 +1,508 @@
+# tulvingbench.py -- Benchmarks of the test harness on a fake model
+# Times the Python side of the tests: filling sessions, formatting the
+# prompts, scoring, writing and tabulating the results, against a
+# deterministic in-process model, so that the harness overhead can be
+# compared from run to run in a history file.
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import zlib
+from contextlib import redirect_stdout
+import numpy as np
+#
+import tulvingbackend as tb
+import tulvingdata as td
+import tulvinglib as tl
+import tulvingmem as tm
+import tulvingsink as tsk
+import tulvingstats as tst
+import TulvingTabulator as tt
+from tulving import cues
+import tulving_test
+import tulving_test_imm
+import tulving_test_del_order
+import tulving_test_imm_order
+
+# Sizes of the benchmarks: words of the word lists, number of sessions
+SIZES     = { 'small'    : { 'words' : 100,   'sessions' : 10 },
+              'lists'    : { 'words' : 10000, 'sessions' : 10 },
+              'sessions' : { 'words' : 100,   'sessions' : 1000 } }
+# Latency of the fake model: distribution and mean seconds
+LATENCY   = ( 'const', 0. )
+# Share of each kind of response of the fake model, see `BenchBackend'
+RESPONSES = { 'yes' : .35, 'no' : .35, 'cue' : .1, 'list' : .1, 'none' : .1 }
+# Words padding the responses
+FILLER    = [ 'because', 'the', 'word', 'was', 'in', 'list' ]
+# Appended to by each run, see `compare'
+HISTORY   = 'tulvingbench.jsonl'
+# Slowdown beyond which a case is reported as a regression
+TOLERANCE = .1
+# Bootstrap resamples of the tabulation benchmark
+RESAMPLES = 1000
+# Model name of the result files
+MODEL     = 'bench'
+TEMPL_LIB = "merge_{test}_{chrono}_" + MODEL + "_session_{session}.csv"
+
+
+class BenchError( Exception ):
+    pass
+
+
+class BenchBackend( tb.FakeBackend ):
+    """`FakeBackend' with seeded distributions of latencies and responses
+
+    Each prompt draws its latency and response from uniforms hashed from
+    its text and the `seed', so that the same prompt always gets the
+    same response, whatever the order or concurrency of the prompts.
+
+    Attributes
+    ----------
+    latency: ( str, float )
+        Distribution, `const', `exp' or `lognormal', and mean seconds
+    responses: { str : float }
+        Share of each kind of response: `yes', `no', `none' (the words
+        YES, NO, None), `cue' (the last word of the prompt) and `list'
+        (any word of the prompt)
+    length: float
+        Mean number of words padding the responses, exponentially
+        distributed
+    seed: int
+    """
+
+    def __init__( self, latency=LATENCY, responses=RESPONSES, length=0., seed=0 ):
+        super().__init__( self.answer )
+        self.latency   = latency
+        self.responses = responses
+        self.length    = length
+        self.seed      = seed
+        if latency[0] not in [ 'const', 'exp', 'lognormal' ]:
+            raise BenchError( f'Unknown latency distribution {latency[0]}' )
+        if not responses or any( share < 0 for share in responses.values() ) or not sum( responses.values() ):
+            raise BenchError( f'Invalid response shares {responses}' )
+
+
+    def uniforms( self, text ):
+        "Three uniforms in [0, 1) of `text'."
+        h = zlib.crc32( text.encode( 'utf-8' ), self.seed )
+        u = [ h ]
+        for _ in range( 2 ):
+            u.append( zlib.crc32( u[-1].to_bytes( 4, 'little' ), self.seed ) )
+        return [ x / 2**32 for x in u ]
+
+
+    def delay( self, u ):
+        kind, mean = self.latency
+        if 'exp' == kind:
+            return -mean * math.log( 1 - u[0] )
+        if 'lognormal' == kind and mean > 0:
+            # Unit variance of the log, Box-Muller on two uniforms
+            z = math.sqrt( -2 * math.log( 1 - u[0] ) ) * math.cos( 2 * math.pi * u[1] )
+            return mean * math.exp( z - .5 )
+        return mean
+
+
+    def answer( self, text, u=None ):
+        u      = self.uniforms( text ) if u is None else u
+        x, acc = u[1] * sum( self.responses.values() ), 0.
+        for kind, share in self.responses.items():
+            acc += share
+            if x < acc:
+                break
+        if 'cue' == kind or 'list' == kind:
+            words = text.replace( '?', ' ' ).replace( ',', ' ' ).replace( '.', ' ' ).split() or [ 'None' ]
+            word  = words[-1] if 'cue' == kind else words[ int( u[2] * len( words ) ) ]
+        else:
+            word  = { 'yes' : 'YES', 'no' : 'NO' }.get( kind, 'None' )
+        padding = int( -self.length * math.log( 1 - u[2] ) )
+        return ' ' + ' '.join( [ word ] + [ FILLER[ i % len( FILLER ) ] for i in range( padding ) ] )
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        tbeg  = timeit.default_timer()
+        u     = self.uniforms( text )
+        delay = self.delay( u )
+        if delay > 0:
+            time.sleep( delay )
+        self.usage = {}
+        return tb.consume( self.chunks( self.answer( text, u ) ), stop, max_tokens, self.usage, tbeg )
+
+
+    def batch( self, texts, stop=None, max_tokens=None ):
+        # The batch is as slow as its slowest prompt
+        u     = [ self.uniforms( text ) for text in texts ]
+        delay = max( [ self.delay( x ) for x in u ], default=0. )
+        if delay > 0:
+            time.sleep( delay )
+        self.usage = {}
+        return [ tb.consume( self.chunks( self.answer( text, x ) ), stop, max_tokens ) for text, x in zip( texts, u ) ]
+
+
+
+def word( i, prefix='w' ):
+    "A distinct, letters only, word for each `i'."
+    s = ''
+    while True:
+        i, r = divmod( i, 26 )
+        s   += chr( ord( 'a' ) + r )
+        if not i:
+            return prefix + s
+
+
+def word_bank( words ):
+    """Synthetic word bank of `words' TBR words, each with its NCAW and
+    NCRW cues, and of NTBR words, as `cues.read_bank'.
+    """
+    tbr_words  = [ ( word( i ), word( i, 'a' ), word( i, 'r' ) ) for i in range( max( words, cues.SHEET_TBR ) ) ]
+    ntbr_words = [ word( i, 'n' ) for i in range( max( words // 3, cues.SHEET_NTBR ) ) ]
+    return tbr_words, ntbr_words
+
+
+def write_word_files( dirname, words ):
+    """Writes the word lists of the `tulvinglib' tests, as `tm_words0023.csv'
+    and `tw_cues.csv', with `words' words; returns their paths by test.
+    """
+    tbr_words, ntbr_words = word_bank( words )
+    paths = { test : os.path.join( dirname, f'words_{test}.csv' ) for test in [ 'reco', 'ord', 'tw' ] }
+    with open( paths['reco'], 'w', newline='' ) as f:
+        out = csv.writer( f )
+        out.writerow( [ 'T', 'C', 'A', 'R', 'D' ] )
+        out.writerows( [ w, w, ncaw, ncrw, 'none' ] for ( w, ncaw, ncrw ) in tbr_words )
+        out.writerows( [ 'none' ]*4 + [ w ] for w in ntbr_words )
+    with open( paths['ord'], 'w', newline='' ) as f:
+        out = csv.writer( f )
+        out.writerow( [ 'T', 'O' ] )
+        out.writerows( [ w, ordinal( i ) ] for i, ( w, ncaw, ncrw ) in enumerate( tbr_words ) )
+    with open( paths['tw'], 'w', newline='' ) as f:
+        out = csv.writer( f )
+        out.writerow( [ 'target', 'acue', 'aduration', 'rcue', 'rduration', 'altacue', 'altrcue' ] )
+        out.writerows( [ w, ncaw, 0., ncrw, 0., word( i, 'b' ), word( i, 's' ) ]
+                       for i, ( w, ncaw, ncrw ) in enumerate( tbr_words ) )
+    paths['reca'] = paths['reco']
+    return paths
+
+
+def ordinal( i ):
+    ordinals = tulving_test_imm_order.ORDINALS
+    return ordinals[ i ].strip() if i < len( ordinals ) else f'{i + 1}th'
+
+
+
+class Bench:
+    """Benchmark cases of the harness on a `BenchBackend'
+
+    Sessions are seeded by their number, and their results written to
+    the `workdir', where the tabulation cases read them.
+
+    Attributes
+    ----------
+    words, sessions: int
+        Words of the word lists, and number of sessions of each case
+    backend: BenchBackend
+    workdir: str
+    resamples: int
+        Bootstrap resamples of the tabulation case
+    cases: { str : function }
+        The cases by name, each returning its number of probes
+
+    Methods
+    -------
+    run( names=None )
+        Times the cases `names', all by default, in order; returns their
+        seconds, sessions, probes and microseconds per probe, by name.
+    """
+
+    def __init__( self, workdir, words, sessions, backend, resamples=RESAMPLES ):
+        self.workdir   = workdir
+        self.words     = words
+        self.sessions  = sessions
+        self.backend   = backend
+        self.resamples = resamples
+        self.libdir    = os.path.join( workdir, 'tulvinglib' )
+        self.testdir   = os.path.join( workdir, 'tulving_test' )
+        os.makedirs( self.libdir, exist_ok=True )
+        os.makedirs( self.testdir, exist_ok=True )
+        self.files     = write_word_files( workdir, words )
+        self.done      = set()
+        self.cases     = {}
+        for test in [ 'reco', 'reca', 'ord', 'tw' ]:
+            for chrono in [ 'imm', 'del' ]:
+                self.cases[ f'tulvinglib:{test}:{chrono}' ] = self.lib_case( test, chrono )
+        for mod in [ tulving_test_imm, tulving_test ]:
+            for test in [ 'reco', 'reca' ]:
+                self.cases[ f'{mod.__name__}:{test}' ] = self.test_case( mod, test )
+        for mod in [ tulving_test_imm_order, tulving_test_del_order ]:
+            self.cases[ mod.__name__ ] = self.order_case( mod )
+        self.cases[ 'tulving_tabulate' ] = self.tabulate
+        self.cases[ 'TulvingTabulator' ] = self.tabulate_tw
+
+
+    def lib_case( self, test, chrono ):
+        def case():
+            run    = { 'reco' : tl.test_recognition, 'reca' : tl.test_recall,
+                       'ord' : tl.test_ordering, 'tw' : tl.test_tw }[ test ]
+            chrono_type = tm.TulvingTest.TYPE_PROMPT if 'imm' == chrono else tm.TulvingTest.TYPE_CHAT
+            probes = 0
+            for session in range( self.sessions ):
+                name = f'tw_session_{session}.csv' if 'tw' == test and 'imm' == chrono else \
+                       TEMPL_LIB.format( test=test, chrono=chrono, session=session )
+                fn   = os.path.join( self.libdir, name )
+                if os.path.exists( fn ):
+                    os.remove( fn )
+                # `fill' draws from the global generator
+                np.random.seed( session )
+                run( chrono_type, self.files[ test ], MODEL, backend=self.backend, cache=False, output=fn )
+                probes += count_rows( fn )
+            return probes
+        return case
+
+
+    def cuesheets( self ):
+        tbr_words, ntbr_words = word_bank( self.words )
+        return cues.generate_cuesheets( range( self.sessions ), 0, tbr_words, ntbr_words )
+
+
+    def test_case( self, mod, test ):
+        chrono = 'imm' if mod is tulving_test_imm else 'del'
+        def case():
+            probes = 0
+            for session, tbr, cso, csa in self.cuesheets():
+                fn = os.path.join( self.testdir, TEMPL_LIB.format( test=test, chrono=chrono, session=session ) )
+                if os.path.exists( fn ):
+                    os.remove( fn )
+                with tsk.open_sink( fn, tulving_test.COLUMNS ) as sink, redirect_stdout( io.StringIO() ):
+                    for beg in range( 0, len( cso ), mod.BLOCKSIZE ):
+                        mod.protocol_session( MODEL, test, tbr, cso, csa, beg, backend=self.backend, cache=False,
+                                              output=sink )
+                probes += count_rows( fn )
+            return probes
+        return case
+
+
+    def order_case( self, mod ):
+        chrono = 'imm' if mod is tulving_test_imm_order else 'del'
+        def case():
+            probes = 0
+            for session, tbr, cso, csa in self.cuesheets():
+                fn = os.path.join( self.testdir, TEMPL_LIB.format( test='ord', chrono=chrono, session=session ) )
+                if os.path.exists( fn ):
+                    os.remove( fn )
+                with tsk.open_sink( fn, tulving_test.COLUMNS ) as sink, redirect_stdout( io.StringIO() ):
+                    mod.protocol_session( MODEL, tbr, backend=self.backend, cache=False, output=sink )
+                probes += count_rows( fn )
+            return probes
+        return case
+
+
+    def require( self, names ):
+        "Runs, untimed, the cases `names' not yet run, e.g. writing the results to tabulate."
+        for name in names:
+            if name not in self.done:
+                self.cases[ name ]()
+                self.done.add( name )
+
+
+    def tabulate( self ):
+        # The tabulator plots with `matplotlib'
+        from tulving import tulving_tabulate as ttab
+        self.require( [ name for name in self.cases if name.startswith( 'tulving_test' ) ] )
+        sessions = list( range( self.sessions ) )
+        ttab.OUTPUT_DIR, ttab.MODEL, ttab.SESSIONS = self.testdir, MODEL, sessions
+        tbr      = [ w for ( w, ncaw, ncrw ) in word_bank( self.words )[0] ]
+        probes   = 0
+        for chrono in [ 'Immediate', 'Delayed' ]:
+            reco, reca = ttab.tulving_results( chrono, columns=[ 'tbrword' ] )
+            for df in [ reco, reca ]:
+                ttab.summary( df, True )
+                ttab.summary_ci( df, True, chrono, self.resamples )
+                ttab.tulving_occurences( df, tbr, ttab.CUEGROUPS )
+                ttab.tulving_hit_matrix( df, tbr, sessions )
+                probes += len( df.index )
+        for df in ttab.tulving_ordering_results():
+            tst.mean_ci( df, 'result', resamples=self.resamples )
+        df = ttab.tulving_latency_results()
+        tst.latency_table( df, [ 'task', 'chrono', 'model', 'cue_type' ] )
+        tst.latency_table( df, [ 'chrono', 'model', 'position' ] )
+        return probes + len( df.index )
+
+
+    def tabulate_tw( self ):
+        self.require( [ 'tulvinglib:tw:imm' ] )
+        sessions   = list( range( self.sessions ) )
+        ttab       = tt.TulvingTabulator( self.libdir )
+        tables     = ttab.session_tables( sessions )
+        tst.bootstrap( tables.reshape( -1, 16 ).T, tables.sum( axis=2 ).repeat( 4, axis=1 ).T, self.resamples )
+        dmXY, dmYX = ttab.data_matrices( sessions )
+        ttab.trace_mats( dmXY, dmYX )
+        df         = ttab.read_latencies( sessions )
+        tst.latency_table( df, [ 'chrono', 'model', 'position' ] )
+        return len( df.index )
+
+
+    def run( self, names=None ):
+        results = {}
+        for name in names or list( self.cases ):
+            if name not in self.cases:
+                raise BenchError( f'Unknown case {name}' )
+            try:
+                tbeg   = timeit.default_timer()
+                probes = self.cases[ name ]()
+                secs   = timeit.default_timer() - tbeg
+            except ImportError as e:
+                logging.warning( f'Bench: {name} skipped: {e}' )
+                continue
+            self.done.add( name )
+            results[ name ] = { 'seconds'  : secs,
+                                'sessions' : self.sessions,
+                                'probes'   : probes,
+                                'us_per_probe' : secs * 1000000 / max( 1, probes ) }
+            print( f'{name}: {secs:.3f}s, {probes} probes', file=sys.stderr )
+        return results
+
+
+
+def count_rows( fn ):
+    "Rows of a result CSV file."
+    return len( td.read_csv_rows( fn )[1] )
+
+
+def git_commit():
+    "Commit of the working tree, or None."
+    try:
+        return subprocess.run( [ 'git', 'rev-parse', '--short', 'HEAD' ], capture_output=True, text=True,
+                               cwd=os.path.dirname( os.path.abspath( __file__ ) ), check=True ).stdout.strip()
+    except ( OSError, subprocess.CalledProcessError ):
+        return None
+
+
+def record( results, config ):
+    "History record of the `results' of a run of `config'."
+    return { 'time'     : time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+             'commit'   : git_commit(),
+             'python'   : platform.python_version(),
+             'platform' : platform.platform(),
+             'config'   : config,
+             'cases'    : results }
+
+
+def read_history( path ):
+    "Records of the history file `path', oldest first."
+    if not os.path.exists( path ):
+        return []
+    with open( path, encoding='utf-8' ) as f:
+        return [ json.loads( line ) for line in f if line.strip() ]
+
+
+def append_history( path, rec ):
+    with open( path, 'a', encoding='utf-8' ) as f:
+        f.write( json.dumps( rec ) + '\n' )
+
+
+def compare( rec, history, tolerance=TOLERANCE ):
+    """Compares the cases of `rec' with the last record of the `history'
+    of the same config; returns the report lines and the regressed cases,
+    slower per probe by more than `tolerance'.
+    """
+    base = next( ( h for h in reversed( history ) if h['config'] == rec['config'] ), None )
+    if base is None:
+        return [ 'No previous run of this configuration' ], []
+    lines     = [ f"Baseline {base['time']} ({base['commit']})",
+                  f"| {'case':<32} | {'us/probe':>10} | {'baseline':>10} | {'ratio':>6} |" ]
+    regressed = []
+    for name, stats in rec['cases'].items():
+        old = base['cases'].get( name )
+        if old is None:
+            lines += [ f"| {name:<32} | {stats['us_per_probe']:10.1f} | {'':>10} | {'':>6} |" ]
+            continue
+        ratio  = stats['us_per_probe'] / old['us_per_probe'] if old['us_per_probe'] else float( 'inf' )
+        flag   = ' <' if ratio > 1 + tolerance else ''
+        lines += [ f"| {name:<32} | {stats['us_per_probe']:10.1f} | {old['us_per_probe']:10.1f} | {ratio:6.2f} |{flag}" ]
+        if flag:
+            regressed.append( name )
+    return lines, regressed
+
+
+def parse_latency( spec ):
+    "Latency distribution of `DIST:SECONDS', e.g. `exp:0.001'."
+    kind, _, mean = spec.partition( ':' )
+    try:
+        return ( kind, float( mean or 0. ) )
+    except ValueError:
+        raise BenchError( f'Invalid latency {spec}' )
+
+
+def parse_responses( specs ):
+    "Response shares of `KIND=SHARE' items, e.g. `yes=.5 no=.5'."
+    responses = {}
+    for spec in specs:
+        kind, _, share = spec.partition( '=' )
+        if kind not in RESPONSES:
+            raise BenchError( f'Unknown response kind {kind}' )
+        try:
+            responses[ kind ] = float( share )
+        except ValueError:
+            raise BenchError( f'Invalid response share {spec}' )
+    return responses
+
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.WARNING )
+    parser = argparse.ArgumentParser( prog="tulvingbench",
+                                      description="Benchmarks the Tulving Test harness on a fake model." )
+    parser.add_argument( 'cases', nargs='*', help='Cases to run (default: all), see --list' )
+    parser.add_argument( '-s', '--size', default='small', choices=list( SIZES ) )
+    parser.add_argument( '-w', '--words', type=int, help='Words of the word lists (default: by size)' )
+    parser.add_argument( '-n', '--sessions', type=int, help='Sessions of each case (default: by size)' )
+    parser.add_argument( '-l', '--latency', default='{}:{}'.format( *LATENCY ),
+                         help='Latency of the fake model, DIST:SECONDS, DIST one of const, exp, lognormal' )
+    parser.add_argument( '-r', '--responses', nargs='+', default=[],
+                         help='Shares of the responses of the fake model, e.g. yes=.5 no=.4 none=.1' )
+    parser.add_argument( '--length', type=float, default=0., help='Mean words padding the responses' )
+    parser.add_argument( '--seed', type=int, default=0 )
+    parser.add_argument( '--resamples', type=int, default=RESAMPLES,
+                         help='Bootstrap resamples of the tabulation cases' )
+    parser.add_argument( '-H', '--history', default=HISTORY, help='History file, appended to' )
+    parser.add_argument( '--no-history', action='store_true', help='Does not append the run to the history' )
+    parser.add_argument( '-t', '--tolerance', type=float, default=TOLERANCE,
+                         help='Slowdown per probe reported as a regression, e.g. 0.1' )
+    parser.add_argument( '--check', action='store_true', help='Exits with an error on regressions' )
+    parser.add_argument( '--list', action='store_true', help='Lists the cases' )
+    parser.add_argument( '-d', '--workdir', help='Directory of the result files (default: temporary)' )
+    args = parser.parse_args()
+    #
+    size   = dict( SIZES[ args.size ] )
+    size.update( { key : value for key, value in [ ( 'words', args.words ), ( 'sessions', args.sessions ) ]
+                   if value is not None } )
+    try:
+        backend = BenchBackend( parse_latency( args.latency ), parse_responses( args.responses ) or RESPONSES,
+                                args.length, args.seed )
+    except BenchError as e:
+        parser.error( str( e ) )
+    config = dict( size, latency=list( backend.latency ), responses=backend.responses, length=args.length,
+                   seed=args.seed, resamples=args.resamples )
+    with ( contextlib.nullcontext( args.workdir ) if args.workdir else tempfile.TemporaryDirectory() ) as workdir:
+        bench = Bench( workdir, size['words'], size['sessions'], backend, args.resamples )
+        if args.list:
+            print( '\n'.join( bench.cases ) )
+            sys.exit( 0 )
+        try:
+            results = bench.run( args.cases )
+        except BenchError as e:
+            parser.error( str( e ) )
+    rec               = record( results, config )
+    history           = read_history( args.history )
+    lines, regressed  = compare( rec, history, args.tolerance )
+    print( '\n'.join( lines ) )
+    if not args.no_history:
+        append_history( args.history, rec )
+    sys.exit( 1 if args.check and regressed else 0 )
@@ -0,0 +1,319 @@
+# tulvingcache.py -- Persistent cache of model responses
+# Re-running a session, e.g. to change scoring or tabulation, answers
+# unchanged prompts from disk instead of the model.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import timeit
+from pathlib import Path
+#
+import tulvingbackend as tb
+
+CACHE_DB  = Path( os.environ.get( 'TULVING_CACHE', Path.home() / ".cache" / "tulving" / "responses.sqlite" ) )
+# Size bound of the cached responses, least recently used are evicted
+MAX_BYTES = 1 << 30
+
+
+class Cached( str ):
+    """Response text read from the cache, with the `duration' (microseconds)
+    and token counts of the original response.
+    """
+    duration, prompt_tokens, response_tokens = None, None, None
+
+
+
+class ResponseCache:
+    """SQLite store of responses keyed by a hash of model, decoding
+    options, prompt template and prompt(s); size-bounded with LRU eviction.
+
+    Methods
+    -------
+    key( model_id, options, kind, prompts )
+        Content hash of a request.
+
+    get( key )
+        Returns a `Cached' response, or None.
+
+    put( key, text, duration, prompt_tokens=None, response_tokens=None )
+        Stores a response, evicting the least recently used beyond `max_bytes'.
+
+    close()
+        Closes the store.
+    """
+
+    def __init__( self, path=CACHE_DB, max_bytes=MAX_BYTES ):
+        path = Path( path )
+        path.parent.mkdir( parents=True, exist_ok=True )
+        self.max_bytes = max_bytes
+        self.lock      = threading.Lock()
+        self.db        = sqlite3.connect( path, timeout=30., check_same_thread=False, isolation_level=None )
+        self.db.execute( 'PRAGMA journal_mode=WAL' )
+        self.db.execute( 'PRAGMA synchronous=NORMAL' )
+        self.db.execute( '''CREATE TABLE IF NOT EXISTS responses (
+                              key TEXT PRIMARY KEY, text TEXT, duration REAL,
+                              prompt_tokens INTEGER, response_tokens INTEGER,
+                              size INTEGER, used REAL )''' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS responses_used ON responses (used)' )
+        self.total = self.db.execute( 'SELECT COALESCE( SUM( size ), 0 ) FROM responses' ).fetchone()[0]
+
+
+    @staticmethod
+    def key( model_id, options, kind, prompts ):
+        request = json.dumps( [ model_id, options, kind, prompts ], sort_keys=True )
+        return hashlib.sha256( request.encode() ).hexdigest()
+
+
+    def get( self, key ):
+        with self.lock:
+            row = self.db.execute( 'SELECT text, duration, prompt_tokens, response_tokens FROM responses WHERE key = ?',
+                                   ( key, ) ).fetchone()
+            if row is None:
+                return None
+            self.db.execute( 'UPDATE responses SET used = ? WHERE key = ?', ( time.time(), key ) )
+        txt = Cached( row[0] )
+        txt.duration, txt.prompt_tokens, txt.response_tokens = row[1:]
+        return txt
+
+
+    def put( self, key, text, duration, prompt_tokens=None, response_tokens=None ):
+        size = len( key ) + len( text.encode() ) + 32
+        with self.lock:
+            # A replaced response no longer counts
+            old  = self.db.execute( 'SELECT size FROM responses WHERE key = ?', ( key, ) ).fetchone()
+            self.db.execute( 'INSERT OR REPLACE INTO responses VALUES ( ?, ?, ?, ?, ?, ?, ? )',
+                             ( key, text, duration, prompt_tokens, response_tokens, size, time.time() ) )
+            self.total += size - ( old[0] if old else 0 )
+            if self.total > self.max_bytes:
+                self.evict()
+
+
+    def evict( self ):
+        # Keep the most recently used responses which fit in 90% of `max_bytes'
+        self.db.execute( '''DELETE FROM responses WHERE key IN (
+                              SELECT key FROM ( SELECT key, SUM( size ) OVER ( ORDER BY used DESC ) AS cum
+                                                FROM responses ) WHERE cum > ? )''',
+                         ( int( 0.9*self.max_bytes ), ) )
+        self.total = self.db.execute( 'SELECT COALESCE( SUM( size ), 0 ) FROM responses' ).fetchone()[0]
+
+
+    def close( self ):
+        with self.lock:
+            self.db.close()
+
+
+
+class CachedBackend( tb.Backend ):
+    """`Backend' answering from a `ResponseCache', calling the wrapped
+    backend on misses only. Conversations and prefix sessions of the
+    wrapped backend are only started on a first miss.
+    """
+
+    def __init__( self, backend, cache ):
+        super().__init__( backend.model )
+        self.backend    = backend
+        self.cache      = cache
+        self.concurrent = backend.concurrent
+        self.can_batch  = backend.can_batch
+        self.count      = None
+
+
+    def load( self ):
+        self.backend.load()
+
+
+    def tokenizer( self ):
+        return self.backend.tokenizer()
+
+
+    def key( self, kind, prompts, stop=None, max_tokens=None ):
+        options = dict( self.backend.options(), template=self.template() )
+        # Early stopped responses differ from full ones
+        if stop is not None or max_tokens is not None:
+            options = dict( options, stop=repr( stop ), max_tokens=max_tokens )
+        return self.cache.key( self.backend.model_id, options, kind, prompts )
+
+
+    def template( self ):
+        "System prompt and prompt template of the model, where it has them."
+        model = self.backend.model
+        return [ getattr( model, name )() for name in ( 'system_prompt', 'prompt_template' ) if hasattr( model, name ) ]
+
+
+    def close( self ):
+        "Closes the response cache; the wrapped backend stays loaded."
+        self.cache.close()
+
+
+    def lookup( self, key, call ):
+        "Cached response of `key', else the response of `call()', then cached."
+        txt = self.cache.get( key )
+        if txt is None:
+            tbeg  = timeit.default_timer()
+            txt   = call()
+            tdur  = (timeit.default_timer() - tbeg)*1000000
+            usage = self.backend.usage
+            self.cache.put( key, txt, tdur, usage.get( 'prompt_tokens' ), usage.get( 'response_tokens' ) )
+            self.usage = dict( usage )
+        else:
+            self.usage = { 'prompt_tokens' : txt.prompt_tokens, 'response_tokens' : txt.response_tokens,
+                           'cached' : True }
+        return txt
+
+
+    def lookup_batch( self, keys, prompts, call ):
+        """As `lookup', for a batch of `prompts': `call( indices )' answers
+        the misses. Batches have no usage by response, so the tokens of
+        each are counted by `tulvingbackend.get_tokenizer'; the usage is
+        the sum over the batch.
+        """
+        txts   = [ self.cache.get( key ) for key in keys ]
+        misses = [ i for i, txt in enumerate( txts ) if txt is None ]
+        if misses:
+            self.count = self.count or tb.get_tokenizer()
+            tbeg       = timeit.default_timer()
+            for i, txt in zip( misses, call( misses ) ):
+                txts[ i ] = txt
+            tdur = (timeit.default_timer() - tbeg)*1000000 / len( misses )
+            for i in misses:
+                txt                 = Cached( txts[ i ] )
+                txt.duration        = tdur
+                txt.prompt_tokens   = self.count( prompts[ i ] )
+                txt.response_tokens = self.count( txt )
+                self.cache.put( keys[ i ], txt, tdur, txt.prompt_tokens, txt.response_tokens )
+                txts[ i ]           = txt
+        self.usage = { 'prompt_tokens'   : sum( txt.prompt_tokens or 0 for txt in txts ),
+                       'response_tokens' : sum( txt.response_tokens or 0 for txt in txts ) }
+        if not misses:
+            self.usage['cached'] = True
+        return txts
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        return self.lookup( self.key( 'prompt', [ text ], stop, max_tokens ),
+                            lambda: self.backend.prompt( text, stop, max_tokens ) )
+
+
+    def stream( self, text, stop=None, max_tokens=None ):
+        """Chunks of the response to `text', as `Backend.stream', read until
+        `stop' or `max_tokens' as with `prompt'; a cached response is one
+        chunk, a missed one is cached once read.
+        """
+        key = self.key( 'prompt', [ text ], stop, max_tokens )
+        txt = self.cache.get( key )
+        return iter( [ txt ] ) if txt is not None else self.streamed( key, text, stop, max_tokens )
+
+
+    def streamed( self, key, text, stop, max_tokens ):
+        tbeg   = timeit.default_timer()
+        chunks = self.backend.stream( text )
+        txt, n = '', 0
+        try:
+            for n, chunk in enumerate( chunks, 1 ):
+                txt += chunk
+                yield chunk
+                if ( stop is not None and stop( txt ) ) or ( max_tokens is not None and n >= max_tokens ):
+                    break
+        finally:
+            if hasattr( chunks, 'close' ):
+                chunks.close()
+        self.cache.put( key, txt, (timeit.default_timer() - tbeg)*1000000, None, n )
+
+
+    def batch( self, texts, stop=None, max_tokens=None ):
+        return self.lookup_batch( [ self.key( 'prompt', [ text ], stop, max_tokens ) for text in texts ], texts,
+                                  lambda misses: self.backend.batch( [ texts[ i ] for i in misses ], stop, max_tokens ) )
+
+
+    def conversation( self ):
+        return CachedConversation( self )
+
+
+    def prefix( self, text, cache=True ):
+        return CachedPrefixSession( self, text, cache )
+
+
+
+class CachedConversation( tb.Conversation ):
+    """Conversation keyed by all its turns so far. On a first miss the
+    wrapped conversation is started and restores the previous turns.
+    """
+
+    def __init__( self, backend ):
+        self.backend      = backend
+        self.turns        = []
+        self.conversation = None
+
+
+    def prompt( self, text, stop=None, max_tokens=None ):
+        def call():
+            if self.conversation is None:
+                self.conversation = self.backend.backend.conversation()
+                self.conversation.restore( self.turns )
+            return self.conversation.prompt( text, stop, max_tokens )
+
+        # Earlier responses are part of the key, as they may have been stopped early
+        key = self.backend.key( 'conversation', [ t for turn in self.turns for t in turn ] + [ text ], stop, max_tokens )
+        txt = self.backend.lookup( key, call )
+        self.turns.append( ( text, txt ) )
+        return txt
+
+
+    def restore( self, turns ):
+        if self.conversation is not None:
+            self.conversation.restore( turns )
+        self.turns.extend( turns )
+
+
+
+class CachedPrefixSession( tb.PrefixSession ):
+    """Prefix session keyed as full prompts; the wrapped prefix session,
+    hence the prefix evaluation, only happens on a first miss.
+    """
+
+    def __init__( self, backend, prefix, cache=True ):
+        super().__init__( backend, prefix )
+        self.cache   = cache
+        self.session = None
+
+
+    def wrapped( self ):
+        if self.session is None:
+            self.session = self.backend.backend.prefix( self.prefix, cache=self.cache )
+        return self.session
+
+
+    def prompt( self, suffix, stop=None, max_tokens=None ):
+        return self.backend.lookup( self.backend.key( 'prompt', [ self.prefix + suffix ], stop, max_tokens ),
+                                    lambda: self.wrapped().prompt( suffix, stop, max_tokens ) )
+
+
+    def batch( self, suffixes, stop=None, max_tokens=None ):
+        return self.backend.lookup_batch( [ self.backend.key( 'prompt', [ self.prefix + suffix ], stop, max_tokens )
+                                            for suffix in suffixes ], [ self.prefix + suffix for suffix in suffixes ],
+                                          lambda misses: self.wrapped().batch( [ suffixes[ i ] for i in misses ],
+                                                                               stop, max_tokens ) )
+
+
+
+def cached( backend, enabled=False, path=CACHE_DB ):
+    """Returns `backend' behind a response cache, if `enabled' and the
+    backend responses are cacheable.
+
+    Cached responses are replayed, not sampled again: the cache is for
+    deterministic decoding, a warning is logged otherwise.
+    """
+    if enabled and backend.cacheable:
+        if backend.options().get( 'temp' ):
+            logging.warning( 'Response cache with sampled decoding: responses are replayed, not sampled again' )
+        return CachedBackend( backend, ResponseCache( path ) )
+    return backend
+
+
+def close( backend ):
+    "Closes the response cache of `backend', if `cached'."
+    if isinstance( backend, CachedBackend ):
+        backend.close()
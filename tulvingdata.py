@@ -0,0 +1,229 @@
+# tulvingdata.py -- Consolidated dataset of Tulving Test results
+# Compacts the result files of all sessions into one Parquet dataset,
+# partitioned by task/chrono/model/session, so that the tabulators read
+# only the partitions and columns they need.
+import argparse
+import csv
+import glob
+import logging
+import os
+import re
+import numpy as np
+import pandas as pd
+
+PARTITIONS = [ 'task', 'chrono', 'model', 'session' ]
+COLUMNS    = [ 'row', 'tbrword', 'result', 'fp', 'cue', 'response', 'cue_type', 'duration' ]
+DTYPES     = { 'row'      : 'int16',
+               'tbrword'  : 'string',
+               'result'   : 'int8',
+               # Missing in the first sessions
+               'fp'       : 'Int8',
+               'cue'      : 'string',
+               'response' : 'string',
+               'cue_type' : 'category',
+               'duration' : 'float32' }
+# Result file names, see README.md, Data Repository. Older names have
+# no model (mistral), or neither chrono (delayed) nor model; the
+# `TulvingTest' files of the Tulving-Watkins test are `tw_session_N'.
+TEMPL_NAME = re.compile( r'(?:merge_(?P<task>reco|reca|ord)(?:_(?P<chrono>imm|del))?(?:_(?P<model>[a-z]+))?|(?P<tw>tw))'
+                         r'_session_(?P<session>\d+)\.(?:csv|parquet)$' )
+# Column names of `TulvingTest.perform' results
+ALIASES    = { 'inlist' : 'fp' }
+
+
+def parse_name( fn ):
+    """Returns the partition of a result file name as a dict, or None."""
+    m = TEMPL_NAME.search( os.path.basename( fn ) )
+    if m is None:
+        return None
+    return { 'task'    : 'tw' if m['tw'] else m['task'],
+             'chrono'  : m['chrono'] or ( 'imm' if m['tw'] else 'del' ),
+             'model'   : m['model'] or 'mistral',
+             'session' : int( m['session'] ) }
+
+
+def unquote( field ):
+    field = field.strip()
+    if len( field ) >= 2 and "'" == field[0] == field[-1]:
+        field = field[ 1:-1 ].replace( "''", "'" )
+    return field
+
+
+def split_row( fields, nscores, after ):
+    """Rejoins the fields of a row split on commas: the target words, the
+    `nscores' integer scores, the cue, the response and `after' fields.
+
+    Targets (lists of words in the TW test) and responses may hold
+    unquoted commas, the targets ending where the scores start.
+    """
+    k = 1
+    while k + nscores < len( fields ) - after - 1 and \
+          not all( re.fullmatch( r'-?\d+', x.strip() ) for x in fields[ k:k+nscores ] ):
+        k += 1
+    cue = k + nscores
+    return [ ','.join( fields[ :k ] ) ] + fields[ k:cue+1 ] + \
+           [ ','.join( fields[ cue+1:len( fields )-after ] ) ] + fields[ len( fields )-after: ]
+
+
+def read_quoted_rows( fn ):
+    """Header and rows of a result CSV file written by `tulvingsink.CsvSink':
+    strings quoted and their quotes doubled, so that a response may hold
+    commas, quotes and newlines. Raises `csv.Error' or `ValueError' on
+    files which are not, e.g. the former printed rows.
+
+    Fields are not converted on reading, as `csv.QUOTE_NONNUMERIC' would,
+    since missing scores are written empty and unquoted.
+    """
+    rows, header = [], None
+    with open( fn, encoding='utf-8', errors='replace', newline='' ) as f:
+        # Comment lines of the test scripts
+        lines  = ( line for line in f if not line.startswith( '#' ) )
+        reader = csv.reader( lines, quotechar="'", skipinitialspace=True, strict=True )
+        for fields in reader:
+            if not fields:
+                continue
+            if 'tbrword' == fields[0].lower():
+                # Header, repeated by blocks in unmerged files
+                if header is None:
+                    header  = [ ALIASES.get( x.lower(), x.lower() ) for x in fields ]
+                    nscores = header.index( 'cue' ) - 1
+                continue
+            scores = fields[ 1:1+nscores ] if header else []
+            if header is None or len( fields ) != len( header ) or \
+               not all( re.fullmatch( r'-?\d*', x.strip() ) for x in scores ):
+                raise ValueError( f'{fn}: not a quoted result file at line {reader.line_num}' )
+            fields[ 1:1+nscores ] = [ x.strip() or None for x in scores ]
+            rows.append( fields )
+    return header, rows
+
+
+def read_csv_rows( fn ):
+    """Header, with normalized names, and rows of a result CSV file.
+
+    Files of `tulvingsink.CsvSink' are read as CSV records. Former files
+    of printed rows, whose quotes are not escaped, are read line by line
+    and their fields rejoined by `split_row'.
+    """
+    try:
+        return read_quoted_rows( fn )
+    except ( csv.Error, ValueError ):
+        pass
+    rows, header = [], None
+    with open( fn, encoding='utf-8', errors='replace' ) as f:
+        for line in f:
+            line = line.rstrip( '\r\n' )
+            if not line or line.startswith( '#' ):
+                continue
+            fields = line.split( ',' )
+            if 'tbrword' == unquote( fields[0] ).lower():
+                # Header, repeated by blocks in unmerged files
+                if header is None:
+                    header  = [ unquote( x ).lower() for x in fields ]
+                    header  = [ ALIASES.get( x, x ) for x in header ]
+                    nscores = header.index( 'cue' ) - 1
+                    after   = len( header ) - header.index( 'response' ) - 1
+                continue
+            if header is None or len( fields ) < len( header ):
+                logging.warning( f'{fn}: skipped line {line!r}' )
+                continue
+            rows.append( [ unquote( x ) for x in split_row( fields, nscores, after ) ] )
+    return header, rows
+
+
+def read_result_file( fn ):
+    """Typed results of a session file, CSV or Parquet, with its partition columns."""
+    if fn.endswith( '.parquet' ):
+        df = pd.read_parquet( fn )
+        df.columns = [ ALIASES.get( x.lower(), x.lower() ) for x in df.columns ]
+    else:
+        header, rows = read_csv_rows( fn )
+        df = pd.DataFrame( rows, columns=header or COLUMNS[ 1: ] )
+    df.insert( 0, 'row', np.arange( len( df ) ) )
+    df = df.reindex( columns=COLUMNS ).astype( DTYPES )
+    for key, value in parse_name( fn ).items():
+        df[ key ] = value
+    return df
+
+
+def result_files( srcdir, **filters ):
+    """Result files of `srcdir' in the partitions selected by `filters'."""
+    files = []
+    for fn in sorted( glob.glob( os.path.join( srcdir, '*_session_*.*' ) ) ):
+        part = parse_name( fn )
+        if part and all( part[ key ] in values for key, values in filters.items() ):
+            files.append( fn )
+    return files
+
+
+def select( filters ):
+    "Normalizes scalar filters to lists."
+    return { key : value if isinstance( value, ( list, tuple, range ) ) else [ value ]
+             for key, value in filters.items() if value is not None }
+
+
+def read_results( srcdir, columns=None, **filters ):
+    """Results of the result files of `srcdir', as `load' for a dataset."""
+    filters = select( filters )
+    files   = result_files( srcdir, **filters )
+    if not files:
+        return pd.DataFrame( columns=( columns or COLUMNS ) + PARTITIONS )
+    df = pd.concat( [ read_result_file( fn ) for fn in files ], ignore_index=True )
+    df[ 'cue_type' ] = df[ 'cue_type' ].astype( 'category' )
+    for key in PARTITIONS:
+        df[ key ] = df[ key ].astype( 'int32' if 'session' == key else 'category' )
+    return df[ ( columns or COLUMNS ) + PARTITIONS ]
+
+
+def ingest( srcdir, dataset, force=False ):
+    """Writes the result files of `srcdir' to the partitioned `dataset';
+    returns the number of sessions written.
+
+    Each session is one Parquet file, rewritten only when its result
+    file is newer, or with `force'.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    written = 0
+    for fn in result_files( srcdir ):
+        part = parse_name( fn )
+        dst  = os.path.join( dataset, *[ f'{key}={part[ key ]}' for key in PARTITIONS ], 'part-0.parquet' )
+        if not force and os.path.exists( dst ) and os.path.getmtime( dst ) >= os.path.getmtime( fn ):
+            continue
+        df = read_result_file( fn ).drop( columns=PARTITIONS )
+        os.makedirs( os.path.dirname( dst ), exist_ok=True )
+        pq.write_table( pa.Table.from_pandas( df, preserve_index=False ), dst )
+        written += 1
+    logging.info( f'Ingested {written} sessions from {srcdir} into {dataset}' )
+    return written
+
+
+def load( dataset, columns=None, **filters ):
+    """Results of `dataset', reading only the `columns' and the partitions
+    selected by `filters', e.g. `task='reco', chrono='imm', session=[5, 6]'.
+    """
+    filters = [ ( key, 'in', list( values ) ) for key, values in select( filters ).items() ]
+    df = pd.read_parquet( dataset, columns=( columns + PARTITIONS if columns else None ), filters=filters or None )
+    for key in PARTITIONS:
+        df[ key ] = df[ key ].astype( 'int32' if 'session' == key else 'category' )
+    return df
+
+
+def results( source, columns=None, **filters ):
+    """Results from `source', either a dataset written by `ingest', or a
+    directory of result files.
+    """
+    if glob.glob( os.path.join( source, 'task=*' ) ):
+        return load( source, columns, **filters )
+    return read_results( source, columns, **filters )
+
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO )
+    parser = argparse.ArgumentParser( prog="tulvingdata",
+                                      description="Compacts Tulving Test result files into a dataset." )
+    parser.add_argument( 'srcdir', help='Directory of the result files' )
+    parser.add_argument( 'dataset', help='Directory of the partitioned dataset' )
+    parser.add_argument( '-f', '--force', action='store_true', help='Rewrites all sessions' )
+    args = parser.parse_args()
+    #
+    ingest( args.srcdir, args.dataset, force=args.force )
@@ -0,0 +1,112 @@
+# tulvingjournal.py -- Append-only journal of a Tulving Test session
+# Each completed probe is journaled as it is answered, so that a crashed
+# session resumes from its first incomplete probe instead of restarting.
+import json
+import logging
+import os
+import time
+
+
+class JournalError( Exception ):
+    pass
+
+
+
+class Journal:
+    """Append-only JSON lines file of a session.
+
+    The first line is the header, e.g. the session as prepared by
+    `TulvingTest.fill'; each following line is a record. Records are
+    flushed as written, so a crashed process loses none, and synced to
+    disk every `sync_every' records or `sync_interval' seconds, so a
+    crashed machine loses only the records since the last sync.
+
+    Methods
+    -------
+    load( path )
+        Returns the header and records of an existing journal, ignoring
+        a torn last line.
+
+    create( header )
+        Starts a new journal with `header'.
+
+    reopen()
+        Appends to an existing journal, past its last complete record.
+
+    append( record )
+        Appends a record.
+
+    close()
+        Syncs and closes the journal.
+    """
+
+    def __init__( self, path, sync_every=8, sync_interval=1. ):
+        self.path          = path
+        self.sync_every    = sync_every
+        self.sync_interval = sync_interval
+        self.f             = None
+        self.pending       = 0
+        self.synced        = time.monotonic()
+
+
+    @staticmethod
+    def load( path ):
+        header, records, end = None, [], 0
+        with open( path, 'rb' ) as f:
+            for line in f:
+                if not line.endswith( b'\n' ):
+                    logging.warning( f'Journal {path}: torn record ignored' )
+                    break
+                entry = json.loads( line )
+                if header is None:
+                    header = entry
+                else:
+                    records.append( entry )
+                end += len( line )
+        if header is None:
+            raise JournalError( f'Journal {path} has no header' )
+        return header, records, end
+
+
+    def create( self, header ):
+        self.f = open( self.path, 'w', encoding='utf-8' )
+        self.append( header )
+        self.sync()
+        return self
+
+
+    def reopen( self ):
+        header, records, end = Journal.load( self.path )
+        self.f = open( self.path, 'r+', encoding='utf-8' )
+        self.f.truncate( end )
+        self.f.seek( end )
+        return header, records
+
+
+    def append( self, record ):
+        self.f.write( json.dumps( record ) + '\n' )
+        self.f.flush()
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.synced >= self.sync_interval:
+            self.sync()
+
+
+    def sync( self ):
+        os.fsync( self.f.fileno() )
+        self.pending = 0
+        self.synced  = time.monotonic()
+
+
+    def close( self ):
+        if self.f is not None:
+            self.sync()
+            self.f.close()
+            self.f = None
+
+
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, *exc ):
+        self.close()
@@ -1,18 +1,28 @@
 # tulvinglib.py -- A catalog of Tulving Tests
+import argparse
 import logging
+import tulvingbackend as tb
 import tulvingmem as tm
+import tulvingscore as ts
+
+# Answers of the recognition tests
+YESNO = ts.Matcher( [ 'YES', 'NO' ] )
 
 # Test protocols described in 
 
 # - Tulving, E. (1983). Elements of episodic memory. : Oxford University
 #   Press.
 
-def test_recognition( chrono, fn, model_nn ):
+# Keyword arguments of each test are passed on to `TulvingTest.perform',
+# e.g. `prefix_cache=True', or `journal=..., resume=True'.
+
+def test_recognition( chrono, fn, model_nn, **kwargs ):
     def test_score( resp, row ):
+        answers = YESNO.findall( resp )
         if 'C' == row['cue_type']:
-            return 1 if resp.upper().find( "YES" ) >= 0 else 0
+            return 1 if 'yes' in answers else 0
         else:
-            return 1 if resp.upper().find( "NO" ) >= 0 else 0
+            return 1 if 'no' in answers else 0
 
     tt             = tm.TulvingTest( 'Tulving Recognition {}'.format( tm.TulvingTest.TYPE_LABELS[chrono] ) )
     tt.distractors = [ 'D' ]
@@ -28,15 +38,19 @@ def test_recognition( chrono, fn, model_nn ):
     }
     tt.fill( fn )
     tt.score = test_score
-    tt.perform( model_nn )
+    # Stops at the first YES or NO
+    tt.stop_condition = lambda: tb.StopOnWords( [ 'YES', 'NO' ] )
+    tt.max_tokens     = 8
+    tt.perform( model_nn, **kwargs )
 
 
-def test_recall( chrono, fn, model_nn ):
+def test_recall( chrono, fn, model_nn, **kwargs ):
     def test_score( resp, row ):
+        answers = YESNO.findall( resp )
         if 'C' == row['cue_type']:
-            return 1 if resp.upper().find( "YES" ) >= 0 else 0
+            return 1 if 'yes' in answers else 0
         else:
-            return 1 if resp.upper().find( "NO" ) >= 0 else 0
+            return 1 if 'no' in answers else 0
 
     tt             = tm.TulvingTest( 'Tulving Reall {}'.format( tm.TulvingTest.TYPE_LABELS[chrono] ) )
     tt.distractors = [ 'D' ]
@@ -52,12 +66,15 @@ def test_recall( chrono, fn, model_nn ):
     }
     tt.fill( fn )
     tt.score = test_score
-    tt.perform( model_nn )
+    # Stops at the first YES or NO, the words scored
+    tt.stop_condition = lambda: tb.StopOnWords( [ 'YES', 'NO' ] )
+    tt.max_tokens     = 32
+    tt.perform( model_nn, **kwargs )
 
     
-def test_ordering( chrono, fn, model_nn ):
+def test_ordering( chrono, fn, model_nn, **kwargs ):
     def test_score( resp, row ):
-        return 1 if resp.upper().find( row['target'][0].upper() ) >= 0 else 0
+        return 1 if row['target'][0].lower() in tt.matcher.findall( resp ) else 0
 
     tt             = tm.TulvingTest( 'Tulving Ordering {}'.format( tm.TulvingTest.TYPE_LABELS[chrono] ) )
 
@@ -78,7 +95,9 @@ def test_ordering( chrono, fn, model_nn ):
     }
     tt.fill( fn, randomize=False )
     tt.score = test_score
-    tt.perform( model_nn )
+    tt.stop_condition = lambda: tb.StopOnWords( tt.study_words() + [ 'None' ] )
+    tt.max_tokens     = 32
+    tt.perform( model_nn, **kwargs )
 
     
 # Test protocols described in: 
@@ -87,9 +106,9 @@ def test_ordering( chrono, fn, model_nn ):
 #   Traces. Psychological Review, 82(4),
 #   261–275. http://dx.doi.org/10.1037/h0076782
     
-def test_tw( chrono, fn, model_nn ):
+def test_tw( chrono, fn, model_nn, **kwargs ):
     def tw_test_score( resp, row ):
-        return 1 if resp.upper().find( row['target'][0].upper() ) >= 0 else 0
+        return 1 if row['target'][0].lower() in tt.matcher.findall( resp ) else 0
 
     tt             = tm.TulvingTest( 'Tulving Watkins {}'.format( tm.TulvingTest.TYPE_LABELS[chrono] ) )
 
@@ -119,9 +138,11 @@ def test_tw( chrono, fn, model_nn ):
     }
     tt.score          = tw_test_score
     tt.render_context = tw_test_render_cue
+    tt.stop_condition = lambda: tb.StopOnWords( tt.study_words() + [ 'None' ] )
+    tt.max_tokens     = 32
     #
     tt.fill( fn )
-    tt.perform( model_nn )
+    tt.perform( model_nn, **kwargs )
 
 
 if __name__ == '__main__':
@@ -132,4 +153,35 @@ if __name__ == '__main__':
     )
     # test_recall( tm.TulvingTest.TYPE_PROMPT, 'tm_words0023.csv', 'mistral' )
     # test_ordering( tm.TulvingTest.TYPE_PROMPT, 'tm_ordering.csv', 'mistral' )
-    test_tw( tm.TulvingTest.TYPE_PROMPT,  'tw_cues.csv', 'mistral' )
+    # test_tw( tm.TulvingTest.TYPE_PROMPT,  'tw_cues.csv', 'mistral' )
+    TESTS  = { 'reco' : test_recognition, 'reca' : test_recall, 'ord' : test_ordering, 'tw' : test_tw }
+    parser = argparse.ArgumentParser( prog="tulvinglib",
+                                      description="Tulving Tests for LLMs." )
+    parser.add_argument( 'csv', nargs='?', default='tw_cues.csv', help='Data .CSV file of the test words' )
+    parser.add_argument( '-t', '--test', default='tw', choices=list( TESTS ) )
+    parser.add_argument( '-c', '--chrono', default='imm', choices=[ 'imm', 'del' ] )
+    parser.add_argument( '-m', '--model', default='mistral', choices=list( tm.TulvingTest.MODELS ) )
+    parser.add_argument( '-j', '--journal', help='Journal of the completed probes' )
+    parser.add_argument( '--resume', action='store_true',
+                         help='Resumes the session of the journal from its first incomplete probe' )
+    parser.add_argument( '--early-stop', default=False,
+                         help="Stops each response at the first word its score reads",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--cache', default=False,
+                         help="Replays and stores responses in the response cache, for deterministic decoding only",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--metrics',
+                         help='Timing and throughput of the session, .prom (Prometheus text) or .jsonl, appended to' )
+    parser.add_argument( '--warmup', action='store_true',
+                         help='Sends a discarded first prompt, so that the cold start of the model is not timed' )
+    parser.add_argument( '--fit', action='store_true',
+                         help='Holds as many batches per delayed conversation as fit in the model context' )
+    parser.add_argument( '--dry-run', action='store_true',
+                         help='Prints the prompt plan and its token counts without loading the model' )
+    args = parser.parse_args()
+    if args.resume and not args.journal:
+        parser.error( '--resume requires --journal' )
+    chrono = tm.TulvingTest.TYPE_PROMPT if 'imm' == args.chrono else tm.TulvingTest.TYPE_CHAT
+    TESTS[ args.test ]( chrono, args.csv, args.model, journal=args.journal, resume=args.resume, cache=args.cache,
+                        early_stop=args.early_stop, dry_run=args.dry_run,
+                        fit=args.fit, metrics=args.metrics, warmup=args.warmup )
@@ -1,6 +1,8 @@
 # tulvingmem.py -- Refactors Tulving test protocols
 # Friday, March 1, 2024 New
 import argparse
+import asyncio
+import os
 from datetime import datetime
 import timeit
 import logging
@@ -8,7 +10,223 @@ import logging
 import csv
 import numpy as np
 #
-import llm
+import tulvingbackend as tb
+import tulvingcache as tc
+import tulvingjournal as tj
+import tulvingmetrics as tmx
+import tulvingregistry as tr
+import tulvingscore as ts
+import tulvingsink as tsk
+
+
+class Session:
+    """A prepared session, held compactly: the strings of its probes are
+    interned in one table, and the probes are numpy arrays of indices in
+    that table, in session order.
+
+    Indexing and iterating give the batches as lists of probes
+    { target, probe, cue_type }, the target being the list of its
+    encodings, or `TulvingTest.DISTRACTOR'.
+
+    Attributes
+    ----------
+    strings: [ str ]
+        The string table
+    bounds: array (batches + 1,)
+        Offsets of the batches in the probe arrays
+    targets: array (probes, encodings)
+        Indices of the encodings of the targets, padded with -1
+    widths: array (probes,)
+        Number of encodings of the targets, 0 for distractors
+    probes, cue_types: array (probes,)
+        Indices of the cues and of their types
+
+    Methods
+    -------
+    tolist()
+        The batches as JSON-compatible lists, e.g. for a journal.
+
+    from_batches( batches )
+        A session from batches as given by `tolist'.
+    """
+    __slots__ = ( 'strings', 'bounds', 'targets', 'widths', 'probes', 'cue_types' )
+
+    def __init__( self, strings, bounds, targets, widths, probes, cue_types ):
+        # Only the strings of the probes are kept
+        used           = np.unique( np.concatenate( [ targets[ targets >= 0 ], probes, cue_types ] ) )
+        remap          = np.full( len( strings ), -1, dtype=np.int32 )
+        remap[ used ]  = np.arange( len( used ), dtype=np.int32 )
+        self.strings   = [ strings[ i ] for i in used ]
+        self.bounds    = np.asarray( bounds, dtype=np.int32 )
+        self.targets   = np.where( targets >= 0, remap[ np.maximum( targets, 0 ) ], -1 ).astype( np.int32 )
+        self.widths    = np.asarray( widths, dtype=np.int8 )
+        self.probes    = remap[ probes ]
+        self.cue_types = remap[ cue_types ]
+
+
+    @staticmethod
+    def from_batches( batches ):
+        strings, index = [], {}
+        def intern( x ):
+            if x not in index:
+                index[ x ] = len( strings )
+                strings.append( x )
+            return index[ x ]
+
+        rows    = [ row for batch in batches for row in batch ]
+        width   = max( [ 1 ] + [ len( row['target'] ) for row in rows if TulvingTest.DISTRACTOR != row['target'] ] )
+        targets = np.full( ( len( rows ), width ), -1, dtype=np.int32 )
+        widths  = np.zeros( len( rows ), dtype=np.int8 )
+        for i, row in enumerate( rows ):
+            if TulvingTest.DISTRACTOR != row['target']:
+                widths[ i ]                    = len( row['target'] )
+                targets[ i, :len( row['target'] ) ] = [ intern( x ) for x in row['target'] ]
+        return Session( strings, np.cumsum( [ 0 ] + [ len( batch ) for batch in batches ] ), targets, widths,
+                        np.array( [ intern( row['probe'] ) for row in rows ], dtype=np.int32 ),
+                        np.array( [ intern( row['cue_type'] ) for row in rows ], dtype=np.int32 ) )
+
+
+    def row( self, i ):
+        w = self.widths[ i ]
+        return { 'target'   : [ self.strings[ j ] for j in self.targets[ i, :w ] ] if w else TulvingTest.DISTRACTOR,
+                 'probe'    : self.strings[ self.probes[ i ] ],
+                 'cue_type' : self.strings[ self.cue_types[ i ] ] }
+
+
+    def __len__( self ):
+        return len( self.bounds ) - 1
+
+
+    def __getitem__( self, batch_idx ):
+        if not 0 <= batch_idx < len( self ):
+            raise IndexError( batch_idx )
+        return [ self.row( i ) for i in range( self.bounds[ batch_idx ], self.bounds[ batch_idx + 1 ] ) ]
+
+
+    def __iter__( self ):
+        return ( self[ batch_idx ] for batch_idx in range( len( self ) ) )
+
+
+    def tolist( self ):
+        return list( self )
+
+
+
+ContextError = tb.ContextError
+
+
+
+class Plan:
+    """The compiled prompts of a session, with their token counts.
+
+    Prompts are in session order, the i-th prompt being the retrieval
+    of the i-th probe of the `Session'. Each prompt follows a prefix, the
+    list to memorize, which is held once however many prompts share it:
+    in the delayed setting it opens each conversation, in the immediate
+    setting it precedes each prompt.
+
+    Attributes
+    ----------
+    chat: bool
+        Whether the prompts are turns of conversations (delayed setting)
+    prefixes: [ str ]
+        The distinct prefixes
+    prompts: [ str ]
+        The retrieval prompts
+    prefix_of, batches: array (probes,)
+        Indices of the prefix and of the batch of each prompt
+    prefix_tokens: array (prefixes,)
+    prompt_tokens: array (probes,)
+        Token counts of the prefixes and prompts
+    estimated: bool
+        Whether the counts are estimates, see `tulvingbackend.get_tokenizer'
+
+    Methods
+    -------
+    firsts()
+        Indices of the first prompt of each batch.
+
+    context_tokens( max_tokens=None )
+        Tokens in the context window at the end of each retrieval, each
+        response counting for `max_tokens', or the expected
+        `tulvingbackend.RESPONSE' tokens if uncapped, as in `TulvingTest.fit'.
+
+    total_tokens( prefix_cache=False )
+        Prompt tokens evaluated by the session.
+
+    check( n_ctx, max_tokens=None )
+        Raises `ContextError' if a retrieval may exceed `n_ctx' tokens.
+
+    describe( n_ctx=None, max_tokens=None, prefix_cache=False )
+        Lines of a printable plan.
+    """
+    __slots__ = ( 'chat', 'prefixes', 'prompts', 'prefix_of', 'batches', 'prefix_tokens', 'prompt_tokens',
+                  'estimated' )
+
+    def __init__( self, chat, prefixes, prompts, prefix_of, batches, count ):
+        self.chat          = chat
+        self.prefixes      = prefixes
+        self.prompts       = prompts
+        self.prefix_of     = np.asarray( prefix_of, dtype=np.int32 )
+        self.batches       = np.asarray( batches, dtype=np.int32 )
+        self.prefix_tokens = np.array( [ count( x ) for x in prefixes ], dtype=np.int64 )
+        self.prompt_tokens = np.array( [ count( x ) for x in prompts ], dtype=np.int64 )
+        self.estimated     = getattr( count, 'estimated', False )
+
+
+    def firsts( self ):
+        "Indices of the first prompt of each batch."
+        return np.flatnonzero( np.r_[ True, self.batches[ 1: ] != self.batches[ :-1 ] ] )
+
+
+    def context_tokens( self, max_tokens=None ):
+        response = tb.RESPONSE if max_tokens is None else max_tokens
+        prefix   = self.prefix_tokens[ self.prefix_of ]
+        if not self.chat or not len( self.prompts ):
+            return prefix + self.prompt_tokens + response
+        # Turns accumulate in the conversation of their batch, after the memorization
+        first    = self.firsts()
+        turns    = np.cumsum( self.prompt_tokens + response )
+        before   = np.repeat( turns[ first ] - self.prompt_tokens[ first ] - response,
+                              np.diff( np.r_[ first, len( self.prompts ) ] ) )
+        return prefix + response + turns - before
+
+
+    def total_tokens( self, prefix_cache=False ):
+        if self.chat:
+            # Each conversation evaluates its prefix once
+            prefixes = self.prefix_tokens[ self.prefix_of[ self.firsts() ] ] if len( self.prompts ) else 0
+        elif prefix_cache:
+            prefixes = self.prefix_tokens[ np.unique( self.prefix_of ) ]
+        else:
+            prefixes = self.prefix_tokens[ self.prefix_of ]
+        return int( np.sum( prefixes ) + self.prompt_tokens.sum() )
+
+
+    def check( self, n_ctx, max_tokens=None ):
+        context = self.context_tokens( max_tokens )
+        over    = np.flatnonzero( context > n_ctx )
+        if len( over ):
+            raise ContextError( f'{len( over )} retrievals exceed the context window of {n_ctx} tokens, '
+                                f'up to {context.max()} tokens from probe {over[0]}' )
+
+
+    def describe( self, n_ctx=None, max_tokens=None, prefix_cache=False ):
+        context = self.context_tokens( max_tokens )
+        lines   = [ f'# {len( self.prefixes )} prefixes, {len( self.prompts )} prompts, '
+                    f'{"delayed" if self.chat else "immediate"}' ]
+        lines  += [ f'# Prefix {i}, {n} tokens: {x}' for i, ( x, n ) in enumerate( zip( self.prefixes,
+                                                                                          self.prefix_tokens ) ) ]
+        lines  += [ 'BATCH,PREFIX,TOKENS,CONTEXT,PROMPT' ]
+        lines  += [ f"{b},{i},{n},{c},'{x}'" for b, i, n, c, x in zip( self.batches, self.prefix_of,
+                                                                       self.prompt_tokens, context, self.prompts ) ]
+        lines  += [ f'# Total: {self.total_tokens( prefix_cache )} prompt tokens, context up to '
+                    f'{context.max() if len( context ) else 0}' + ( f' of {n_ctx}' if n_ctx else '' ) + ' tokens' ]
+        if self.estimated:
+            lines += [ f'# Token counts are estimates, with a margin of {tb.MARGIN - 1:+.0%}' ]
+        return lines
+
+
 
 class TulvingTest:
     """Abstraction of the Tulving Test protocols for application to LLMs
@@ -62,6 +280,16 @@ class TulvingTest:
 
           retrievals: [ [ str ] ] A list of `batch_size' selections of
           column names from the data .CSV file to use for retrieval in step 2.
+    max_tokens: int
+        Cap of the tokens generated per retrieval, or None
+    tokenizer: function
+        Token count of a text, `tulvingbackend.get_tokenizer()' by default
+    plan: Plan
+        The compiled prompts of the session
+    matcher: tulvingscore.Matcher
+        The words of the list to remember, compiled for scoring
+    metrics: tulvingmetrics.Metrics
+        The timed phases of the last performance
  
     Methods
     -------
@@ -79,13 +307,72 @@ class TulvingTest:
         word and optional context. `cue_type' is a column name in the
         data .CSV file. (Usually overriden.)
 
+    stop_condition()
+        Returns the condition, e.g. a `tulvingbackend.StopOnWords', under
+        which a streamed response is decided and its generation cancelled,
+        or None. (Usually overriden.)
+
+    study_words()
+        Returns the words of the list to remember and the session targets.
+
     fill( csvfn, randomize=True )
         Prepares a full test session from the data .CSV file
         `fn'. Randomize if required the order of presentations.
-        Session is tored in local instance attribute `session'.
-
-    perform( model )
+        Session is tored in local instance attribute `session', a
+        `Session', and its prompts in `plan'. The context window of the
+        model is only checked by `fit' and `perform'.
+
+    compile()
+        Returns the `Plan' of the session.
+
+    fit( n_ctx=tulvingbackend.CONTEXT )
+        In the delayed setting, merges consecutive batches of the session
+        into conversations, each as long as fits in `n_ctx' tokens, so
+        that the list is memorized once per conversation. Batches are
+        kept whole, and with them the encoding/retrieval pattern of the
+        protocol. Responses count for `max_tokens', or the expected
+        `tulvingbackend.RESPONSE' tokens if uncapped. Raises
+        `ContextError' if a batch alone exceeds `n_ctx' tokens.
+
+    perform( model, prefix_cache=False, backend=None, concurrency=1, batched=False, cache=False,
+             journal=None, resume=False, early_stop=False, output=None, dry_run=False, fit=False,
+             metrics=None, warmup=False )
         Performs a prepared (`fill') session on model key `model'.
+        In the immediate setting, `prefix_cache' evaluates the list
+        to remember once and runs each retrieval from that state.
+        A preloaded `backend' for `model' may be given, e.g. by
+        `tulvingworker'. Up to `concurrency' immediate probes, or
+        delayed conversations, are in flight at once. With `batched',
+        the immediate probes of a batch are a single batched generation
+        on backends which support it; their duration is then a share
+        of the batch duration. With `cache', for deterministic decoding,
+        responses are read from, or stored in, the `tulvingcache' response
+        cache; cached responses report their original duration. Each completed
+        probe is appended to the `journal' file, if given; with `resume',
+        the session is reloaded from the journal and continues from its
+        first incomplete probe, delayed conversations being restored
+        from their journaled turns. With `early_stop' (opt-in), retrievals are
+        streamed and cancelled once `stop_condition' holds; the partial
+        response is recorded. Retrievals generate at most `max_tokens'.
+        Results go to `output', a `tulvingsink' sink or file path (.csv
+        or .parquet), or standard output by default. The session is
+        rejected, before loading the model, if a retrieval may exceed
+        the context window. With `fit', the delayed session is first
+        regrouped (`fit') for the context window of the model. With
+        `dry_run', the plan is printed with its token counts instead,
+        and the model is not loaded. Model load, memorization, each
+        retrieval (tokens, time to first token, cue type and row in its
+        batch or conversation), scoring and output are timed in `metrics',
+        with percentiles of their durations, and exported to the `metrics'
+        file, if given (see `tulvingmetrics.Metrics.export'). With `warmup',
+        a first prompt, `tulvingbackend.WARMUP', is sent to the model and
+        discarded, so that its cold start is timed apart from the probes.
+
+    perform_async( backend, prefix_cache=False, concurrency=1, batched=False, journal=None, done=None, early_stop=False,
+                   sink=None, metrics=None )
+        Coroutine performing the session on a `tulvingbackend.AsyncBackend';
+        `done' are the journaled probes, by ( batch, row ); timed phases
+        are recorded in `metrics', a `tulvingmetrics.Metrics'.
     """
     
     TYPE_CHAT   = 1
@@ -98,20 +385,26 @@ class TulvingTest:
         "mistral"  : "mistral-7b-instruct-v0"
     }
 
-    RES_HEADER = "'TBRWORD','RESULT','INLIST','CUE','RESPONSE','CUE_TYPE','DURATION'"
-    RES_ROW    = "'{word}',{val:1d},{valinlist:1d},'{cue}','{txt}','{cue_type}',{tdur:4.2f}"
+    RES_COLUMNS = [ 'TBRWORD', 'RESULT', 'INLIST', 'CUE', 'RESPONSE', 'CUE_TYPE', 'DURATION' ]
 
     name       = ""
     remember, encodings, retrievals = '', '', ''
-    distractors  = []
     protocol   = None
-    session    = []
-    tbr_list   = []
+    # Cap of generated tokens per retrieval
+    max_tokens = None
+    # Token counter of the plan
+    tokenizer  = None
 
 
     def __init__(self, name):
         "A TulvingTest instance."
-        self.name = name
+        self.name        = name
+        self.distractors = []
+        self.session     = Session.from_batches( [] )
+        self.tbr_list    = []
+        self.plan        = None
+        self.matcher     = ts.Matcher( [] )
+        self.metrics     = tmx.Metrics()
 
 
     def score( self, resp, row ):
@@ -124,75 +417,220 @@ class TulvingTest:
 
     def render_context( self, cue_str, cue_type ):
         return cue_str
-        
 
-    def perform(self, model_nn):
-        def render_target( lst ):
-            return ' - '.join( lst )
+
+    def stop_condition( self ):
+        return None
+
+
+    def study_words( self ):
+        words  = [ enc[0] for enc in self.tbr_list ]
+        words += [ row['target'][0] for batch in self.session for row in batch
+                   if TulvingTest.DISTRACTOR != row['target'] ]
+        return words
         
+
+    def perform(self, model_nn, prefix_cache=False, backend=None, concurrency=1, batched=False, cache=False,
+                journal=None, resume=False, early_stop=False, output=None, dry_run=False, fit=False, metrics=None,
+                warmup=False):
         tbeg = datetime.now().isoformat( timespec='seconds' )
         logging.info( f'{tbeg} > Performance' )
-        #
-        tbr_str = ', '.join( [ self.encodings.format( *enc ) for enc in self.tbr_list ] )
-        model     = llm.get_model( TulvingTest.MODELS[ model_nn ] )
-        #
+        n_ctx = tb.CONTEXT if backend is None else backend.n_ctx
+        if fit and not resume:
+            self.fit( n_ctx )
+        if dry_run:
+            print( '\n'.join( self.plan.describe( n_ctx, self.max_tokens, prefix_cache ) ) )
+            return
+        # Journal of the completed probes, keyed by ( batch, row ), row -1 being the memorization
+        done = {}
+        if journal is not None:
+            journal = tj.Journal( journal )
+            if resume and os.path.exists( journal.path ):
+                header, records = journal.reopen()
+                if [ self.name, model_nn ] != [ header['name'], header['model'] ]:
+                    journal.close()
+                    raise tj.JournalError( f"Journal {journal.path} is of {header['name']} on {header['model']}" )
+                # The session as filled before the crash
+                self.session, self.tbr_list = Session.from_batches( header['session'] ), header['tbr_list']
+                self.plan, self.matcher = self.compile(), ts.Matcher( self.study_words() )
+                done = { ( r['batch'], r['row'] ) : r for r in records }
+                logging.info( f'{tbeg} > Resuming {journal.path}: {len( done )} probes done' )
+            else:
+                journal.create( { 'name' : self.name, 'model' : model_nn,
+                                  'session' : self.session.tolist(), 'tbr_list' : self.tbr_list } )
+        try:
+            # Oversized sessions are rejected before loading the model
+            self.plan.check( n_ctx, self.max_tokens )
+            self.metrics = tmx.Metrics( name=self.name, model=model_nn,
+                                        chrono=TulvingTest.TYPE_LABELS[ self.protocol['type'] ] )
+            if backend is None:
+                with self.metrics.timer( 'load' ):
+                    backend = tb.get_backend( tr.get_model( TulvingTest.MODELS[ model_nn ] ) )
+                    backend.load()
+            count = backend.tokenizer() if self.plan.estimated else None
+            if count is not None:
+                # Estimated counts are made again by the loaded model
+                self.tokenizer = count
+                self.plan      = self.compile()
+                self.plan.check( n_ctx, self.max_tokens )
+            if warmup:
+                # Not answered from the response cache, nor timed with the probes
+                self.metrics.record( 'warmup', tb.warm_up( backend ) )
+            backend = tc.cached( backend, cache )
+            #
+            tbeg = datetime.now().isoformat( timespec='seconds' )
+            logging.info( f'{tbeg} > Model {model_nn} loaded' )
+            with tsk.sink( output, TulvingTest.RES_COLUMNS ) as sink:
+                asyncio.run( self.perform_async( tb.AsyncBackend( backend ), prefix_cache, concurrency, batched,
+                                                 journal, done, early_stop, sink, self.metrics ) )
+                tend = timeit.default_timer()
+            self.metrics.record( 'flush', timeit.default_timer() - tend )
+        finally:
+            tc.close( backend )
+            if journal is not None:
+                journal.close()
+        if metrics is not None:
+            self.metrics.export( metrics )
         tbeg = datetime.now().isoformat( timespec='seconds' )
-        logging.info( f'{tbeg} > Model {model_nn} loaded' )
-        print( TulvingTest.RES_HEADER )
+        logging.info( f'{tbeg} > Performance done: {self.metrics.summary()}' )
+
+
+    async def perform_async(self, backend, prefix_cache=False, concurrency=1, batched=False, journal=None, done=None,
+                            early_stop=False, sink=None, metrics=None):
+        if sink is None:
+            with tsk.sink( None, TulvingTest.RES_COLUMNS ) as sink:
+                return await self.perform_async( backend, prefix_cache, concurrency, batched, journal, done,
+                                                 early_stop, sink, metrics )
+        done    = done or {}
+        metrics = tmx.Metrics() if metrics is None else metrics
+        # Retrievals are streamed until their score is decided, and capped
+        stop = self.stop_condition() if early_stop else None
+        def render_target( lst ):
+            return ' - '.join( lst )
+
+        def report( row, txt, tdur ):
+            with metrics.timer( 'score' ):
+                val = self.score( txt, row )
+                valinlist = self.score_inlist( txt, row )
+            with metrics.timer( 'write' ):
+                sink.write( ( render_target( row['target'] ), val, valinlist, row['probe'], str( txt ),
+                              row['cue_type'], round( tdur, 2 ) ) )
+
+        def measure( batch_idx, row_idx, row, txt, tbeg ):
+            # Prompt tokens as counted by the backend, or as planned
+            usage = getattr( txt, 'usage', {} )
+            metrics.record_usage( 'retrieval', timeit.default_timer() - tbeg, usage, batch=batch_idx, row=row_idx,
+                                  cue_type=row['cue_type'],
+                                  prompt_tokens=usage.get( 'prompt_tokens' ) or
+                                                int( plan.prompt_tokens[ bounds[ batch_idx ] + row_idx ] ) )
+
+        def record( batch_idx, row_idx, txt, tdur ):
+            if journal is not None:
+                journal.append( { 'batch' : batch_idx, 'row' : row_idx, 'txt' : txt, 'tdur' : tdur } )
+
+        def recorded( batch_idx, row_idx, row ):
+            entry = done[ ( batch_idx, row_idx ) ]
+            return row, entry['txt'], entry['tdur']
+
+        plan    = self.plan
+        bounds  = self.session.bounds
+        # At most `concurrency' probes, or conversations, in flight
+        limit   = asyncio.Semaphore( concurrency )
         #
         if TulvingTest.TYPE_CHAT == self.protocol['type']:
-            batch_idx = 0
-            for batch in self.session:
-                tbeg = datetime.now().isoformat( timespec='seconds' )
-                logging.info( f'{tbeg} > BEGIN batch {batch_idx}' )
-                #
-                conversation = model.conversation()
-                response     = conversation.prompt( self.remember.format( tbr_str ) )
-                for row in batch:
+            async def converse( batch_idx, batch ):
+                # Completed probes of a conversation are its first rows
+                results = []
+                while len( results ) < len( batch ) and ( batch_idx, len( results ) ) in done:
+                    results += [ recorded( batch_idx, len( results ), batch[ len( results ) ] ) ]
+                if len( results ) == len( batch ):
+                    return results
+                async with limit:
                     tbeg = datetime.now().isoformat( timespec='seconds' )
-                    logging.info( f'{tbeg} > BEGIN row {row}' )
+                    logging.info( f'{tbeg} > BEGIN batch {batch_idx}' )
                     #
-                    tbeg     = timeit.default_timer()
-                    response = conversation.prompt( self.retrievals.format( row['probe'] ) )
-                    tdur     = (timeit.default_timer() - tbeg)*1000000
-                    val = self.score( response.text(), row )
-                    valinlist = self.score_inlist( response.text(), row )
-                    print( TulvingTest.RES_ROW.format(
-                        word      = render_target( row['target'] ),
-                        val       = val,
-                        valinlist = valinlist,
-                        cue       = row['probe'],
-                        txt       = response.text().replace( ',','' ),
-                        cue_type  = row['cue_type'],
-                        tdur      = tdur
-                    ) )
-                batch_idx += 1
+                    async with await backend.conversation() as conversation:
+                        memo = plan.prefixes[ plan.prefix_of[ bounds[ batch_idx ] ] ]
+                        if ( batch_idx, -1 ) in done:
+                            with metrics.timer( 'memorize', batch=batch_idx, restored=len( results ) ):
+                                await conversation.restore( [ ( memo, done[ ( batch_idx, -1 ) ]['txt'] ) ] +
+                                                            [ ( plan.prompts[ bounds[ batch_idx ] + row_idx ], txt )
+                                                              for row_idx, ( row, txt, tdur ) in enumerate( results ) ] )
+                        else:
+                            with metrics.timer( 'memorize', batch=batch_idx ):
+                                response = await conversation.prompt( memo )
+                            record( batch_idx, -1, response, 0. )
+                        for row_idx in range( len( results ), len( batch ) ):
+                            row  = batch[ row_idx ]
+                            tbeg = datetime.now().isoformat( timespec='seconds' )
+                            logging.info( f'{tbeg} > BEGIN row {row}' )
+                            #
+                            tbeg     = timeit.default_timer()
+                            txt      = await conversation.prompt( plan.prompts[ bounds[ batch_idx ] + row_idx ],
+                                                                      stop, self.max_tokens )
+                            tdur     = tb.elapsed( txt, tbeg )
+                            measure( batch_idx, row_idx, row, txt, tbeg )
+                            record( batch_idx, row_idx, txt, tdur )
+                            results += [ ( row, txt, tdur ) ]
+                return results
+
+            # Conversations are sequential within, and concurrent between, batches
+            tasks = [ asyncio.create_task( converse( batch_idx, batch ) )
+                      for batch_idx, batch in enumerate( self.session ) ]
+            for task in tasks:
+                for row, txt, tdur in await task:
+                    report( row, txt, tdur )
         #
         elif TulvingTest.TYPE_PROMPT == self.protocol['type']:
-            batch_idx = 0
-            inst = '{} '.format( self.remember.format( tbr_str ) )
-            for batch in self.session:
-                for row in batch:
+            # The immediate session has one prefix
+            if len( done ) < len( self.session.probes ):
+                with metrics.timer( 'memorize', prefix_cache=prefix_cache ):
+                    probes = await backend.prefix( plan.prefixes[ 0 ], cache=prefix_cache )
+
+            async def probe( batch_idx, row_idx, row ):
+                if ( batch_idx, row_idx ) in done:
+                    return recorded( batch_idx, row_idx, row )
+                async with limit:
                     tbeg     = timeit.default_timer()
-                    response = model.prompt( inst + self.retrievals.format( row['probe'] ) )
-                    tdur     = (timeit.default_timer() - tbeg)*1000000
-                    val = self.score( response.text(), row )
-                    valinlist = self.score_inlist( response.text(), row )
-                    print( TulvingTest.RES_ROW.format(
-                        word      = render_target( row['target'] ),
-                        val       = val,
-                        valinlist = valinlist,
-                        cue       = row['probe'],
-                        txt       = response.text().replace( ',','' ),
-                        cue_type  = row['cue_type'],
-                        tdur      = tdur
-                    ) )
-                batch_idx += 1
+                    txt      = await probes.prompt( plan.prompts[ bounds[ batch_idx ] + row_idx ], stop, self.max_tokens )
+                    tdur     = tb.elapsed( txt, tbeg )
+                measure( batch_idx, row_idx, row, txt, tbeg )
+                record( batch_idx, row_idx, txt, tdur )
+                return row, txt, tdur
+
+            async def probe_batch( batch_idx, batch ):
+                results = [ recorded( batch_idx, row_idx, row ) if ( batch_idx, row_idx ) in done else None
+                            for row_idx, row in enumerate( batch ) ]
+                todo    = [ row_idx for row_idx, result in enumerate( results ) if result is None ]
+                if todo:
+                    async with limit:
+                        tbeg     = timeit.default_timer()
+                        txts     = await probes.batch( [ plan.prompts[ bounds[ batch_idx ] + row_idx ]
+                                                         for row_idx in todo ], stop, self.max_tokens )
+                        tdur     = (timeit.default_timer() - tbeg)*1000000 / len( todo )
+                    metrics.record( 'retrieval', timeit.default_timer() - tbeg, batch=batch_idx, rows=len( todo ),
+                                    prompt_tokens=int( sum( plan.prompt_tokens[ bounds[ batch_idx ] + row_idx ]
+                                                            for row_idx in todo ) ) )
+                    for row_idx, txt in zip( todo, txts ):
+                        results[ row_idx ] = ( batch[ row_idx ], txt, getattr( txt, 'duration', None ) or tdur )
+                        record( batch_idx, row_idx, *results[ row_idx ][1:] )
+                return results
+
+            # Probes are independent, reported in session order
+            if batched and backend.backend.can_batch:
+                tasks = [ asyncio.create_task( probe_batch( batch_idx, batch ) )
+                          for batch_idx, batch in enumerate( self.session ) ]
+                for task in tasks:
+                    for row, txt, tdur in await task:
+                        report( row, txt, tdur )
+            else:
+                tasks = [ asyncio.create_task( probe( batch_idx, row_idx, row ) )
+                          for batch_idx, batch in enumerate( self.session ) for row_idx, row in enumerate( batch ) ]
+                for task in tasks:
+                    report( *await task )
 
         else:
             pass
-        tbeg = datetime.now().isoformat( timespec='seconds' )
-        logging.info( f'{tbeg} > Performance done' )
 
 
 
@@ -201,48 +639,94 @@ class TulvingTest:
         assert len( self.protocol['encodings']) == len( self.protocol['retrievals'] )
         assert len( self.protocol['encodings']) == self.protocol['batch_size']
         
-        self.session = []
-        tbr, ntbr = [], []
-        # Read in words CSV file
-        with open( csvfn ) as csvfile:
-            reader = reader = csv.DictReader(csvfile)
-            for row in reader:
-                if [] == self.distractors or all( [ 'none' == row[x] for x in self.distractors ] ):
-                    tbr += [ row ]
-                else:
-                    ntbr += [ row ]
+        # Read in words CSV file, as indices of its interned strings
+        index = {}
+        with open( csvfn, newline='' ) as csvfile:
+            reader  = csv.reader( csvfile )
+            columns = { name : j for j, name in enumerate( next( reader ) ) }
+            cells   = np.array( [ [ index.setdefault( x, len( index ) ) for x in row ] for row in reader ],
+                                dtype=np.int32 ).reshape( -1, len( columns ) )
+        if self.distractors:
+            none  = index.get( 'none', -1 )
+            istbr = np.all( cells[ :, [ columns[ x ] for x in self.distractors ] ] == none, axis=1 )
+        else:
+            istbr = np.ones( len( cells ), dtype=bool )
+        tbr, ntbr = cells[ istbr ], cells[ ~istbr ]
+        # Cue types are interned with the words
+        types     = { r : index.setdefault( r, len( index ) ) for rs in self.protocol['retrievals'] for r in rs }
+        strings   = list( index )
 
         # Randomize
-        p        = np.random.permutation( len(tbr) ) if randomize else range( len(tbr) )
-        q        = np.random.permutation( len(ntbr) ) if randomize else range( len(ntbr) )
-        # Precompile session as a list of batches
+        p        = np.random.permutation( len(tbr) ) if randomize else np.arange( len(tbr) )
+        q        = np.random.permutation( len(ntbr) ) if randomize else np.arange( len(ntbr) )
+        # Precompile session as arrays of probes, by batch
+        # A batch is a list of probes = { target:<a list of encodings>, probe:<a cue word> }
+        # (There may be several probes for one target.)
         tbr_idx, ntbr_idx = 0, 0
         self.tbr_list = []
+        width    = max( len( enc ) for enc in self.protocol['encodings'] )
+        targets, widths, probes, cue_types, bounds = [], [], [], [], [ 0 ]
         for b in range( self.protocol['batch_number'] ):
-            batch = []
-            # A batch is a list of probes = { target:<a list of encodings>, probe:<a cue word> }
-            # (There may be several probes for one target.)
             for i in range ( self.protocol['batch_size'] ):
                 if self.protocol['encodings'][i][0] in self.distractors:
-                    batch += [{
-                        'target'   : TulvingTest.DISTRACTOR,
-                        'probe'    : ntbr[q[ntbr_idx]][ self.protocol['retrievals'][i][0] ],
-                        'cue_type' : self.protocol['retrievals'][i][0]
-                    }]
+                    r = self.protocol['retrievals'][i][0]
+                    targets   += [ [ -1 ]*width ]
+                    widths    += [ 0 ]
+                    probes    += [ ntbr[ q[ntbr_idx], columns[ r ] ] ]
+                    cue_types += [ types[ r ] ]
                     ntbr_idx += 1
                 else:
-                    target = [ tbr[p[tbr_idx]][ x ] for x in self.protocol['encodings'][i] ]
+                    encs   = self.protocol['encodings'][i]
+                    target = [ tbr[ p[tbr_idx], columns[ x ] ] for x in encs ]
                     for r in self.protocol['retrievals'][i]:
-                        batch += [ {
-                            'target'   : target,
-                            'probe'    : tbr[p[tbr_idx]][r],
-                            'cue_type' : r
-                        } ]
+                        targets   += [ target + [ -1 ]*(width - len( encs )) ]
+                        widths    += [ len( encs ) ]
+                        probes    += [ tbr[ p[tbr_idx], columns[ r ] ] ]
+                        cue_types += [ types[ r ] ]
                     #
-                    row = [ self.render_context( tbr[tbr_idx][x], x ) for x in self.protocol['encodings'][i] ]
+                    row = [ self.render_context( strings[ tbr[ tbr_idx, columns[ x ] ] ], x ) for x in encs ]
                     self.tbr_list += [ row ]
                     tbr_idx += 1
-            self.session += [ batch ]
+            bounds += [ len( probes ) ]
+        self.session = Session( strings, bounds, np.array( targets, dtype=np.int32 ).reshape( -1, width ), widths,
+                                np.array( probes, dtype=np.int32 ), np.array( cue_types, dtype=np.int32 ) )
+        self.plan    = self.compile()
+        self.matcher = ts.Matcher( self.study_words() )
+
+
+    def fit( self, n_ctx=tb.CONTEXT ):
+        if TulvingTest.TYPE_CHAT != self.protocol['type'] or not len( self.session ):
+            return
+        plan     = self.plan
+        response = tb.RESPONSE if self.max_tokens is None else self.max_tokens
+        bounds   = self.session.bounds
+        # Tokens of each batch, prompts and responses
+        costs    = np.add.reduceat( plan.prompt_tokens + response, bounds[ :-1 ] )
+        prefix   = int( plan.prefix_tokens.max() ) + response
+        merged   = [ 0 ]
+        while merged[-1] < len( costs ):
+            n = tb.fit_probes( prefix, costs[ merged[-1]: ], n_ctx )
+            if not n:
+                raise ContextError( f'Batch {len( merged ) - 1} of {costs[ merged[-1] ]} tokens exceeds '
+                                    f'the context window of {n_ctx} tokens' )
+            merged += [ merged[-1] + n ]
+        self.session.bounds = bounds[ merged ]
+        self.plan           = self.compile()
+        logging.info( f'Fit: {len( costs )} batches in {len( merged ) - 1} conversations of {n_ctx} tokens' )
+
+
+    def compile( self ):
+        tbr_str  = ', '.join( [ self.encodings.format( *enc ) for enc in self.tbr_list ] )
+        memo     = self.remember.format( tbr_str )
+        chat     = TulvingTest.TYPE_CHAT == self.protocol['type']
+        # All retrievals of a session share the list to memorize
+        prefixes = [ memo if chat else '{} '.format( memo ) ]
+        # Each distinct cue is formatted once
+        cues     = { i : self.retrievals.format( self.session.strings[ i ] ) for i in np.unique( self.session.probes ) }
+        prompts  = [ cues[ i ] for i in self.session.probes ]
+        batches  = np.repeat( np.arange( len( self.session ) ), np.diff( self.session.bounds ) )
+        return Plan( chat, prefixes, prompts, np.zeros( len( prompts ), dtype=np.int32 ), batches,
+                     self.tokenizer or tb.get_tokenizer() )
                 
 
     
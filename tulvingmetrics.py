@@ -0,0 +1,266 @@
+# tulvingmetrics.py -- Timing and throughput of the phases of a session
+# An in-memory registry of timed events, e.g. each retrieval with its
+# token counts and time to first token, summarized per phase, and
+# exported as JSONL records or in the Prometheus text format. Durations
+# are also counted in HDR-style histograms, for their tail percentiles.
+import contextlib
+import json
+import math
+import os
+import time
+import timeit
+
+# Phases of a session, in order
+PHASES = [ 'load', 'warmup', 'memorize', 'retrieval', 'score', 'write', 'flush' ]
+# Significant decimal digits of the histogram durations
+DIGITS      = 2
+# Percentiles of the latency reports
+PERCENTILES = [ 50, 90, 99 ]
+# Fields of the events by which the JSONL export breaks down the retrieval latencies
+BREAKDOWN   = [ 'cue_type', 'row' ]
+
+
+class Histogram:
+    """HDR-style histogram of durations
+
+    Durations, in microseconds, are counted in buckets of the same
+    relative width, so that percentiles keep `digits' significant
+    digits in a memory bounded by the orders of magnitude of the
+    durations, not by their number: the first 2**k microseconds have
+    a bucket each, k resolving `digits' digits, and each following
+    power of two is split in 2**(k-1) buckets.
+
+    Attributes
+    ----------
+    digits: int
+        Significant decimal digits of the durations
+    counts: { ( int, int ) : int }
+        Durations counted by bucket, as ( exponent, sub-bucket )
+    count, total, min, max
+        Number, sum, least and greatest of the durations, in seconds
+
+    Methods
+    -------
+    record( seconds: float, count=1 )
+        Counts a duration.
+
+    merge( other: Histogram )
+        Adds the counts of `other', of the same `digits'.
+
+    percentile( p: float )
+        Duration, in seconds, below which are `p' percent of the
+        durations, within `digits' digits; None if empty.
+
+    percentiles( ps=PERCENTILES )
+        Durations of percentiles `ps', as a dict keyed `p50', `p90'...
+    """
+
+    def __init__( self, digits=DIGITS ):
+        self.digits = digits
+        self.bits   = math.ceil( math.log2( 2 * 10**digits ) )
+        self.counts = {}
+        self.count, self.total, self.min, self.max = 0, 0., None, None
+
+
+    def bucket( self, us ):
+        e = max( 0, us.bit_length() - self.bits )
+        return e, us >> e
+
+
+    def record( self, seconds, count=1 ):
+        key               = self.bucket( max( 0, round( seconds * 1000000 ) ) )
+        self.counts[ key ] = self.counts.get( key, 0 ) + count
+        self.count       += count
+        self.total       += seconds * count
+        self.min          = seconds if self.min is None else min( self.min, seconds )
+        self.max          = seconds if self.max is None else max( self.max, seconds )
+
+
+    def merge( self, other ):
+        for key, count in other.counts.items():
+            self.counts[ key ] = self.counts.get( key, 0 ) + count
+        self.count += other.count
+        self.total += other.total
+        for x in [ other.min, other.max ]:
+            if x is not None:
+                self.min = x if self.min is None else min( self.min, x )
+                self.max = x if self.max is None else max( self.max, x )
+
+
+    def percentile( self, p ):
+        if not self.count:
+            return None
+        rank, seen = max( 1, math.ceil( p / 100 * self.count ) ), 0
+        for ( e, sub ), count in sorted( self.counts.items() ):
+            seen += count
+            if seen >= rank:
+                # Highest duration of the bucket, as HdrHistogram
+                return min( max( ( ( sub + 1 ) << e ) - 1, 0 ) / 1000000, self.max )
+        return self.max
+
+
+    def percentiles( self, ps=PERCENTILES ):
+        return { f'p{p:g}' : self.percentile( p ) for p in ps }
+
+
+    def __repr__( self ):
+        return f'Histogram({self.count} durations)'
+
+
+
+class Metrics:
+    """Registry of the timed events of a session
+
+    Attributes
+    ----------
+    labels: dict
+        Labels of the session, e.g. name, model, chrono
+    events: [ dict ]
+        The events, each with its `phase', `seconds' and fields, e.g.
+        `prompt_tokens', `response_tokens' and `ttft' (seconds to the
+        first token) of a retrieval
+    latency: { str : Histogram }
+        Durations of the events of each phase
+
+    Methods
+    -------
+    record( phase: str, seconds: float, **fields )
+        Adds an event.
+
+    record_usage( phase: str, seconds: float, usage: dict, **fields )
+        Adds an event with the token `usage' of a response, see
+        `tulvingbackend.Backend'.
+
+    timer( phase: str, **fields )
+        Context manager recording an event of the duration of its block;
+        fields may be added to the yielded dict.
+
+    histograms( phase: str, *fields )
+        Histograms of the durations of the `phase' events, by values
+        of their `fields', e.g. `cue_type' and `row'.
+
+    summary()
+        Per phase: count, total, mean and max seconds, percentiles, and
+        where known, the token counts, mean time to first token, and
+        decoding rate in tokens per second.
+
+    prometheus()
+        The summary in the Prometheus text format.
+
+    export( path: str )
+        Writes the Prometheus text to a `.prom' file, or else appends
+        the events, the summary and the retrieval percentiles by
+        `BREAKDOWN' fields, as JSONL records.
+    """
+
+    def __init__( self, **labels ):
+        self.labels  = labels
+        self.events  = []
+        self.latency = {}
+
+
+    def record( self, phase, seconds, **fields ):
+        self.events.append( dict( fields, phase=phase, seconds=seconds ) )
+        self.latency.setdefault( phase, Histogram() ).record( seconds )
+
+
+    def record_usage( self, phase, seconds, usage, **fields ):
+        self.record( phase, seconds, **dict( { 'prompt_tokens'   : usage.get( 'prompt_tokens' ),
+                                               'response_tokens' : usage.get( 'response_tokens' ),
+                                               'ttft'            : usage.get( 'ttft' ),
+                                               'cached'          : bool( usage.get( 'cached' ) ) }, **fields ) )
+
+
+    @contextlib.contextmanager
+    def timer( self, phase, **fields ):
+        tbeg = timeit.default_timer()
+        try:
+            yield fields
+        finally:
+            self.record( phase, timeit.default_timer() - tbeg, **fields )
+
+
+    def histograms( self, phase, *fields ):
+        histograms = {}
+        for e in self.events:
+            if phase == e['phase']:
+                key = tuple( e.get( field ) for field in fields )
+                histograms.setdefault( key if len( fields ) > 1 else key[0], Histogram() ).record( e['seconds'] )
+        return histograms
+
+
+    def summary( self ):
+        summary = {}
+        for phase in PHASES + sorted( { e['phase'] for e in self.events } - set( PHASES ) ):
+            events = [ e for e in self.events if phase == e['phase'] ]
+            if not events:
+                continue
+            seconds = [ e['seconds'] for e in events ]
+            stats   = { 'count'   : len( events ),
+                        'seconds' : sum( seconds ),
+                        'mean'    : sum( seconds ) / len( events ),
+                        'max'     : max( seconds ) }
+            if phase in self.latency:
+                stats.update( self.latency[ phase ].percentiles() )
+            for key in [ 'prompt_tokens', 'response_tokens' ]:
+                values = [ e[ key ] for e in events if e.get( key ) is not None ]
+                if values:
+                    stats[ key ] = sum( values )
+            # Decoding, after the first token
+            timed = [ e for e in events if e.get( 'ttft' ) is not None and e.get( 'response_tokens' ) ]
+            if timed:
+                stats[ 'ttft' ] = sum( e['ttft'] for e in timed ) / len( timed )
+                decode          = sum( e['seconds'] - e['ttft'] for e in timed )
+                decoded         = sum( e['response_tokens'] - 1 for e in timed )
+                if decode > 0 and decoded > 0:
+                    stats[ 'tokens_per_second' ] = decoded / decode
+            summary[ phase ] = stats
+        return summary
+
+
+    def prometheus( self ):
+        def labels( **extra ):
+            items = dict( self.labels, **extra )
+            return '{' + ','.join( '{}="{}"'.format( k, str( v ).replace( '\\', '\\\\' ).replace( '"', '\\"' ) )
+                                   for k, v in items.items() ) + '}'
+
+        lines = [ '# HELP tulving_phase_seconds Time spent in each phase of a session.',
+                  '# TYPE tulving_phase_seconds summary' ]
+        summary = self.summary()
+        for phase, stats in summary.items():
+            lines += [ f'tulving_phase_seconds{labels( phase=phase, quantile=p / 100 )} {stats[ f"p{p:g}" ]:.6f}'
+                       for p in PERCENTILES if stats.get( f'p{p:g}' ) is not None ]
+            lines += [ f'tulving_phase_seconds_sum{labels( phase=phase )} {stats["seconds"]:.6f}',
+                       f'tulving_phase_seconds_count{labels( phase=phase )} {stats["count"]}' ]
+        lines += [ '# HELP tulving_tokens_total Prompt and response tokens of each phase.',
+                   '# TYPE tulving_tokens_total counter' ]
+        for phase, stats in summary.items():
+            for kind in [ 'prompt', 'response' ]:
+                if f'{kind}_tokens' in stats:
+                    lines += [ f'tulving_tokens_total{labels( phase=phase, kind=kind )} {stats[ f"{kind}_tokens" ]}' ]
+        for name, key, help in [ ( 'tulving_ttft_seconds', 'ttft', 'Mean time to the first response token.' ),
+                                 ( 'tulving_tokens_per_second', 'tokens_per_second', 'Decoding rate of the responses.' ) ]:
+            lines += [ f'# HELP {name} {help}', f'# TYPE {name} gauge' ]
+            lines += [ f'{name}{labels( phase=phase )} {stats[ key ]:.6f}'
+                       for phase, stats in summary.items() if key in stats ]
+        return '\n'.join( lines ) + '\n'
+
+
+    def export( self, path ):
+        if path.endswith( '.prom' ):
+            # Replaced atomically, as read by the Prometheus textfile collector
+            with open( path + '.tmp', 'w', encoding='utf-8' ) as f:
+                f.write( self.prometheus() )
+            os.replace( path + '.tmp', path )
+            return
+        with open( path, 'a', encoding='utf-8' ) as f:
+            stamp = time.time()
+            for event in self.events:
+                f.write( json.dumps( dict( self.labels, **event ) ) + '\n' )
+            f.write( json.dumps( dict( self.labels, phase='summary', time=stamp, summary=self.summary() ) ) + '\n' )
+            for field in BREAKDOWN:
+                report = { str( key ) : dict( histogram.percentiles(), count=histogram.count, max=histogram.max )
+                           for key, histogram in self.histograms( 'retrieval', field ).items() if key is not None }
+                if report:
+                    f.write( json.dumps( dict( self.labels, phase='latency', time=stamp, by=field,
+                                               latency=report ) ) + '\n' )
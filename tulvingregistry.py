@@ -0,0 +1,120 @@
+# tulvingregistry.py -- Local registry of the models used by the Tulving tests
+# Resolves model ids from a cached manifest, keeping the network out of
+# the prompts: `llm' plugins otherwise re-download `models2.json' when
+# a model is instantiated, which then counts in the reported latency.
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+#
+import llm
+
+MANIFEST_URL = "https://gpt4all.io/models/models3.json"
+# Same directory as `llm-gpt4all' and `gpt4all'
+MODEL_DIR    = Path.home() / ".cache" / "gpt4all"
+MANIFEST     = MODEL_DIR / "tulving_models.json"
+# Time-to-live of the cached manifest, in seconds
+TTL          = 7*24*3600
+# Connect timeout when refreshing the manifest, in seconds
+TIMEOUT      = 5.
+# Strict offline mode: never touch the network, fail fast instead
+OFFLINE      = os.environ.get( 'TULVING_OFFLINE', '' ) not in [ '', '0' ]
+
+
+class RegistryError( Exception ):
+    pass
+
+
+def refresh( url=MANIFEST_URL, path=MANIFEST, timeout=TIMEOUT ):
+    """Downloads the model manifest to `path' and returns its entries.
+
+    This is the only network access of the registry. Raises
+    `RegistryError' if the manifest cannot be downloaded or stored.
+    """
+    if OFFLINE:
+        raise RegistryError( f'Offline: cannot refresh manifest from {url}' )
+    try:
+        import httpx
+    except ImportError as e:
+        raise RegistryError( f'Cannot refresh manifest from {url}: {e}' ) from e
+    try:
+        response = httpx.get( url, follow_redirects=True, timeout=timeout )
+        response.raise_for_status()
+        entries  = response.json()
+        #
+        path = Path( path )
+        path.parent.mkdir( parents=True, exist_ok=True )
+        tmp  = path.with_suffix( '.tmp' )
+        with open( tmp, 'w' ) as f:
+            json.dump( entries, f )
+        os.replace( tmp, path )
+    except ( httpx.HTTPError, ValueError, OSError ) as e:
+        raise RegistryError( f'Cannot refresh manifest from {url}: {e}' ) from e
+    logging.info( f'Manifest {path} refreshed from {url}' )
+    return entries
+
+
+def load_manifest( path=MANIFEST, ttl=TTL ):
+    """Returns the manifest entries, from the cache when fresh.
+
+    A stale manifest is refreshed except in offline mode, or if the
+    refresh fails, where the stale copy is used.
+    """
+    path = Path( path )
+    if path.is_file():
+        with open( path ) as f:
+            entries = json.load( f )
+        age = time.time() - path.stat().st_mtime
+        if age < ttl:
+            return entries
+        if OFFLINE:
+            logging.warning( f'Manifest {path} is stale ({age/3600:.0f}h), offline' )
+            return entries
+        try:
+            return refresh( path=path )
+        except RegistryError as e:
+            logging.warning( f'Manifest {path} is stale ({age/3600:.0f}h), refresh failed: {e}' )
+            return entries
+    if OFFLINE:
+        raise RegistryError( f'Offline: no manifest at {path}, run `python tulvingregistry.py --refresh\' first' )
+    return refresh( path=path )
+
+
+def resolve( model_id, path=MANIFEST ):
+    """Returns the manifest details of `model_id', a file name without extension."""
+    for details in load_manifest( path ):
+        if details['filename'].split( '.' )[0] == model_id:
+            if not (MODEL_DIR / details['filename']).exists():
+                raise RegistryError( f'Model {model_id} is not installed in {MODEL_DIR}' )
+            return details
+    raise RegistryError( f'Model {model_id} is not in manifest {path}' )
+
+
+def get_model( model_id ):
+    """Returns the `llm' model for `model_id', in lieu of `llm.get_model'.
+
+    Local gpt4all models are instantiated from the manifest, bypassing
+    `llm' plugin registration. Other models go through `llm', except in
+    offline mode.
+    """
+    try:
+        import llm_gpt4all
+        return llm_gpt4all.Gpt4AllModel( resolve( model_id ) )
+    except (ImportError, RegistryError) as e:
+        if OFFLINE:
+            raise RegistryError( f'Offline: cannot resolve model {model_id}' ) from e
+    return llm.get_model( model_id )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( prog="tulvingregistry",
+                                      description="Local registry of models for Tulving Tests." )
+    parser.add_argument( '-r', '--refresh', action='store_true', help='Download the model manifest' )
+    args = parser.parse_args()
+    #
+    entries = refresh() if args.refresh else load_manifest()
+    for details in entries:
+        installed = ' (installed)' if (MODEL_DIR / details['filename']).exists() else ''
+        print( '{}{}'.format( details['filename'].split( '.' )[0], installed ) )
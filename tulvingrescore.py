@@ -0,0 +1,144 @@
+# tulvingrescore.py -- Re-scoring stored responses without the models
+# Applies a scoring rule to the responses of result files, or of a
+# dataset, vectorized over the response column of all sessions at once,
+# and writes the new scores next to the stored ones.
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+#
+import tulvingdata as td
+import tulvingscore as ts
+
+# Study list of each task: recognition and recall share the list to memorize
+STUDY = { 'reco' : 'tbr', 'reca' : 'tbr', 'ord' : 'ord', 'tw' : 'tw' }
+
+
+def found( df, words ):
+    """The `words' found in each response of `df', by `tulvingscore.Matcher',
+    as a series of lowercase words indexed by the row labels of `df'.
+    """
+    matcher = ts.Matcher( words )
+    if matcher.regex is None:
+        return pd.Series( [], index=df.index[ :0 ], dtype=object )
+    return df[ 'response' ].fillna( '' ).astype( object ).str.findall( matcher.regex ).explode().dropna().str.lower()
+
+
+def any_by_row( df, hits ):
+    "Whether any of the boolean `hits', indexed by row labels, holds for each row of `df'."
+    return hits.groupby( level=0 ).any().reindex( df.index, fill_value=False ).to_numpy( dtype=bool )
+
+
+def targets( df ):
+    """Lowercase target word of each row: the first word of `tbrword', which
+    may hold several encodings (TW test), `none' for distractors.
+    """
+    return df[ 'tbrword' ].astype( object ).str.extract( r'([^\W\d_][\w-]*)', expand=False ).fillna( 'none' ).str.lower()
+
+
+def study_lists( df ):
+    """Study list of each task of `df', as the sorted target words of all
+    the sessions of the tasks sharing its list to memorize, see `STUDY'.
+    """
+    answer = targets( df )
+    keep   = answer != 'none'
+    groups = df.loc[ keep, 'task' ].astype( object ).map( STUDY )
+    words  = answer[ keep ].groupby( groups.to_numpy() ).unique()
+    return { task : sorted( words.get( group, [] ) ) for task, group in STUDY.items() }
+
+
+def rule_reco( df, study=None ):
+    """Recognition, as `protocol_reco_match': a Yes after the start and no
+    No for a copy cue, the reverse for other cues; false positives are
+    the Yes answers.
+    """
+    resp   = df[ 'response' ].fillna( '' ).astype( object )
+    y, n   = resp.str.find( 'Yes' ).to_numpy(), resp.str.find( 'No' ).to_numpy()
+    copy   = ( df[ 'tbrword' ] == df[ 'cue' ] ).fillna( False ).to_numpy( dtype=bool )
+    yes    = ( y > 0 ) & ( n < 0 )
+    return ( yes & copy ) | ( ( y < 0 ) & ( n > 0 ) & ~copy ), yes
+
+
+def rule_reco_words( df, study=None ):
+    """Recognition on whole words, case insensitive, wherever in the
+    response: one of YES or NO, as expected for the cue.
+    """
+    words  = found( df, [ 'yes', 'no' ] )
+    yes    = any_by_row( df, words == 'yes' )
+    no     = any_by_row( df, words == 'no' )
+    copy   = ( df[ 'tbrword' ] == df[ 'cue' ] ).fillna( False ).to_numpy( dtype=bool )
+    return ( yes & ~no & copy ) | ( no & ~yes & ~copy ), yes & ~no
+
+
+def rule_recall( df, study=None ):
+    """Recall, on whole words: the response holds the target word, or
+    None for distractors; false positives are responses holding any word
+    of the `study' list, as `protocol_reca_match( false_positives=False )',
+    so that a correct recall counts as a false positive too.
+    """
+    answer = targets( df )
+    words  = found( df, set( answer.unique() ) | set( study or [] ) )
+    hits   = pd.Series( words.to_numpy() == answer.loc[ words.index ].to_numpy(), index=words.index )
+    return any_by_row( df, hits ), any_by_row( df, words.isin( study or [] ) )
+
+
+def rule_recall_only( df, study=None ):
+    """Recall as `rule_recall', without false positives, as the ordering
+    and TW tests which do not score in-list responses.
+    """
+    return rule_recall( df )[0], np.zeros( len( df ), dtype=bool )
+
+
+RULES = { 'reco'       : rule_reco,
+          'reco_words' : rule_reco_words,
+          'reca'       : rule_recall,
+          'ord'        : rule_recall_only,
+          'tw'         : rule_recall_only }
+
+
+def rescore( df, rule=None, name='new', study=None ):
+    """Adds the `result_{name}' and `fp_{name}' scores of `rule' to the
+    results `df'; by default each task has the rule of its name.
+
+    `study' maps each task to its study list, by default `study_lists'
+    of `df': filtering the sessions of `df' may shorten the lists.
+    """
+    study      = study or study_lists( df )
+    result, fp = np.zeros( len( df ), dtype=bool ), np.zeros( len( df ), dtype=bool )
+    tasks      = df[ 'task' ].astype( object ).to_numpy()
+    for task in pd.unique( tasks ):
+        sel                    = tasks == task
+        result[ sel ], fp[ sel ] = RULES[ rule or task ]( df[ sel ], study.get( task ) )
+    return df.assign( **{ f'result_{name}' : result.astype( 'int8' ), f'fp_{name}' : fp.astype( 'int8' ) } )
+
+
+def summary( df, name='new' ):
+    "Mean stored and new scores by task, chronology, model and cue type."
+    return df.groupby( [ 'task', 'chrono', 'model', 'cue_type' ], observed=True )[
+        [ 'result', f'result_{name}', 'fp', f'fp_{name}' ] ].mean()
+
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO )
+    parser = argparse.ArgumentParser( prog="tulvingrescore",
+                                      description="Re-scores stored Tulving Test responses." )
+    parser.add_argument( 'source', help='Dataset, or directory of the result files' )
+    parser.add_argument( '-r', '--rule', choices=list( RULES ), help='Scoring rule (default: by task)' )
+    parser.add_argument( '-n', '--name', default='new', help='Suffix of the new score columns' )
+    parser.add_argument( '-t', '--tasks', nargs='+', choices=[ 'reco', 'reca', 'ord', 'tw' ] )
+    parser.add_argument( '-c', '--chronos', nargs='+', choices=[ 'imm', 'del' ] )
+    parser.add_argument( '-m', '--models', nargs='+' )
+    parser.add_argument( '-s', '--sessions', type=int, nargs='+', help='Session number(s)' )
+    parser.add_argument( '-o', '--output', help='Rescored results, .csv or .parquet (default: summary only)' )
+    args = parser.parse_args()
+    #
+    df = td.results( args.source, task=args.tasks, chrono=args.chronos, model=args.models, session=args.sessions )
+    # Study lists of all the sessions of the source, whatever the filters
+    df = rescore( df, args.rule, args.name, study_lists( td.results( args.source, columns=[ 'tbrword' ] ) ) )
+    if args.output:
+        if args.output.endswith( '.parquet' ):
+            df.to_parquet( args.output, index=False )
+        else:
+            df.to_csv( args.output, index=False )
+    pd.set_option( "display.precision", 2 )
+    print( summary( df, args.name ) )
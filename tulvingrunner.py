@@ -0,0 +1,176 @@
+# tulvingrunner.py -- Running many independent Tulving Test sessions in parallel
+# Fans sessions out on a process pool, each process owning one model
+# instance, instead of hand-launching `tulving_session.bat' per session.
+import argparse
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+import numpy as np
+#
+import tulvingbackend as tb
+import tulvingregistry as tr
+import tulvingsink as tsk
+from tulvingmem import TulvingTest
+from tulving import cues
+import tulving_test
+import tulving_test_imm
+import tulving_test_del_order
+import tulving_test_imm_order
+
+TASKS   = [ 'reco', 'reca', 'ord' ]
+CHRONOS = [ 'imm', 'del' ]
+# See README.md, Data Repository; `fmt' is csv or parquet
+TEMPL_MERGE = "merge_{task}_{chrono}_{model}_session_{session}.{fmt}"
+# Probes per session in recognition and recall tasks
+SESSION_SIZE = 32
+
+# Per-process state, set by `init_process'
+MODEL, BACKEND = None, None
+
+
+def pool_size( model_nn, ram_gb=None ):
+    """Number of processes for `model_nn', bounded by cores and available RAM."""
+    size = os.cpu_count() or 1
+    if ram_gb is None:
+        try:
+            ram_gb = float( tr.resolve( TulvingTest.MODELS[ model_nn ] )['ramrequired'] )
+        except (tr.RegistryError, KeyError, ValueError):
+            pass
+    avail = available_ram()
+    if ram_gb and avail:
+        size = min( size, int( avail // (ram_gb * 2**30) ) )
+    return max( 1, size )
+
+
+def available_ram():
+    "Available RAM in bytes, or None if unknown."
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf( 'SC_AVPHYS_PAGES' ) * os.sysconf( 'SC_PAGE_SIZE' )
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def init_process( model_nn, n_threads, warmup=False ):
+    "Loads the model once per pool process, and with `warmup' sends it a discarded first prompt."
+    global MODEL, BACKEND
+    MODEL   = model_nn
+    BACKEND = tb.get_backend( tr.get_model( TulvingTest.MODELS[ model_nn ] ), n_threads=n_threads )
+    BACKEND.load()
+    if warmup:
+        logging.info( f'Runner: {model_nn} warmed up in {tb.warm_up( BACKEND ):.3f}s' )
+
+
+def run_session( session, task, chrono, outdir, prefix_cache=False, batched=False, cache=False, fmt='csv',
+                 cuesheets=None, fit=False ):
+    """Runs one full session on the process model; returns the session file name.
+
+    The cue sheets are read from the `cuesheets' file written by `cues.py
+    -n', or else drawn from `cues.protocol_cuesheets' seeded by the
+    session id, so that all tasks of a session share the same sheets.
+    All blocks of the session are written to the same sink. With `fit',
+    delayed blocks hold as many cues as fit in the model context.
+    """
+    if cuesheets:
+        tbr, cso, csa = cues.read_cuesheets( cuesheets, session )
+    else:
+        np.random.seed( session )
+        cso, csa = cues.protocol_cuesheets()
+        tbr      = [ w for ( w, ncaw, ncrw ) in cues.TBR_WORDS ]
+    fn       = os.path.join( outdir, TEMPL_MERGE.format( task=task, chrono=chrono, model=MODEL, session=session, fmt=fmt ) )
+    if os.path.exists( fn ):
+        os.remove( fn )
+    # Comment lines of the test scripts are discarded
+    with tsk.open_sink( fn, tulving_test.COLUMNS ) as sink, redirect_stdout( io.StringIO() ):
+        if 'ord' == task:
+            mod = tulving_test_imm_order if 'imm' == chrono else tulving_test_del_order
+            if 'imm' == chrono:
+                mod.protocol_session( MODEL, tbr, prefix_cache=prefix_cache, backend=BACKEND, cache=cache, output=sink )
+            else:
+                mod.protocol_session( MODEL, tbr, backend=BACKEND, cache=cache, output=sink )
+        else:
+            mod  = tulving_test_imm if 'imm' == chrono else tulving_test
+            size = mod.BLOCKSIZE
+            if fit and 'del' == chrono:
+                size = mod.block_size( task, tbr, cso, csa, n_ctx=BACKEND.n_ctx,
+                                       count=tb.get_tokenizer( backend=BACKEND ) )
+            for beg in range( 0, SESSION_SIZE, size ):
+                if 'imm' == chrono:
+                    mod.protocol_session( MODEL, task, tbr, cso, csa, beg, prefix_cache=prefix_cache, backend=BACKEND,
+                                          batched=batched, cache=cache, output=sink )
+                else:
+                    mod.protocol_session( MODEL, task, tbr, cso, csa, beg, backend=BACKEND, cache=cache, output=sink,
+                                          size=size )
+    return fn
+
+
+def run( sessions, tasks, chronos, models, outdir, jobs=None, prefix_cache=False, batched=False, cache=False,
+         fmt='csv', cuesheets=None, fit=False, warmup=False ):
+    """Runs the matrix of `sessions' x `tasks' x `chronos' for each model in turn."""
+    failed = 0
+    for model_nn in models:
+        size      = jobs or pool_size( model_nn )
+        n_threads = max( 1, (os.cpu_count() or 1) // size )
+        logging.info( f'Runner: {model_nn} on {size} processes, {n_threads} threads each' )
+        with ProcessPoolExecutor( max_workers=size, initializer=init_process,
+                                  initargs=( model_nn, n_threads, warmup ) ) as pool:
+            futures = { pool.submit( run_session, ses, task, chrono, outdir, prefix_cache, batched, cache, fmt,
+                                         cuesheets, fit ) : ( ses, task, chrono )
+                        for ses in sessions for task in tasks for chrono in chronos }
+            for future in as_completed( futures ):
+                ses, task, chrono = futures[ future ]
+                try:
+                    logging.info( f'Runner: session {ses} {task} {chrono} {model_nn} done: {future.result()}' )
+                except Exception as e:
+                    failed += 1
+                    logging.error( f'Runner: session {ses} {task} {chrono} {model_nn} failed: {e}' )
+    return failed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        filename='tulvingmem.log',
+        encoding='utf-8',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser( prog="tulvingrunner",
+                                      description="Run Tulving Test sessions in parallel." )
+    parser.add_argument( 'first', type=int, help='First session id' )
+    parser.add_argument( 'last', type=int, help='Last session id (included)' )
+    parser.add_argument( '-t', '--tasks', nargs='+', default=TASKS, choices=TASKS )
+    parser.add_argument( '-c', '--chronos', nargs='+', default=CHRONOS, choices=CHRONOS )
+    parser.add_argument( '-m', '--models', nargs='+', default=[ 'mistral' ], choices=list( TulvingTest.MODELS ) )
+    parser.add_argument( '-o', '--outdir', default='.', help='Directory of the session files' )
+    parser.add_argument( '-f', '--format', default='csv', choices=[ 'csv', 'parquet' ] )
+    parser.add_argument( '-j', '--jobs', type=int, help='Number of processes (default: by cores and RAM)' )
+    parser.add_argument( '-p', '--prefix-cache',
+                         help="Evaluates the list to memorize once for all probes",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--batched',
+                         help="Generates the probes of a block in one batch, if the model supports it",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--cache', default=False,
+                         help="Replays and stores responses in the response cache, for deterministic decoding only",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--cuesheets',
+                         help="Cue sheets file of the sessions, written by `tulving/cues.py -n FIRST LAST'" )
+    parser.add_argument( '--fit',
+                         help="Holds as many cues per delayed conversation as fit in the model context",
+                         action=argparse.BooleanOptionalAction )
+    parser.add_argument( '--warmup',
+                         help="Sends a discarded first prompt to each loaded model, so that its cold start is not timed",
+                         action=argparse.BooleanOptionalAction )
+    args = parser.parse_args()
+    #
+    failed = run( range( args.first, args.last + 1 ), args.tasks, args.chronos, args.models,
+                  args.outdir, jobs=args.jobs, prefix_cache=bool( args.prefix_cache ),
+                  batched=bool( args.batched ), cache=args.cache, fmt=args.format,
+                  cuesheets=args.cuesheets, fit=bool( args.fit ), warmup=bool( args.warmup ) )
+    sys.exit( 1 if failed else 0 )
@@ -0,0 +1,77 @@
+# tulvingscore.py -- Compiled scoring of Tulving Test responses
+# The words looked for in responses, e.g. the study list, are compiled
+# once into a single regex, shaped as a trie of the words, so that all
+# the words of a response are found in one pass, whatever their number.
+import functools
+import re
+
+
+def trie_pattern( words ):
+    """Regex source matching any of `words', as a trie: words sharing a
+    prefix share its branch, longer words being tried first.
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for c in w:
+            node = node.setdefault( c, {} )
+        node[ '' ] = None
+
+    def pattern( node ):
+        alts = [ re.escape( c ) + pattern( child ) for c, child in sorted( node.items() ) if c ]
+        if not alts:
+            return ''
+        group = alts[0] if 1 == len( alts ) and '' not in node else '(?:{})'.format( '|'.join( alts ) )
+        return group + '?' if '' in node else group
+
+    return pattern( trie )
+
+
+
+class Matcher:
+    """Whole-word, case insensitive, matching of a set of words in texts.
+
+    A word matches where it is neither preceded nor followed by a word
+    character: `ant' is found in `An ant.' but not in `want' or `ants'.
+
+    Attributes
+    ----------
+    words: [ str ]
+        The words, lowercase
+
+    Methods
+    -------
+    findall( txt: str )
+        The distinct words found in `txt', lowercase, in order of first
+        occurrence.
+
+    search( txt: str )
+        The first word found in `txt', lowercase, or None.
+    """
+
+    def __init__( self, words ):
+        self.words = sorted( set( w.lower() for w in words if w ) )
+        self.regex = re.compile( r'(?<!\w)(?:{})(?!\w)'.format( trie_pattern( self.words ) ), re.IGNORECASE ) \
+            if self.words else None
+
+
+    def findall( self, txt ):
+        if self.regex is None or not txt:
+            return []
+        return list( dict.fromkeys( m.lower() for m in self.regex.findall( txt ) ) )
+
+
+    def search( self, txt ):
+        m = self.regex.search( txt ) if self.regex is not None and txt else None
+        return m.group().lower() if m else None
+
+
+    def __repr__( self ):
+        return f'Matcher({len( self.words )} words)'
+
+
+
+@functools.lru_cache( maxsize=256 )
+def matcher( words ):
+    "The `Matcher' of a tuple of `words', compiled once."
+    return Matcher( words )
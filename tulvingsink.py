@@ -0,0 +1,187 @@
+# tulvingsink.py -- Result sinks of the Tulving tests
+# Rows are buffered and written in batches by a background thread, as
+# CSV or as Parquet, keeping the response text as generated.
+import contextlib
+import csv
+import logging
+import os
+import sys
+import threading
+
+# Types of the result columns in Parquet, by lowercase name; others are strings
+TYPES = { 'tbrword'  : 'string',
+          'result'   : 'int8',
+          'fp'       : 'int8',
+          'inlist'   : 'int8',
+          'cue'      : 'string',
+          'response' : 'string',
+          'cue_type' : 'string',
+          'duration' : 'float32' }
+
+
+class ResultSink:
+    """Buffered writer of result rows.
+
+    Rows are tuples in the order of `columns'. They are written by a
+    background thread every `flush_rows' rows or `flush_interval'
+    seconds, and on `close'.
+
+    Methods
+    -------
+    write( row: tuple )
+        Buffers a row.
+
+    close()
+        Writes the buffered rows and closes the sink.
+    """
+
+    def __init__( self, columns, flush_rows=64, flush_interval=1. ):
+        self.columns        = list( columns )
+        self.flush_rows     = flush_rows
+        self.flush_interval = flush_interval
+        self.rows           = []
+        self.lock           = threading.Lock()
+        self.wakeup         = threading.Event()
+        self.closing        = False
+        self.error          = None
+        self.flusher        = threading.Thread( target=self.run, daemon=True )
+        self.flusher.start()
+
+
+    def write( self, row ):
+        if self.error:
+            raise self.error
+        with self.lock:
+            self.rows.append( tuple( row ) )
+            if len( self.rows ) >= self.flush_rows:
+                self.wakeup.set()
+
+
+    def run( self ):
+        while not self.closing:
+            self.wakeup.wait( self.flush_interval )
+            self.wakeup.clear()
+            self.flush()
+
+
+    def flush( self ):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            try:
+                self.write_rows( rows )
+            except Exception as e:
+                logging.error( f'Result sink: {e}' )
+                self.error = e
+
+
+    def write_rows( self, rows ):
+        raise NotImplementedError
+
+
+    def close( self ):
+        self.closing = True
+        self.wakeup.set()
+        self.flusher.join()
+        self.flush()
+        if self.error:
+            raise self.error
+
+
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, *exc ):
+        self.close()
+
+
+
+class CsvSink( ResultSink ):
+    """CSV file of results, in the dialect of the former printed rows:
+    `'` quotes strings, including the header, and numbers are bare.
+    Commas and quotes of responses are quoted, not stripped.
+
+    `path' is appended to, e.g. by successive blocks of a session, the
+    header being written to new files only; `None' writes to standard
+    output.
+    """
+
+    def __init__( self, path, columns, **kwargs ):
+        if path is None:
+            self.f, self.owned = sys.stdout, False
+        else:
+            self.f, self.owned = open( path, 'a', newline='', encoding='utf-8' ), True
+        self.writer = csv.writer( self.f, quotechar="'", quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n' )
+        if not self.owned or 0 == self.f.tell():
+            self.writer.writerow( columns )
+        super().__init__( columns, **kwargs )
+
+
+    def write_rows( self, rows ):
+        self.writer.writerows( rows )
+        self.f.flush()
+
+
+    def close( self ):
+        try:
+            super().close()
+        finally:
+            if self.owned:
+                self.f.close()
+
+
+
+class ParquetSink( ResultSink ):
+    """Parquet file of results, one row group per flush, typed by
+    `TYPES'. Requires `pyarrow'.
+
+    `path' is appended to as with `CsvSink': Parquet files cannot grow
+    in place, so the rows already in `path' are copied to a new file,
+    which replaces `path' on `close'.
+    """
+
+    def __init__( self, path, columns, **kwargs ):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path        = path
+        self.schema      = pyarrow.schema( [ ( c, getattr( pyarrow, TYPES.get( c.lower(), 'string' ) )() )
+                                             for c in columns ] )
+        self.writer      = pyarrow.parquet.ParquetWriter( path + '.tmp', self.schema )
+        if os.path.exists( path ):
+            self.writer.write_table( pyarrow.parquet.read_table( path ).select( self.schema.names ).cast( self.schema ) )
+        super().__init__( columns, **kwargs )
+
+
+    def write_rows( self, rows ):
+        self.writer.write_table( self.pa.Table.from_arrays( [ self.pa.array( col, type=field.type )
+                                                              for col, field in zip( zip( *rows ), self.schema ) ],
+                                                            schema=self.schema ) )
+
+
+    def close( self ):
+        try:
+            super().close()
+        finally:
+            self.writer.close()
+            os.replace( self.path + '.tmp', self.path )
+
+
+
+def open_sink( path, columns, **kwargs ):
+    """Returns the sink of `path' by extension, `.parquet' or CSV;
+    standard output if `path' is None.
+    """
+    if path is not None and '.parquet' == os.path.splitext( path )[1]:
+        return ParquetSink( path, columns, **kwargs )
+    return CsvSink( path, columns, **kwargs )
+
+
+def sink( output, columns ):
+    """Context manager of the sink of `output': an open `ResultSink',
+    left open, or else a path as for `open_sink', closed on exit.
+    """
+    if isinstance( output, ResultSink ):
+        return contextlib.nullcontext( output )
+    return open_sink( output, columns )
@@ -0,0 +1,79 @@
+# tulvingstats.py -- Bootstrap confidence intervals of Tulving Test results
+# Sessions are resampled with replacement, all resamples at once: each
+# resample is a row of session weights, so that the resampled statistics
+# of every cell are one matrix product.
+import numpy as np
+import pandas as pd
+from tulvingmetrics import PERCENTILES
+
+RESAMPLES  = 10000
+CONFIDENCE = .95
+
+
+def ci_labels( confidence=CONFIDENCE ):
+    "Column labels of the lower and upper bounds, e.g. `2.5%' and `97.5%'."
+    alpha = 100*(1 - confidence)/2
+    return f'{alpha:g}%', f'{100 - alpha:g}%'
+
+
+def resample_weights( nsessions, resamples=RESAMPLES, seed=None ):
+    """(resamples, nsessions) matrix of the number of draws of each session
+    in each resample.
+    """
+    rng  = np.random.default_rng( seed )
+    idx  = rng.integers( 0, nsessions, size=( resamples, nsessions ) )
+    idx += nsessions*np.arange( resamples )[ :, None ]
+    return np.bincount( idx.ravel(), minlength=resamples*nsessions ).reshape( resamples, nsessions ).astype( float )
+
+
+def bootstrap( sums, counts, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None ):
+    """Percentile intervals of the ratios `sums/counts' pooled over sessions.
+
+    `sums' and `counts' are arrays of shape (..., sessions), e.g. hits
+    and probes of each cue type in each session; returns the lower and
+    upper bounds, of shape (...).
+    """
+    sums, counts = np.asarray( sums, dtype=float ), np.asarray( counts, dtype=float )
+    weights      = resample_weights( sums.shape[ -1 ], resamples, seed )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        ratios   = ( sums @ weights.T ) / ( counts @ weights.T )
+    alpha        = (1 - confidence)/2
+    low, high    = np.nanquantile( ratios, [ alpha, 1 - alpha ], axis=-1 )
+    return low, high
+
+
+def session_sums( df, col, by=None ):
+    """Sums and counts of the non-missing `col' of `df' by `by' (a column,
+    or None) and session, as (groups, sessions) arrays, with the groups.
+    """
+    df     = df[ df[ col ].notna() ]
+    keys   = [ by, 'session' ] if by else [ 'session' ]
+    stats  = df.groupby( keys, observed=True )[ col ].agg( [ 'sum', 'count' ] )
+    if by is None:
+        return stats[ 'sum' ].to_numpy( dtype=float )[ None ], stats[ 'count' ].to_numpy( dtype=float )[ None ], [ None ]
+    sums   = stats[ 'sum' ].unstack( 'session', fill_value=0 )
+    counts = stats[ 'count' ].unstack( 'session', fill_value=0 )
+    return sums.to_numpy( dtype=float ), counts.to_numpy( dtype=float ), list( sums.index )
+
+
+def mean_ci( df, col, by=None, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None ):
+    """Mean of `col' by `by' with its bootstrap interval over sessions, as
+    a frame of columns `col', lower and upper bound.
+    """
+    sums, counts, groups = session_sums( df, col, by )
+    low, high            = bootstrap( sums, counts, resamples, confidence, seed )
+    lo, hi               = ci_labels( confidence )
+    return pd.DataFrame( { col: sums.sum( axis=-1 )/counts.sum( axis=-1 ), lo: low, hi: high },
+                         index=pd.Index( groups, name=by ) )
+
+
+def latency_table( df, by, percentiles=PERCENTILES ):
+    """Count, percentiles and maximum of the `duration' (microseconds) of
+    the results `df' by the `by' columns, in milliseconds.
+    """
+    df    = df[ df[ 'duration' ].notna() ]
+    ms    = df[ 'duration' ].astype( float ) / 1000
+    group = ms.groupby( [ df[ key ] for key in by ], observed=True )
+    table = group.quantile( [ p/100 for p in percentiles ] ).unstack()
+    table.columns = [ f'p{p:g}' for p in percentiles ]
+    return pd.concat( [ group.count().rename( 'count' ), table, group.max().rename( 'max' ) ], axis=1 )
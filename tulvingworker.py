@@ -0,0 +1,170 @@
+# tulvingworker.py -- Long-lived model worker for the Tulving tests
+# Loads each model once, then runs session jobs sent by the test scripts
+# over a local socket, instead of one model load per script run.
+import argparse
+import importlib
+import io
+import logging
+import os
+import secrets
+import sys
+import traceback
+from contextlib import redirect_stdout
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+#
+import tulvingbackend as tb
+import tulvingregistry as tr
+from tulvingmem import TulvingTest
+
+ADDRESS = ( 'localhost', int( os.environ.get( 'TULVING_WORKER_PORT', 6083 ) ) )
+# Authentication key of the worker, written by `serve' unless set here,
+# readable by its user only
+KEYFILE = os.environ.get( 'TULVING_WORKER_KEYFILE',
+                          os.path.join( os.path.expanduser( '~' ), '.cache', 'tulving', 'worker.key' ) )
+# Modules whose session functions may be run by the worker
+MODULES = [ 'tulvinglib', 'tulving_test', 'tulving_test_imm', 'tulving_test_del_order', 'tulving_test_imm_order' ]
+# Keyword arguments of the jobs which are file paths, resolved by the client
+PATHS   = [ 'output', 'metrics', 'journal' ]
+
+
+class WorkerError( Exception ):
+    pass
+
+
+def authkey():
+    """Key of the worker: `TULVING_WORKER_KEY', or else the key of the
+    `KEYFILE' written by `serve'; None if there is neither.
+    """
+    if os.environ.get( 'TULVING_WORKER_KEY' ):
+        return os.environ[ 'TULVING_WORKER_KEY' ].encode()
+    try:
+        with open( KEYFILE, 'rb' ) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def new_authkey():
+    "Writes a random key to `KEYFILE', readable by its user only, and returns it."
+    key = secrets.token_hex( 32 ).encode()
+    os.makedirs( os.path.dirname( KEYFILE ), exist_ok=True )
+    fd  = os.open( KEYFILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 )
+    with os.fdopen( fd, 'wb' ) as f:
+        # Also if the file already existed with other permissions
+        os.chmod( KEYFILE, 0o600 )
+        f.write( key )
+    return key
+
+
+def serve( models, address=ADDRESS ):
+    """Loads `models' and runs jobs until a `None' job is received.
+
+    A job is a dict( module, function, model, args, kwargs ); the function
+    is called with the loaded backend of `model' as keyword `backend', and
+    its standard output is sent back to the client. Clients authenticate
+    with `TULVING_WORKER_KEY', or else with a new random key written to
+    `KEYFILE', removed when the worker stops.
+    """
+    backends = {}
+    for model_nn in models:
+        backends[ model_nn ] = tb.get_backend( tr.get_model( TulvingTest.MODELS[ model_nn ] ) )
+        backends[ model_nn ].load()
+        logging.info( f'Worker: model {model_nn} loaded' )
+    #
+    key = None if os.environ.get( 'TULVING_WORKER_KEY' ) else new_authkey()
+    try:
+        listen( backends, address, key or authkey() )
+    finally:
+        if key is not None and os.path.exists( KEYFILE ):
+            os.remove( KEYFILE )
+    logging.info( 'Worker: stopped' )
+
+
+def listen( backends, address, key ):
+    "Runs the jobs of the clients authenticated by `key' on the loaded `backends'."
+    with Listener( address, authkey=key ) as listener:
+        logging.info( f'Worker: listening on {address}' )
+        while True:
+            try:
+                conn = listener.accept()
+            except ( AuthenticationError, EOFError, OSError ) as e:
+                logging.warning( f'Worker: connection refused: {e}' )
+                continue
+            with conn:
+                job = conn.recv()
+                if job is None:
+                    conn.send( ( 'ok', '' ) )
+                    break
+                try:
+                    if job['module'] not in MODULES:
+                        raise WorkerError( f"Unknown module {job['module']}" )
+                    if job['model'] not in backends:
+                        raise WorkerError( f"Model {job['model']} is not loaded" )
+                    fn  = getattr( importlib.import_module( job['module'] ), job['function'] )
+                    out = io.StringIO()
+                    with redirect_stdout( out ):
+                        fn( *job['args'], backend=backends[ job['model'] ], **job['kwargs'] )
+                    conn.send( ( 'ok', out.getvalue() ) )
+                except Exception:
+                    conn.send( ( 'error', traceback.format_exc() ) )
+
+
+def submit( module, function, model_nn, *args, **kwargs ):
+    """Sends a job to the worker and returns its standard output.
+
+    File paths of the job (`PATHS') are made absolute, so that they are
+    those of the client, not of the worker working directory. Raises
+    `ConnectionRefusedError' if no worker key is found.
+    """
+    key = authkey()
+    if key is None:
+        raise ConnectionRefusedError( f'No worker key {KEYFILE}' )
+    kwargs = { name : os.path.abspath( value ) if name in PATHS and isinstance( value, str ) else value
+               for name, value in kwargs.items() }
+    job = { 'module' : module, 'function' : function, 'model' : model_nn,
+            'args'   : args,   'kwargs'   : kwargs }
+    with Client( ADDRESS, authkey=key ) as conn:
+        conn.send( job )
+        status, out = conn.recv()
+    if 'error' == status:
+        raise WorkerError( out )
+    return out
+
+
+def run( module, function, model_nn, *args, **kwargs ):
+    """Runs a job on the worker if one is listening, else in-process.
+
+    Either way the output of the job goes to standard output.
+    """
+    try:
+        out = submit( module, function, model_nn, *args, **kwargs )
+    except ConnectionRefusedError:
+        logging.info( f'No worker on {ADDRESS}, running {module}.{function} in-process' )
+        fn = getattr( importlib.import_module( module ), function )
+        fn( *args, **kwargs )
+        return
+    sys.stdout.write( out )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        filename='tulvingmem.log',
+        encoding='utf-8',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser( prog="tulvingworker",
+                                      description="Long-lived model worker for Tulving Tests." )
+    parser.add_argument( '-m', '--models', nargs='+', default=list( TulvingTest.MODELS ),
+                         choices=list( TulvingTest.MODELS ) )
+    parser.add_argument( '-s', '--stop', action='store_true', help='Stop the running worker' )
+    args = parser.parse_args()
+    #
+    if args.stop:
+        if authkey() is None:
+            parser.error( f'No worker key {KEYFILE}, nor TULVING_WORKER_KEY' )
+        with Client( ADDRESS, authkey=authkey() ) as conn:
+            conn.send( None )
+            conn.recv()
+    else:
+        serve( args.models )
@@ -6,6 +6,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import TulvingTabulator as tt
+import tulvingstats as tst
 
 # Results from the article 
 
@@ -28,6 +29,16 @@ def tab_summary( ttab, args ):
     print( f'** Sessions: {args.sessions}' )
     print( twres )
     print( twres.mean() )
+    if args.resamples:
+        # Cells as proportions of their row, i.e. of the pairs of an encoding/retrieval order
+        tables    = ttab.session_tables( args.sessions )
+        low, high = tst.bootstrap( tables.reshape( -1, 16 ).T,
+                                   np.repeat( tables.sum( axis=2 ), 4, axis=1 ).T, args.resamples )
+        lo, hi    = tst.ci_labels()
+        print( f'*** {lo} bound' )
+        print( pd.DataFrame( low.reshape( 4, 4 ), index=twres.index, columns=twres.columns ) )
+        print( f'*** {hi} bound' )
+        print( pd.DataFrame( high.reshape( 4, 4 ), index=twres.index, columns=twres.columns ) )
     print( '** Tulving-Watkins published results (1975)' )
     print( TW_RESULTS )
     print( TW_RESULTS.mean() )
@@ -41,26 +52,41 @@ def tab_summary( ttab, args ):
     plt.show()
 
 
-def trace_summary( sessions, encoding ):
-    print( f'* {encoding} encodings' )
-    dmXY, dmYX   = ttab.read_data_matrices_csv( sessions, encoding )
-    tm1, tm2     = ttab.trace_mat( dmXY, dmYX )
-    eqn61, eqn62 = tm1[1][1], tm2[1][1]
-    # print( '** Trace unadjusted' )
-    # print( pd.DataFrame( tm1 ) )
-    # print( '** Trace unadjusted' )
-    # print( pd.DataFrame( tm2) )
-    #
-    print( f'** Eqn. 6 LHS: {eqn61}' )
-    print( '*** Data' )
-    print( pd.DataFrame( dmXY ) )
-    print( '*** Trace' )
-    print( pd.DataFrame( tm1 ) )
-    print( f'** Eqn. 6 RHS: {eqn62}' )
-    print( '*** Data' )
-    print( pd.DataFrame( dmYX ) )
-    print( '*** Trace' )
-    print( pd.DataFrame( tm2 ) )
+def latency_summary( ttab, sessions ):
+    df = ttab.read_latencies( sessions )
+    print( f'* Latency (ms), sessions: {sessions}' )
+    print( '** By Cue Type' )
+    print( tst.latency_table( df, [ 'chrono', 'model', 'cue_type' ] ) )
+    print( '** By Position in Batch' )
+    print( tst.latency_table( df, [ 'chrono', 'model', 'position' ] ) )
+
+
+def trace_summary( sessions, encodings, per_session=False ):
+    # Data matrices of all encodings and sessions, traced in one call,
+    # pooled over the sessions first
+    dmXY, dmYX           = ttab.data_matrices( sessions, encodings )
+    dmXY                 = np.concatenate( [ dmXY.mean( axis=1, keepdims=True ), dmXY ], axis=1 )
+    dmYX                 = np.concatenate( [ dmYX.mean( axis=1, keepdims=True ), dmYX ], axis=1 )
+    tms1, tms2, eq6l, eq6r = ttab.trace_mats( dmXY, dmYX )
+    for e, encoding in enumerate( encodings ):
+        print( f'* {encoding} encodings' )
+        tm1, tm2     = tms1[ e, 0 ], tms2[ e, 0 ]
+        eqn61, eqn62 = tm1[1][1], tm2[1][1]
+        #
+        print( f'** Eqn. 6 LHS: {eqn61}' )
+        print( '*** Data' )
+        print( pd.DataFrame( dmXY[ e, 0 ] ) )
+        print( '*** Trace' )
+        print( pd.DataFrame( tm1 ) )
+        print( f'** Eqn. 6 RHS: {eqn62}' )
+        print( '*** Data' )
+        print( pd.DataFrame( dmYX[ e, 0 ] ) )
+        print( '*** Trace' )
+        print( pd.DataFrame( tm2 ) )
+        if per_session:
+            print( '** Sessions' )
+            print( pd.DataFrame( { 'xy': tms1[ e, 1:, 1, 1 ], 'LHS': eq6l[ e, 1: ], 'RHS': eq6r[ e, 1: ] },
+                                 index=pd.Index( list( dict.fromkeys( sessions ) ), name='Session' ) ) )
     
 
 if __name__ == '__main__':
@@ -70,14 +96,21 @@ if __name__ == '__main__':
                                       description="Tabulate Tulving-Watkins Test results." )
     parser.add_argument('sessions', metavar='N', type=int, nargs='+', help='Session number(s)')
     parser.add_argument('-s', '--summary', action='store_true', help='Tabulate summary of performance')
+    parser.add_argument('-e', '--encodings', nargs='+', choices=['all', 'A', 'R'], default=['all', 'A', 'R'],
+                        help='Encodings of the traces')
+    parser.add_argument('-p', '--per-session', action='store_true', help='Tabulate traces of each session')
+    parser.add_argument('-r', '--resamples', type=int, default=tst.RESAMPLES,
+                        help='Bootstrap resamples of the sessions for confidence intervals, 0 for none')
+    parser.add_argument('-m', '--model', help='Selects the model, all by default')
+    parser.add_argument('-l', '--latency', action='store_true', help='Tabulate latency percentiles of the probes')
     args  = parser.parse_args()
-    ttab  = tt.TulvingTabulator( "C:\\Users\\chauv\\Documents\\NEWNEWAI\\tulving\\output\\" )
+    ttab  = tt.TulvingTabulator( "C:\\Users\\chauv\\Documents\\NEWNEWAI\\tulving\\output\\", args.model )
     #
     if args.summary:
         tab_summary( ttab, args )
+    if args.latency:
+        latency_summary( ttab, args.sessions )
     #
-    trace_summary( args.sessions, "all" )
-    trace_summary( args.sessions, "A" )
-    trace_summary( args.sessions, "R" )
+    trace_summary( args.sessions, args.encodings, args.per_session )
 
 